@@ -0,0 +1,198 @@
+import argparse
+import math
+import os
+import time
+import uuid
+
+import numpy as np
+
+from scoring import batch_top_k, normalize_rows
+
+try:
+    import faiss
+except ImportError:  # faiss-cpu is only needed for the approximate backends
+    faiss = None
+
+ANN_KINDS = ("flat", "ivf", "hnsw")
+
+
+class AnnIndex:
+    """Approximate-nearest-neighbour index over normalized embeddings, backed by faiss."""
+
+    def __init__(self, kind="hnsw", nlist=None, nprobe=16, hnsw_m=32, ef_construction=200, ef_search=64):
+        if faiss is None:
+            raise ImportError("faiss-cpu is required for approximate retrieval. Install it with `pip install faiss-cpu`.")
+        if kind not in ANN_KINDS:
+            raise ValueError(f"Unknown ANN index kind: {kind}. Expected one of {', '.join(ANN_KINDS)}.")
+        self.kind = kind
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.index = None
+
+    def __len__(self):
+        return self.index.ntotal if self.index is not None else 0
+
+    def build(self, embeddings):
+        """Builds the index from a normalized float32 matrix; inner product then equals cosine similarity."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        count, dim = embeddings.shape
+
+        if self.kind == "flat":
+            index = faiss.IndexFlatIP(dim)
+        elif self.kind == "ivf":
+            nlist = self.nlist or max(1, min(count, int(4 * math.sqrt(count))))
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings)
+        else:
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.ef_construction
+
+        index.add(embeddings)
+        self.index = index
+        self.set_search_params(nprobe=self.nprobe, ef_search=self.ef_search)
+        return self
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Tunes the recall/latency trade-off: nprobe for IVF, efSearch for HNSW."""
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        if self.index is None:
+            return
+        if self.kind == "ivf":
+            self.index.nprobe = self.nprobe
+        elif self.kind == "hnsw":
+            self.index.hnsw.efSearch = self.ef_search
+
+    def search(self, query_vectors, k):
+        """Returns one (indices, scores) pair per normalized query, best first."""
+        queries = np.ascontiguousarray(np.atleast_2d(query_vectors), dtype=np.float32)
+        k = min(k, len(self))
+        if k <= 0:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in queries]
+        scores, indices = self.index.search(queries, k)
+        results = []
+        for row_indices, row_scores in zip(indices, scores):
+            # faiss pads with -1 when fewer than k neighbours were reached
+            found = row_indices >= 0
+            results.append((row_indices[found], row_scores[found]))
+        return results
+
+    def save(self, path):
+        # A temporary name per writer, so processes saving the same snapshot's index do not interleave
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        self.index = faiss.read_index(path)
+        self.set_search_params()
+        return self
+
+
+# Function to get the on-disk path of an ANN index inside a snapshot directory
+def ann_index_path(snapshot_dir, kind):
+    return os.path.join(snapshot_dir, f"ann_{kind}.faiss")
+
+
+def load_or_build_ann_index(embeddings, snapshot_dir, kind, version=None, **params):
+    """Loads the persisted ANN index for a snapshot, rebuilding it when missing or out of date."""
+    ann = AnnIndex(kind, **params)
+    path = ann_index_path(snapshot_dir, kind) if snapshot_dir else None
+    if path and os.path.exists(path):
+        saved_version = None
+        if os.path.exists(path + ".version"):
+            with open(path + ".version", "r", encoding="utf-8") as f:
+                saved_version = f.read().strip()
+        ann.load(path)
+        if len(ann) == embeddings.shape[0] and (version is None or saved_version == version):
+            return ann
+        print(f"ANN index {path} does not match the snapshot. Rebuilding...")
+
+    ann.build(embeddings)
+    if path:
+        ann.save(path)
+        if version is not None:
+            tmp_path = f"{path}.version.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(version)
+            os.replace(tmp_path, path + ".version")
+    return ann
+
+
+def recall_report(embeddings, queries, k=10, configs=None):
+    """Measures recall@k and per-query latency of each ANN configuration against exact search."""
+    if configs is None:
+        configs = [
+            ("flat", {}),
+            ("ivf", {"nprobe": 1}),
+            ("ivf", {"nprobe": 8}),
+            ("ivf", {"nprobe": 32}),
+            ("hnsw", {"ef_search": 16}),
+            ("hnsw", {"ef_search": 64}),
+            ("hnsw", {"ef_search": 256}),
+        ]
+
+    start = time.perf_counter()
+    exact = batch_top_k(embeddings, queries, k)
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+    rows = [{"kind": "exact", "params": "", "recall": 1.0, "latency_ms": exact_ms, "build_s": 0.0}]
+
+    built = {}
+    for kind, params in configs:
+        if kind not in built:
+            start = time.perf_counter()
+            built[kind] = AnnIndex(kind).build(embeddings)
+            built[kind].build_seconds = time.perf_counter() - start
+        ann = built[kind]
+        ann.set_search_params(**params)
+
+        start = time.perf_counter()
+        approx = ann.search(queries, k)
+        latency_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+        hits = sum(len(set(a[0].tolist()) & set(e[0].tolist())) for a, e in zip(approx, exact))
+        recall = hits / float(sum(len(e[0]) for e in exact) or 1)
+        label = ", ".join(f"{key}={value}" for key, value in params.items())
+        rows.append({"kind": kind, "params": label, "recall": recall, "latency_ms": latency_ms, "build_s": ann.build_seconds})
+    return rows
+
+
+def print_recall_report(rows, k):
+    print(f"{'backend':<8} {'params':<16} {'recall@' + str(k):>10} {'ms/query':>10} {'build s':>9}")
+    for row in rows:
+        print(f"{row['kind']:<8} {row['params']:<16} {row['recall']:>10.3f} {row['latency_ms']:>10.3f} {row['build_s']:>9.2f}")
+
+
+def main():
+    from vector_index import VectorIndex
+
+    parser = argparse.ArgumentParser(description="Report ANN recall vs latency against exact search.")
+    parser.add_argument("snapshot_dir", nargs="?", help="Index snapshot to evaluate (default: random corpus)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--random-size", type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.snapshot_dir:
+        embeddings = np.asarray(VectorIndex.load(args.snapshot_dir).embeddings)
+    else:
+        embeddings = normalize_rows(rng.standard_normal((args.random_size, 384), dtype=np.float32))
+
+    # Queries are perturbed corpus vectors, which resembles real questions landing near stored chunks
+    picks = rng.choice(embeddings.shape[0], size=min(args.queries, embeddings.shape[0]), replace=False)
+    noise = rng.standard_normal((len(picks), embeddings.shape[1]), dtype=np.float32) * 0.05
+    queries = normalize_rows(embeddings[picks] + noise)
+
+    print(f"{embeddings.shape[0]} chunks x {embeddings.shape[1]} dims, {len(queries)} queries")
+    print_recall_report(recall_report(embeddings, queries, k=args.k), args.k)
+
+
+if __name__ == "__main__":
+    main()
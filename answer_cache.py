@@ -0,0 +1,166 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from scoring import normalize_rows
+
+
+class SemanticAnswerCache:
+    """Cache of chat answers keyed by question embedding.
+
+    A lookup hits when a stored question is at least `threshold` cosine-similar to the new one, the
+    entry is younger than `ttl` seconds and it was answered against the current corpus version.
+    Entries are persisted to a local JSON file so they survive restarts. Changes are written by a
+    background thread every `save_interval` seconds and at interpreter exit, never on the request path.
+    """
+
+    def __init__(self, path=None, threshold=0.92, ttl=24 * 3600, max_entries=1000, save_interval=30):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.corpus_version = None
+        self.entries = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        # Serializes writers of the file; held while writing so a slow disk never blocks lookups
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        if path and os.path.exists(path):
+            self._load()
+        if path:
+            self._thread = threading.Thread(target=self._run, name="answer-cache-save", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ignoring unreadable answer cache {self.path}: {e}")
+            return
+        self.corpus_version = data.get("corpus_version")
+        self.entries = data.get("entries", [])
+        vectors = [entry.pop("vector") for entry in self.entries]
+        self.vectors = np.asarray(vectors, dtype=np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def _mark_dirty(self):
+        # Called with _lock held; nothing is written here, the background thread or close() calls flush
+        self._dirty = True
+
+    def flush(self):
+        """Writes the cache to its file if it changed since the last write."""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = [dict(entry, vector=vector.tolist()) for entry, vector in zip(self.entries, self.vectors)]
+                data = {"corpus_version": self.corpus_version, "entries": entries}
+                self._dirty = False
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Error saving answer cache {self.path}: {e}")
+                with self._lock:
+                    self._dirty = True
+
+    def _run(self):
+        while not self._stop_event.wait(self.save_interval):
+            self.flush()
+
+    def close(self):
+        """Stops the background writer and writes any pending changes."""
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def _check_version(self, corpus_version):
+        # Answers were grounded in the old corpus, so a new snapshot invalidates all of them
+        if corpus_version != self.corpus_version:
+            self.entries = []
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+            self.corpus_version = corpus_version
+            return True
+        return False
+
+    def _expire(self):
+        now = time.time()
+        keep = [i for i, entry in enumerate(self.entries) if now - entry["created"] < self.ttl]
+        if len(keep) != len(self.entries):
+            self.entries = [self.entries[i] for i in keep]
+            self.vectors = self.vectors[keep] if keep else np.zeros((0, 0), dtype=np.float32)
+            return True
+        return False
+
+    def lookup(self, query_vector, corpus_version):
+        """Returns the cached answer for a similar question, or None on a miss."""
+        with self._lock:
+            changed = self._check_version(corpus_version)
+            changed = self._expire() or changed
+            if changed:
+                self._mark_dirty()
+
+            if len(self.entries):
+                scores = self.vectors @ normalize_rows(query_vector)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry = self.entries[best]
+                    self.hits += 1
+                    self.saved_seconds += entry.get("latency", 0.0)
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, question, query_vector, answer, corpus_version, latency=0.0):
+        """Caches an answer together with how long it took to generate."""
+        with self._lock:
+            self._check_version(corpus_version)
+            vector = normalize_rows(query_vector).reshape(1, -1)
+            self.entries.append({"question": question, "answer": answer, "created": time.time(), "latency": latency})
+            self.vectors = np.vstack([self.vectors, vector]) if len(self.vectors) else vector
+            if len(self.entries) > self.max_entries:
+                self.entries = self.entries[-self.max_entries:]
+                self.vectors = self.vectors[-self.max_entries:]
+            self._mark_dirty()
+
+    def invalidate(self):
+        with self._lock:
+            self.entries = []
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+            self._mark_dirty()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
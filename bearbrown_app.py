@@ -1,12 +1,15 @@
 import streamlit as st
 from sentence_transformers import SentenceTransformer
-from google.cloud import storage
-from google.oauth2 import service_account
-import numpy as np
-import json
 import os
-import concurrent.futures
+import time
 from openai import OpenAI
+from vector_index import load_or_build_index, retrieval_settings_from_env
+from index_sync import IndexSync
+import context_packer
+from chat_streaming import render_stream, stream_chat_completion
+from embedding_cache import EmbeddingCache
+from resources import gcs_credentials_from_secrets, registry
+from storage_backend import storage_from_env
 
 # Set Streamlit page configuration
 st.set_page_config(
@@ -18,81 +21,102 @@ st.set_page_config(
 # Display the title
 st.title("Bear Brown Co.")
 
-# Initialize SentenceTransformer model with GPU support
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-
-client = OpenAI(api_key=st.secrets["general"]["openai_api_key"])
-
-# Extract GCS credentials from Streamlit secrets
-gcs_credentials = {
-    "type": "service_account",
-    "project_id": st.secrets["gcs"]["project_id"],
-    "private_key_id": st.secrets["gcs"]["private_key_id"],
-    "private_key": st.secrets["gcs"]["private_key"].replace('\\n', '\n'),
-    "client_email": st.secrets["gcs"]["client_email"],
-    "client_id": st.secrets["gcs"]["client_id"],
-    "auth_uri": st.secrets["gcs"]["auth_uri"],
-    "token_uri": st.secrets["gcs"]["token_uri"],
-    "auth_provider_x509_cert_url": st.secrets["gcs"]["auth_provider_x509_cert_url"],
-    "client_x509_cert_url": st.secrets["gcs"]["client_x509_cert_url"]
-}
-
-# Initialize Google Cloud Storage client with credentials
-credentials = service_account.Credentials.from_service_account_info(gcs_credentials)
-storage_client = storage.Client(credentials=credentials)
 bucket_name = "bear_brown_co"
-bucket = storage_client.bucket(bucket_name)
 
-# Function to generate embeddings using SentenceTransformer
+# Local snapshot of the chunk corpus, memory-mapped once per process
+index_snapshot_dir = os.environ.get("VECTOR_INDEX_DIR", os.path.join("index_snapshots", bucket_name))
+
+# Storage is GCS with credentials from Streamlit secrets unless STORAGE_BACKEND selects local or in-memory storage
+def create_storage(name):
+    return storage_from_env(name, credentials_info=lambda: gcs_credentials_from_secrets(st.secrets))
+
+# The index is kept current by a background delta sync against the bucket
+def create_index_sync():
+    storage = registry.get("storage")
+    settings = retrieval_settings_from_env()
+    index = load_or_build_index(storage, index_snapshot_dir, **settings)
+    ann_params = {key: value for key, value in settings.items() if key != "backend"}
+    sync_interval = int(os.environ.get("INDEX_SYNC_INTERVAL", 300))
+    return IndexSync(storage, index, snapshot_dir=index_snapshot_dir, interval=sync_interval, ann_params=ann_params).start()
+
+# Function to fetch suggested questions
+def get_suggested_questions():
+    """Fetches suggested questions for the user."""
+    return [
+        "What are the main services offered by Bear Brown Co.?",
+        "How does Bear Brown Co. contribute to social impact?",
+        "Can you provide examples of technological innovations by Bear Brown Co.?"
+    ]
+
+# Query embeddings are cached; the suggested questions are embedded eagerly at startup
+def create_embedding_cache():
+    cache = EmbeddingCache(registry.get("embedding_model"))
+    cache.warm(get_suggested_questions())
+    return cache
+
+# Models and clients are built once per process and shared by every session and rerun
+registry.register("embedding_model", lambda: SentenceTransformer('all-MiniLM-L6-v2'), health_check=lambda model: len(model.encode("health check")) > 0)
+registry.register("openai_client", lambda: OpenAI(api_key=st.secrets["general"]["openai_api_key"]), health_check=lambda client: bool(client.api_key))
+registry.register("storage", lambda: create_storage(bucket_name), health_check=lambda storage: storage.health())
+registry.register("embedding_cache", create_embedding_cache)
+registry.register("index_sync", create_index_sync, health_check=lambda sync: len(sync.index) > 0)
+registry.warm_up()
+
+# Health checks run once per process, after warm-up, and are logged
+@st.cache_resource
+def check_resources():
+    return registry.report()
+
+resource_health = check_resources()
+
+embedding_cache = registry.get("embedding_cache")
+client = registry.get("openai_client")
+storage = registry.get("storage")
+
+def get_vector_index():
+    return registry.get("index_sync").index
+
+# Function to generate embeddings using SentenceTransformer, served from the LRU cache when possible
 def generate_embeddings(text):
     try:
-        return embedding_model.encode(text).tolist()
+        return embedding_cache.encode(text).tolist()
     except Exception as e:
         print(f"Error generating embeddings: {str(e)}")
         return None
 
-# Function to retrieve blobs from GCS with pagination
-def get_blobs_from_gcs_paginated():
-    blobs = []
-    blob_iterator = bucket.list_blobs()
-
-    for blob in blob_iterator:
-        blobs.append(blob)
+def search_similar_chunks(query, top_k=20):
+    """Searches the local vector index for chunks similar to the query; returns best-first (text, url, score) tuples."""
+    index = get_vector_index()
+    suggested_results = get_suggested_question_results(index.version, top_k)
+    if query in suggested_results:
+        return suggested_results[query]
 
-    return blobs
-
-# Function to download blob content
-def download_blob_content(blob):
-    try:
-        content = blob.download_as_text()
-        data = json.loads(content)
-        text = data.get("body_text", "")
-        embeddings = data.get("embeddings", [])
-        if text.strip() and embeddings:
-            return text, embeddings
-    except json.JSONDecodeError:
-        print(f"Skipping non-JSON blob: {blob.name}")
-    return None, None
-
-def search_similar_documents(query, top_k=5):
-    """Searches for documents in GCS that are similar to the query."""
     query_vector = generate_embeddings(query)
     if query_vector is None:
         return []
 
-    blobs = get_blobs_from_gcs_paginated()
-    similarities = []
+    return [(index.texts[i], index.urls[i], score) for i, score in index.search(query_vector, top_k)]
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(download_blob_content, blob) for blob in blobs]
-        for future in concurrent.futures.as_completed(futures):
-            text, embeddings = future.result()
-            if text and embeddings:
-                similarity = np.dot(query_vector, embeddings) / (np.linalg.norm(query_vector) * np.linalg.norm(embeddings))
-                similarities.append((text, similarity))
+def search_similar_documents(query, top_k=5):
+    """Searches the local vector index for documents that are similar to the query."""
+    return [text for text, _, _ in search_similar_chunks(query, top_k)]
 
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    return [text for text, _ in similarities[:top_k]]
+def search_similar_documents_batch(queries, top_k=20):
+    """Searches the local vector index for several queries with one batched scoring pass."""
+    try:
+        query_vectors = embedding_cache.encode_many(queries)
+    except Exception as e:
+        print(f"Error generating embeddings: {str(e)}")
+        return [[] for _ in queries]
+
+    index = get_vector_index()
+    return [[(index.texts[i], index.urls[i], score) for i, score in results] for results in index.search_batch(query_vectors, top_k)]
+
+# Results for the suggested questions are scored together once per index version
+@st.cache_resource
+def get_suggested_question_results(index_version, top_k):
+    questions = get_suggested_questions()
+    return dict(zip(questions, search_similar_documents_batch(questions, top_k)))
 
 def generate_prompt(query):
     """Generates a comprehensive prompt including contexts from similar documents."""
@@ -100,33 +124,42 @@ def generate_prompt(query):
     prompt_end = f"\n\nQuestion: {query}\nAnswer:"
     
     with st.spinner("Searching for similar documents..."):
-        similar_docs = search_similar_documents(query)
+        similar_chunks = search_similar_chunks(query)
 
-    # Compile contexts into a single prompt, respecting character limits
-    prompt = prompt_start
-    for doc in similar_docs:
-        if len(prompt + doc + prompt_end) < 3750:
-            prompt += "\n\n---\n\n" + doc
-        else:
-            break
-    prompt += prompt_end
+    # Fill the context with the best chunks that fit the token budget
+    context, _ = context_packer.pack_context(similar_chunks, context_token_budget, "gpt-3.5-turbo")
+    prompt = prompt_start + context + prompt_end
     return prompt
 
+def build_messages(prompt):
+    """Builds the messages payload for OpenAI from a structured prompt."""
+    return [
+        {"role": "system", "content":"You are an assistant that is an expert on Bear Brown Co. Provide in-depth answers to questions about the organization's mission, impact, and other related topics. Offer thorough explanations, detailed insights, and cover all relevant aspects to provide comprehensive responses. Include links to relevant resources if available. Ask follow-up questions to engage the user and provide specific examples."},
+        {"role": "user", "content": prompt}
+    ]
+
 def generate_openai_response(prompt, temperature=0.7):
     """Generates a response from OpenAI based on a structured prompt."""
     try:
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content":"You are an assistant that is an expert on Bear Brown Co. Provide in-depth answers to questions about the organization's mission, impact, and other related topics. Offer thorough explanations, detailed insights, and cover all relevant aspects to provide comprehensive responses. Include links to relevant resources if available. Ask follow-up questions to engage the user and provide specific examples."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=build_messages(prompt),
             temperature=temperature
         )
         return response.choices[0].message.content.strip()
     except Exception as e:
         return f"An error occurred: {str(e)}"
 
+def generate_openai_response_stream(prompt, temperature=0.7):
+    """Streams the response from OpenAI token by token."""
+    return stream_chat_completion(client, "gpt-3.5-turbo", build_messages(prompt), temperature)
+
+# Share of the model's context window given to retrieved documents
+context_token_budget = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 2000))
+
+# Stream answers into the chat as they are generated (set STREAM_RESPONSES=0 to wait for the full answer)
+stream_responses = os.environ.get("STREAM_RESPONSES", "1") != "0"
+
 # Function to introduce the bot
 def bot_introduction():
     return (
@@ -135,15 +168,6 @@ def bot_introduction():
         "innovation and our social impact initiatives."
     )
 
-# Function to fetch suggested questions
-def get_suggested_questions():
-    """Fetches suggested questions for the user."""
-    return [
-        "What are the main services offered by Bear Brown Co.?",
-        "How does Bear Brown Co. contribute to social impact?",
-        "Can you provide examples of technological innovations by Bear Brown Co.?"
-    ]
-
 # User input for chat
 user_input = st.chat_input("Ask me a question")
 
@@ -168,22 +192,32 @@ def clear_text_input():
     st.session_state.text_input = ''
 
 if user_input:
+    # Display chat messages from history
+    for message in st.session_state.message_history:
+        role = "user" if message["role"] == "user" else "assistant"
+        with st.chat_message(role):
+            st.markdown(message["content"])
+
     # Add user's message to history
     st.session_state.message_history.append({"role": "user", "content": user_input})
+    st.chat_message("user").markdown(user_input)
 
     final_prompt = generate_prompt(user_input)
-    
-    with st.spinner("Generating response..."):
-        bot_response = generate_openai_response(final_prompt)
-    
+
+    # Stream the answer into the chat as it is generated
+    with st.chat_message("assistant"):
+        start_time = time.time()
+        if stream_responses:
+            bot_response, timing = render_stream(generate_openai_response_stream(final_prompt), st.empty())
+        else:
+            with st.spinner("Generating response..."):
+                bot_response = generate_openai_response(final_prompt)
+            st.markdown(bot_response)
+            timing = {"time_to_first_token": time.time() - start_time, "total_time": time.time() - start_time}
+    print(f"Response time: {timing['time_to_first_token']:.2f}s to first token, {timing['total_time']:.2f}s total")
+
     # Add assistant's response to history
-    st.session_state.message_history.append({"role": "assistant", "content": bot_response})
+    st.session_state.message_history.append({"role": "assistant", "content": bot_response, "timing": timing})
 
     # Clear text input
     clear_text_input()
-
-    # Display chat messages from history on app rerun
-    for message in st.session_state.message_history:
-        role = "user" if message["role"] == "user" else "assistant"
-        with st.chat_message(role):
-            st.markdown(message["content"])
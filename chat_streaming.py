@@ -0,0 +1,51 @@
+import time
+
+
+def stream_chat_completion(client, model, messages, temperature=0.7):
+    """Yields the text deltas of a chat completion as they arrive."""
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def render_stream(token_stream, placeholder, refresh_interval=0.05):
+    """Writes tokens into a Streamlit placeholder as they arrive.
+
+    Returns the final text and a timing dict with time-to-first-token and total seconds, plus
+    `failed`, True when the stream raised and the text ends in an error message instead of a full
+    answer. The placeholder is redrawn at most every refresh_interval seconds to keep websocket
+    traffic down.
+    """
+    start_time = time.time()
+    first_token_time = None
+    last_refresh = 0.0
+    parts = []
+    failed = False
+
+    try:
+        for token in token_stream:
+            if first_token_time is None:
+                first_token_time = time.time()
+            parts.append(token)
+            if time.time() - last_refresh >= refresh_interval:
+                placeholder.markdown("".join(parts) + "▌")
+                last_refresh = time.time()
+    except Exception as e:
+        parts.append(f"\n\nAn error occurred: {str(e)}")
+        failed = True
+
+    text = "".join(parts).strip()
+    placeholder.markdown(text)
+    end_time = time.time()
+    timing = {
+        "time_to_first_token": (first_token_time or end_time) - start_time,
+        "total_time": end_time - start_time,
+        "failed": failed,
+    }
+    return text, timing
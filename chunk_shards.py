@@ -0,0 +1,275 @@
+import json
+import struct
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from storage_backend import ObjectNotFound, PreconditionFailed
+
+# Layout of a shard blob:
+#   8-byte magic | uint32 header length | JSON header | embeddings | uint64 text offsets | UTF-8 text
+# The header stores the byte offset of each section, so the embeddings can be range-read on their own.
+SHARD_MAGIC = b"CRGSHRD1"
+SHARD_SUFFIX = ".crgs"
+SHARD_PREFIX = "shards/"
+MANIFEST_NAME = SHARD_PREFIX + "manifest.json"
+_HEADER_LENGTH = struct.Struct("<I")
+
+
+def is_shard_blob(name):
+    return name.endswith(SHARD_SUFFIX)
+
+
+def encode_shard(records, dtype="float16"):
+    """Packs chunk records (url, text, embeddings, is_rfp, chunk_index, title) into shard bytes."""
+    count = len(records)
+    dim = len(records[0]["embeddings"]) if records else 0
+    embeddings = np.asarray([record["embeddings"] for record in records], dtype=dtype).reshape(count, dim)
+
+    # Pages contribute several chunks, so URLs and titles are stored once and referenced by position
+    urls = []
+    url_ids = {}
+    titles = []
+    url_refs = []
+    for record in records:
+        url = record.get("url", "")
+        if url not in url_ids:
+            url_ids[url] = len(urls)
+            urls.append(url)
+            titles.append(record.get("title", ""))
+        url_refs.append(url_ids[url])
+
+    texts = [record["text"].encode("utf-8") for record in records]
+    offsets = np.zeros(count + 1, dtype="<u8")
+    if texts:
+        offsets[1:] = np.cumsum([len(text) for text in texts])
+
+    embedding_bytes = embeddings.astype(embeddings.dtype.newbyteorder("<")).tobytes()
+    offset_bytes = offsets.tobytes()
+    header = {
+        "count": count,
+        "dim": dim,
+        "dtype": np.dtype(dtype).name,
+        "urls": urls,
+        "titles": titles,
+        "url_refs": url_refs,
+        "chunk_index": [record.get("chunk_index", 0) for record in records],
+        "is_rfp": [1 if record.get("is_rfp") else 0 for record in records],
+        "embeddings_offset": 0,
+        "offsets_offset": len(embedding_bytes),
+        "text_offset": len(embedding_bytes) + len(offset_bytes),
+    }
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return b"".join([SHARD_MAGIC, _HEADER_LENGTH.pack(len(header_bytes)), header_bytes, embedding_bytes, offset_bytes, b"".join(texts)])
+
+
+def decode_shard(data):
+    """Unpacks shard bytes into a header dict, a float32 embedding matrix and the chunk texts."""
+    if data[:len(SHARD_MAGIC)] != SHARD_MAGIC:
+        raise ValueError("Not a chunk shard")
+    position = len(SHARD_MAGIC)
+    (header_length,) = _HEADER_LENGTH.unpack_from(data, position)
+    position += _HEADER_LENGTH.size
+    header = json.loads(bytes(data[position:position + header_length]).decode("utf-8"))
+    body = memoryview(data)[position + header_length:]
+
+    count, dim = header["count"], header["dim"]
+    dtype = np.dtype(header["dtype"]).newbyteorder("<")
+    embeddings = np.frombuffer(body, dtype=dtype, count=count * dim, offset=header["embeddings_offset"]).reshape(count, dim)
+    offsets = np.frombuffer(body, dtype="<u8", count=count + 1, offset=header["offsets_offset"])
+    text_bytes = bytes(body[header["text_offset"]:])
+    texts = [text_bytes[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(count)]
+    return header, embeddings.astype(np.float32), texts
+
+
+def shard_records(name, generation, data):
+    """Turns a downloaded shard into index records named <shard blob>#<row>."""
+    header, embeddings, texts = decode_shard(data)
+    records = []
+    for i, text in enumerate(texts):
+        if not text.strip():
+            continue
+        records.append({
+            "name": f"{name}#{i}",
+            "generation": generation,
+            "url": header["urls"][header["url_refs"][i]],
+            "text": text,
+            "embeddings": embeddings[i],
+        })
+    return records
+
+
+def read_manifest(storage):
+    """Returns the shard manifest and its generation (0 when there is no manifest yet)."""
+    info = storage.stat(MANIFEST_NAME)
+    if info is None:
+        return {"format": 1, "shards": []}, 0
+    try:
+        return json.loads(storage.get_text(MANIFEST_NAME)), info.generation
+    except ObjectNotFound:
+        return {"format": 1, "shards": []}, 0
+
+
+def shard_pages(records):
+    """Lists the pages in a shard in row order as [url, chunk_count, chunk indices], for records added without a page count."""
+    pages = []
+    for record in records:
+        url, chunk_index = record.get("url", ""), record.get("chunk_index", 0)
+        if not pages or pages[-1][0] != url:
+            pages.append([url, 0, []])
+        pages[-1][1] = max(pages[-1][1], chunk_index + 1)
+        pages[-1][2].append(chunk_index)
+    return pages
+
+
+def append_shard(storage, records, dtype="float16", prefix=SHARD_PREFIX, max_attempts=10, pages=None):
+    """Uploads one shard and registers it in the manifest; concurrent writers retry on a generation conflict.
+
+    The manifest entry lists the pages the shard covers, with each page's chunk count at crawl time,
+    so readers can tell which rows of older shards it supersedes without downloading them.
+    """
+    data = encode_shard(records, dtype)
+    name = f"{prefix}{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}{SHARD_SUFFIX}"
+    storage.put(name, data, content_type="application/octet-stream")
+
+    entry = {"name": name, "count": len(records), "dim": len(records[0]["embeddings"]) if records else 0, "dtype": dtype, "bytes": len(data), "created": time.time(),
+             "pages": pages if pages is not None else shard_pages(records)}
+    for attempt in range(max_attempts):
+        manifest, generation = read_manifest(storage)
+        manifest["shards"].append(entry)
+        try:
+            storage.put(MANIFEST_NAME, json.dumps(manifest), content_type="application/json", if_generation_match=generation)
+            return name
+        except PreconditionFailed:
+            time.sleep(0.1 * (attempt + 1))
+    raise RuntimeError(f"Could not register shard {name} in the manifest after {max_attempts} attempts")
+
+
+def live_rows(manifest):
+    """Returns {shard name: set of live row numbers, or None for all rows} for the shards in the manifest.
+
+    Shards are append-only, so a re-crawled page leaves its old rows behind. The newest shard
+    listing a page sets its chunk count, and each (url, chunk index) is served from the newest
+    shard that holds it; chunk indices past the page's current count are dropped. Shards whose
+    entry predates page lists are kept whole.
+    """
+    chunk_counts = {}
+    claimed = set()
+    live = {}
+    for entry in reversed(manifest.get("shards", [])):
+        pages = entry.get("pages")
+        if pages is None:
+            live[entry["name"]] = None
+            continue
+        rows = set()
+        row = 0
+        for url, chunk_count, chunk_indices in pages:
+            chunk_count = chunk_counts.setdefault(url, chunk_count)
+            for chunk_index in chunk_indices:
+                if chunk_index < chunk_count and (url, chunk_index) not in claimed:
+                    claimed.add((url, chunk_index))
+                    rows.add(row)
+                row += 1
+        if rows:
+            live[entry["name"]] = rows
+    return live
+
+
+def download_shards(storage, live, max_workers=8):
+    """Downloads the given shards in parallel and returns the index records of their live rows."""
+    records = []
+    for name, data in storage.get_many(list(live), max_workers=max_workers):
+        if isinstance(data, Exception):
+            print(f"Error downloading shard {name}: {data}")
+            continue
+        rows = live[name]
+        records.extend(record for record in shard_records(name, None, data) if rows is None or shard_row(record["name"]) in rows)
+    return records
+
+
+def shard_row(name):
+    return int(name.rsplit("#", 1)[1])
+
+
+def load_shards(storage, max_workers=8):
+    """Downloads the shards listed in the manifest and returns the records of their live rows only."""
+    manifest, _ = read_manifest(storage)
+    return download_shards(storage, live_rows(manifest), max_workers)
+
+
+class ShardWriter:
+    """Buffers pages of chunk records from crawler threads and appends them to storage as shards.
+
+    A page's records always go into the same shard, along with its chunk count, so a re-crawl that
+    writes only the changed chunks, or none for a page that shrank, still supersedes the old rows.
+    """
+
+    def __init__(self, storage, max_records=2048, dtype="float16", prefix=SHARD_PREFIX):
+        self.storage = storage
+        self.max_records = max_records
+        self.dtype = dtype
+        self.prefix = prefix
+        self.shards_written = 0
+        self._records = []
+        self._pages = []
+        self._lock = threading.Lock()
+
+    def add_page(self, url, chunk_count, records):
+        """Adds a page's new or changed chunk records; chunk_count is how many chunks the page has now."""
+        with self._lock:
+            self._records.extend(records)
+            self._pages.append([url, chunk_count, [record.get("chunk_index", 0) for record in records]])
+            if len(self._records) < self.max_records:
+                return
+            records, pages = self._take()
+        self._write(records, pages)
+
+    def _take(self):
+        records, self._records = self._records, []
+        pages, self._pages = self._pages, []
+        return records, pages
+
+    def flush(self):
+        with self._lock:
+            records, pages = self._take()
+        if pages:
+            self._write(records, pages)
+
+    def _write(self, records, pages):
+        name = append_shard(self.storage, records, self.dtype, self.prefix, pages=pages)
+        self.shards_written += 1
+        print(f"Saved shard {name} with {len(records)} chunks from {len(pages)} pages.")
+
+    def close(self):
+        self.flush()
+
+
+def benchmark(num_chunks=2000, dim=384, chunk_size=2048):
+    """Compares size and parse time of one-JSON-blob-per-chunk storage against a float16 shard."""
+    rng = np.random.default_rng(0)
+    text = "Durham community resource " * (chunk_size // 26)
+    records = [{"url": f"https://example.org/page{i // 4}", "title": "Example", "text": text, "embeddings": rng.standard_normal(dim).astype(np.float32).tolist(), "chunk_index": i % 4} for i in range(num_chunks)]
+    meta_info = [{"charset": "UTF-8"}, {"name": "viewport", "content": "width=device-width, initial-scale=1"}, {"property": "og:title", "content": "Example"}]
+
+    blobs = [json.dumps({"url": r["url"], "meta_info": meta_info, "body_text": r["text"], "embeddings": r["embeddings"], "is_rfp": False}) for r in records]
+    start = time.perf_counter()
+    for blob in blobs:
+        data = json.loads(blob)
+        np.asarray(data["embeddings"], dtype=np.float32)
+    json_seconds = time.perf_counter() - start
+
+    shard = encode_shard(records)
+    start = time.perf_counter()
+    decode_shard(shard)
+    shard_seconds = time.perf_counter() - start
+
+    json_bytes = sum(len(blob) for blob in blobs)
+    print(f"{num_chunks} chunks of {chunk_size} chars, {dim}-dim embeddings")
+    print(f"  JSON blobs: {num_chunks} objects, {json_bytes / 1e6:.1f} MB, parsed in {json_seconds * 1000:.0f} ms")
+    print(f"  float16 shard: 1 object, {len(shard) / 1e6:.1f} MB, parsed in {shard_seconds * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,16 +1,20 @@
 import streamlit as st
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
-from google.cloud import storage
-from google.oauth2 import service_account
-import numpy as np
-import json
 import os
+import time
 from openai import OpenAI
-import concurrent.futures
 import csv
 from datetime import datetime
 from io import StringIO
+from vector_index import load_or_build_index, retrieval_settings_from_env
+from index_sync import IndexSync
+from answer_cache import SemanticAnswerCache
+import context_packer
+from chat_streaming import render_stream, stream_chat_completion
+from embedding_cache import EmbeddingCache
+from resources import gcs_credentials_from_secrets, registry
+from storage_backend import storage_from_env
 
 # Set Streamlit page configuration
 st.set_page_config(
@@ -19,34 +23,65 @@ st.set_page_config(
     layout="wide",
 )
 
-# Initialize SentenceTransformer model
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-
-client = OpenAI(api_key=st.secrets["general"]["openai_api_key"])
-
-# Extract GCS credentials from Streamlit secrets
-gcs_credentials = {
-    "type": "service_account",
-    "project_id": st.secrets["gcs"]["project_id"],
-    "private_key_id": st.secrets["gcs"]["private_key_id"],
-    "private_key": st.secrets["gcs"]["private_key"].replace('\\n', '\n'),
-    "client_email": st.secrets["gcs"]["client_email"],
-    "client_id": st.secrets["gcs"]["client_id"],
-    "auth_uri": st.secrets["gcs"]["auth_uri"],
-    "token_uri": st.secrets["gcs"]["token_uri"],
-    "auth_provider_x509_cert_url": st.secrets["gcs"]["auth_provider_x509_cert_url"],
-    "client_x509_cert_url": st.secrets["gcs"]["client_x509_cert_url"]
-}
-
-# Initialize Google Cloud Storage client with credentials
-credentials = service_account.Credentials.from_service_account_info(gcs_credentials)
-storage_client = storage.Client(credentials=credentials)
 bucket_name = "community_resource_db"
-bucket = storage_client.bucket(bucket_name)
-
-# Initialize feedback bucket
 feedback_bucket_name = "feedbackcrg"
-feedback_bucket = storage_client.bucket(feedback_bucket_name)
+
+# Local snapshot of the chunk corpus, memory-mapped once per process
+index_snapshot_dir = os.environ.get("VECTOR_INDEX_DIR", os.path.join("index_snapshots", bucket_name))
+
+# Storage is GCS with credentials from Streamlit secrets unless STORAGE_BACKEND selects local or in-memory storage
+def create_storage(name):
+    return storage_from_env(name, credentials_info=lambda: gcs_credentials_from_secrets(st.secrets))
+
+# The index is kept current by a background delta sync against the bucket
+def create_index_sync():
+    storage = registry.get("storage")
+    settings = retrieval_settings_from_env()
+    index = load_or_build_index(storage, index_snapshot_dir, **settings)
+    ann_params = {key: value for key, value in settings.items() if key != "backend"}
+    sync_interval = int(os.environ.get("INDEX_SYNC_INTERVAL", 300))
+    return IndexSync(storage, index, snapshot_dir=index_snapshot_dir, interval=sync_interval, ann_params=ann_params).start()
+
+# Suggested questions for the user to click on
+suggested_questions = [
+    "Can you suggest some volunteer opportunities in the Durham area?",
+    "Are there any ongoing fundraisers for local nonprofits in Durham?",
+    "Where can I find food banks in Durham?",
+    "What resources are available for job seekers in Durham?",
+    "Can you help me find mental health services in Durham?"
+]
+
+# Query embeddings are cached; the suggested questions are embedded eagerly at startup
+def create_embedding_cache():
+    cache = EmbeddingCache(registry.get("embedding_model"))
+    cache.warm(suggested_questions)
+    return cache
+
+# Models and clients are built once per process and shared by every session and rerun
+registry.register("embedding_model", lambda: SentenceTransformer('all-MiniLM-L6-v2'), health_check=lambda model: len(model.encode("health check")) > 0)
+registry.register("openai_client", lambda: OpenAI(api_key=st.secrets["general"]["openai_api_key"]), health_check=lambda client: bool(client.api_key))
+registry.register("storage", lambda: create_storage(bucket_name), health_check=lambda storage: storage.health())
+registry.register("feedback_storage", lambda: create_storage(feedback_bucket_name), health_check=lambda storage: storage.health())
+registry.register("embedding_cache", create_embedding_cache)
+registry.register("index_sync", create_index_sync, health_check=lambda sync: len(sync.index) > 0)
+registry.register("answer_cache", lambda: SemanticAnswerCache(os.environ.get("ANSWER_CACHE_PATH", os.path.join("index_snapshots", "answer_cache.json"))))
+registry.warm_up()
+
+# Health checks run once per process, after warm-up, and are logged
+@st.cache_resource
+def check_resources():
+    return registry.report()
+
+resource_health = check_resources()
+
+embedding_cache = registry.get("embedding_cache")
+client = registry.get("openai_client")
+storage = registry.get("storage")
+feedback_storage = registry.get("feedback_storage")
+answer_cache = registry.get("answer_cache")
+
+def get_vector_index():
+    return registry.get("index_sync").index
 
 # Function to upload feedback to GCS
 def upload_feedback_to_gcs(feedback_data):
@@ -57,121 +92,93 @@ def upload_feedback_to_gcs(feedback_data):
     writer.writerows(feedback_data)
     output.seek(0)
 
-    # Create a blob and upload the feedback CSV
-    blob = feedback_bucket.blob(f"feedback_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-    blob.upload_from_string(output.getvalue(), content_type='text/csv')
+    # Upload the feedback CSV
+    feedback_storage.put(f"feedback_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv", output.getvalue(), content_type='text/csv')
 
-# Function to generate embeddings using SentenceTransformer
+# Function to generate embeddings using SentenceTransformer, served from the LRU cache when possible
 def generate_embeddings(text):
     try:
-        return embedding_model.encode(text).tolist()
+        return embedding_cache.encode(text).tolist()
     except Exception as e:
         print(f"Error generating embeddings: {str(e)}")
         return None
 
-# Function to count tokens
-def count_tokens(text):
-    """Counts the tokens in the text."""
-    return len(text.split())
+# Fine-tuned chat model and the share of its context window given to retrieved documents
+chat_model = "ft:gpt-4o-mini-2024-07-18:skunks-ai::9un3mrZs"
+context_token_budget = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 3000))
 
 st.title("Community Resource Guide")
 
 if 'user_input' not in st.session_state:
     st.session_state.user_input = ''
 
-# Suggested questions for the user to click on
-suggested_questions = [
-    "Can you suggest some volunteer opportunities in the Durham area?",
-    "Are there any ongoing fundraisers for local nonprofits in Durham?",
-    "Where can I find food banks in Durham?",
-    "What resources are available for job seekers in Durham?",
-    "Can you help me find mental health services in Durham?"
-]
-
 # Display suggested questions as buttons
 st.sidebar.subheader("Suggested Questions")
 for question in suggested_questions:
     if st.sidebar.button(question):
         st.session_state.user_input = question
 
-# Function to retrieve blobs from GCS with manual pagination
-def get_blobs_from_gcs_paginated(max_blobs=500):
-    blobs = []
-    blob_iterator = bucket.list_blobs()
-    for blob in blob_iterator:
-        blobs.append(blob)
-        if len(blobs) >= max_blobs:
-            break
-    return blobs
+# Report how much the answer cache is saving
+cache_stats = answer_cache.stats()
+st.sidebar.caption(f"Answer cache: {cache_stats['hit_rate']:.0%} hit rate, {cache_stats['saved_seconds']:.1f}s of generation saved")
+unhealthy = [name for name, status in resource_health.items() if status.get("healthy") is False]
+st.sidebar.caption(f"Unhealthy resources: {', '.join(unhealthy)}" if unhealthy else "All resources healthy")
+
+def search_similar_chunks(query, top_k=100):
+    """Searches the local vector index for chunks similar to the query; returns best-first (text, url, score) tuples."""
+    index = get_vector_index()
+    suggested_results = get_suggested_question_results(index.version, top_k)
+    if query in suggested_results:
+        return suggested_results[query]
 
-def search_similar_documents(query, top_k=100):
-    """Searches for documents in GCS that are similar to the query."""
     query_vector = generate_embeddings(query)
     if query_vector is None:
         return []
 
-    blobs = get_blobs_from_gcs_paginated()
-    similarities = []
-
-    def process_blob(blob):
-        content = blob.download_as_text()
-        try:
-            data = json.loads(content)
-            text = data.get("body_text", "")
-            embeddings = data.get("embeddings", [])
-            if not text.strip() or not embeddings:
-                return None
-            similarity = np.dot(query_vector, embeddings) / (np.linalg.norm(query_vector) * np.linalg.norm(embeddings))
-            return (text, similarity)
-        except json.JSONDecodeError:
-            print(f"Skipping non-JSON blob: {blob.name}")
-            return None
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_blob = {executor.submit(process_blob, blob): blob for blob in blobs}
-        for future in concurrent.futures.as_completed(future_to_blob):
-            result = future.result()
-            if result:
-                similarities.append(result)
-
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    return [text for text, _ in similarities[:top_k]]
-
-def generate_prompt(query, history):
-    """Generates a comprehensive prompt including contexts from similar documents and conversation history."""
-    prompt_start = "Answer the question based on the context below. Provide a comprehensive and exhaustive list of all potential organizations that can help. \n\nContext:\n"
-    prompt_end = f"\n\nQuestion: {query}\nAnswer:"
-    
-    similar_docs = search_similar_documents(query)
-
-    # Compile contexts into a single prompt, respecting character limits
-    prompt = prompt_start
-    for doc in similar_docs:
-        if len(prompt + doc + prompt_end) < 3750:
-            prompt += "\n\n---\n\n" + doc
-        else:
-            break
-
-    # Include conversation history in the prompt
-    for message in history:
-        role = message["role"]
-        content = message["content"]
-        prompt += f"\n\n{role.capitalize()}: {content}"
+    return [(index.texts[i], index.urls[i], score) for i, score in index.search(query_vector, top_k)]
 
-    prompt += prompt_end
-    return prompt
+def search_similar_documents(query, top_k=100):
+    """Searches the local vector index for documents that are similar to the query."""
+    return [text for text, _, _ in search_similar_chunks(query, top_k)]
 
-def generate_openai_response(messages, temperature=0.7):
-    """Generates a response from OpenAI based on a structured prompt."""
+def search_similar_documents_batch(queries, top_k=100):
+    """Searches the local vector index for several queries with one batched scoring pass."""
     try:
-        response = client.chat.completions.create(
-            model="ft:gpt-4o-mini-2024-07-18:skunks-ai::9un3mrZs",
-            messages=messages,
-            temperature=temperature
-        )
-        return response.choices[0].message.content.strip()
+        query_vectors = embedding_cache.encode_many(queries)
     except Exception as e:
-        return f"An error occurred: {str(e)}"
+        print(f"Error generating embeddings: {str(e)}")
+        return [[] for _ in queries]
+
+    index = get_vector_index()
+    return [[(index.texts[i], index.urls[i], score) for i, score in results] for results in index.search_batch(query_vectors, top_k)]
+
+# Results for the sidebar questions are scored together once per index version
+@st.cache_resource
+def get_suggested_question_results(index_version, top_k):
+    return dict(zip(suggested_questions, search_similar_documents_batch(suggested_questions, top_k)))
+
+def build_context_message(query):
+    """Builds a system message carrying the retrieved documents that fit the context token budget."""
+    context, packed = context_packer.pack_context(search_similar_chunks(query), context_token_budget, chat_model)
+    if not packed:
+        return None
+    return {"role": "system", "content": "Use the following documents about Durham community organizations to answer the user's latest question. Prefer them over prior knowledge and cite their source links where helpful.\n\nContext:\n" + context}
+
+def generate_openai_response(messages, temperature=0.7):
+    """Generates a response from OpenAI based on a structured prompt; raises when the request fails."""
+    response = client.chat.completions.create(
+        model=chat_model,
+        messages=messages,
+        temperature=temperature
+    )
+    return response.choices[0].message.content.strip()
+
+def generate_openai_response_stream(messages, temperature=0.7):
+    """Streams the response from OpenAI token by token."""
+    return stream_chat_completion(client, chat_model, messages, temperature)
+
+# Stream answers into the chat as they are generated (set STREAM_RESPONSES=0 to wait for the full answer)
+stream_responses = os.environ.get("STREAM_RESPONSES", "1") != "0"
 
 # User input for chat
 user_input = st.chat_input("Ask me a question")
@@ -195,6 +202,14 @@ def clear_text_input():
     """Function to clear text input."""
     st.session_state.text_input = ''
 
+def add_assistant_response(bot_response, question, timing):
+    """Adds the assistant's response to history with a unique ID for the feedback buttons."""
+    response_id = len(st.session_state.message_history)
+    st.session_state.message_history.append({"role": "assistant", "content": bot_response, "id": response_id, "user_input": question, "timing": timing})
+    st.session_state.response_ids.append(response_id)
+
+pending_response = None
+
 if st.session_state.user_input or user_input:
     # Handle the user input from both the text input and suggested questions
     if user_input:
@@ -205,15 +220,23 @@ if st.session_state.user_input or user_input:
 
     # Create the messages payload for OpenAI API
     messages = [{"role": "system", "content": "You are an assistant that is an expert on community organizations in Durham, NC. For main queries related to specific needs such as homelessness, food shelters, education, and similar, provide a comprehensive and exhaustive list of all potential organizations that can help. Include each organization's verified contact information and a brief overview of what the organization does. Where available, include links to relevant resources. For other queries, provide information on the most relevant organization or organizations based on the user's needs. If specific information is not available, clearly indicate that and suggest checking with the organization directly for more details. Provide more detailed information about the organization's programs, mission, and impact only if specifically asked. Ensure your responses are thorough, clear, and concise, tailored to the user's query, and prioritize user safety and privacy. Aim to offer the most relevant and useful information to fully address the user's needs."}]
+    context_message = build_context_message(st.session_state.user_input)
+    if context_message:
+        messages.append(context_message)
     for message in st.session_state.message_history:
         messages.append({"role": message["role"], "content": message["content"]})
 
-    bot_response = generate_openai_response(messages)
-    
-    # Add assistant's response to history
-    response_id = len(st.session_state.message_history)  # Unique ID for each response
-    st.session_state.message_history.append({"role": "assistant", "content": bot_response, "id": response_id, "user_input": st.session_state.user_input})
-    st.session_state.response_ids.append(response_id)
+    # Opening questions are answered from the semantic cache when a near-identical one was seen recently
+    is_first_question = sum(1 for message in st.session_state.message_history if message["role"] == "user") == 1
+    query_vector = generate_embeddings(st.session_state.user_input) if is_first_question else None
+    corpus_version = get_vector_index().version
+    bot_response = answer_cache.lookup(query_vector, corpus_version) if query_vector is not None else None
+
+    if bot_response is None:
+        # The answer is generated below the chat history so it can stream into place
+        pending_response = {"messages": messages, "question": st.session_state.user_input, "query_vector": query_vector, "corpus_version": corpus_version}
+    else:
+        add_assistant_response(bot_response, st.session_state.user_input, {"time_to_first_token": 0.0, "total_time": 0.0, "cached": True})
 
     # Clear text input
     clear_text_input()
@@ -255,6 +278,31 @@ for message in st.session_state.message_history:
                     }
                     st.session_state.show_feedback_form = response_id
 
+# Generate the pending answer, streaming tokens into the chat as they arrive
+if pending_response:
+    with st.chat_message("assistant"):
+        start_time = time.time()
+        if stream_responses:
+            bot_response, timing = render_stream(generate_openai_response_stream(pending_response["messages"]), st.empty())
+        else:
+            failed = False
+            with st.spinner("Generating response..."):
+                try:
+                    bot_response = generate_openai_response(pending_response["messages"])
+                except Exception as e:
+                    bot_response = f"An error occurred: {str(e)}"
+                    failed = True
+            timing = {"time_to_first_token": time.time() - start_time, "total_time": time.time() - start_time, "failed": failed}
+    print(f"Response time: {timing['time_to_first_token']:.2f}s to first token, {timing['total_time']:.2f}s total")
+
+    # Only answers that completed are cached; a failed request shows its error once and is retried next time
+    if pending_response["query_vector"] is not None and not timing["failed"]:
+        answer_cache.store(pending_response["question"], pending_response["query_vector"], bot_response, pending_response["corpus_version"], latency=timing["total_time"])
+    add_assistant_response(bot_response, pending_response["question"], timing)
+
+    # Rerun so the new answer is drawn with its feedback buttons
+    st.rerun()
+
 if 'show_feedback_form' in st.session_state:
     response_id = st.session_state.show_feedback_form
     feedback_entry = st.session_state.feedback.get(response_id, {})
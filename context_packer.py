@@ -0,0 +1,67 @@
+import re
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to an approximate count when tiktoken is not installed
+    tiktoken = None
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+_encodings = {}
+
+
+# Function to get (and cache) the tokenizer used by a chat model
+def get_encoding(model):
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        base_model = model.split(":")[1] if model.startswith("ft:") else model
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(base_model)
+        except KeyError:
+            # Fine-tuned and dated model names are not always known to tiktoken; gpt-4o models use o200k_base
+            _encodings[model] = tiktoken.get_encoding("o200k_base" if "4o" in base_model else "cl100k_base")
+    return _encodings[model]
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """Counts the model tokens in the text."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        # Roughly one token per word or punctuation mark
+        return len(re.findall(r"\w+|[^\w\s]", text))
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def pack_context(chunks, budget_tokens, model="gpt-4o-mini"):
+    """Fills a token budget with the highest-scoring chunks, keeping one chunk per URL.
+
+    chunks is a best-first list of (text, url, score). Chunks that would overflow the budget are
+    skipped so a smaller, lower-ranked chunk can still use the remaining room. Returns the context
+    text and the chunks that went into it.
+    """
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR, model)
+    seen_urls = set()
+    seen_texts = set()
+    packed = []
+    used = 0
+
+    for text, url, score in chunks:
+        if not text.strip() or text in seen_texts or (url and url in seen_urls):
+            continue
+        tokens = count_tokens(_format_chunk(text, url), model) + (separator_tokens if packed else 0)
+        if used + tokens > budget_tokens:
+            continue
+        packed.append((text, url, score))
+        seen_texts.add(text)
+        if url:
+            seen_urls.add(url)
+        used += tokens
+        if budget_tokens - used <= separator_tokens:
+            break
+
+    return CONTEXT_SEPARATOR.join(_format_chunk(text, url) for text, url, _ in packed), packed
+
+
+def _format_chunk(text, url):
+    return f"Source: {url}\n{text}" if url else text
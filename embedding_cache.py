@@ -0,0 +1,83 @@
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Function to map near-identical questions onto one cache key
+def normalize_query(text):
+    text = re.sub(r'\s+', ' ', text).strip().lower()
+    return text.rstrip('?!. ')
+
+
+class EmbeddingCache:
+    """Bounded LRU cache of query embeddings keyed on normalized query text."""
+
+    def __init__(self, model, max_size=2048):
+        self.model = model
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def _store(self, key, vector):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def encode(self, text):
+        """Returns the embedding of text, running the model only on a cache miss."""
+        key = normalize_query(text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = np.asarray(self.model.encode(text), dtype=np.float32)
+            self._store(key, vector)
+        return vector
+
+    def encode_many(self, texts):
+        """Returns embeddings for several texts, encoding all misses in a single model call."""
+        keys = [normalize_query(text) for text in texts]
+        vectors = [self._lookup(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = self.model.encode([texts[i] for i in missing])
+            for i, vector in zip(missing, encoded):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+                self._store(keys[i], vectors[i])
+        return np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def warm(self, texts):
+        """Embeds texts eagerly so their first lookup is already a hit; does not count towards the stats."""
+        keys = [normalize_query(text) for text in texts]
+        with self._lock:
+            pending = [(key, text) for key, text in zip(keys, texts) if key not in self._entries]
+        if pending:
+            encoded = self.model.encode([text for _, text in pending])
+            for (key, _), vector in zip(pending, encoded):
+                self._store(key, np.asarray(vector, dtype=np.float32))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
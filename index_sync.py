@@ -0,0 +1,132 @@
+import concurrent.futures
+import functools
+import threading
+import time
+
+from chunk_shards import SHARD_PREFIX, download_shards, live_rows, read_manifest, shard_row
+from vector_index import VectorIndex, download_chunk_records, source_blob
+
+
+class IndexSync:
+    """Keeps a VectorIndex in step with its storage by fetching only new, changed or deleted chunk blobs.
+
+    Searches read `sync.index`, which is replaced in a single assignment after each sync, so the
+    serving path never waits on a sync in progress.
+    """
+
+    def __init__(self, storage, index, snapshot_dir=None, interval=300, max_workers=16, ann_kind=None, ann_params=None):
+        self.storage = storage
+        self.index = index
+        self.snapshot_dir = snapshot_dir
+        self.interval = interval
+        self.max_workers = max_workers
+        self.ann_kind = ann_kind if ann_kind is not None else (index.ann.kind if index.ann is not None else None)
+        self.ann_params = ann_params or {}
+
+        # Blobs that were listed but produced no chunk (non-JSON, empty text) so they are not re-downloaded every sync
+        self.skipped = {}
+        # Generation of the shard manifest the index reflects
+        self.shard_generation = None
+        self.last_sync = None
+        self.last_stats = None
+        self._sync_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def sync_once(self):
+        """Runs one delta sync and returns a summary of what changed."""
+        with self._sync_lock:
+            start = time.time()
+            index = self.index
+            known = {source_blob(name): generation for name, generation in zip(index.blob_names, index.generations) if not name.startswith(SHARD_PREFIX)}
+            known.update(self.skipped)
+
+            listed = {}
+            changed = []
+            for info in self.storage.list():
+                # Shards are followed through their manifest below
+                if info.name.startswith(SHARD_PREFIX):
+                    continue
+                listed[info.name] = info.generation
+                if known.get(info.name) != info.generation:
+                    changed.append(info)
+
+            removed = [name for name in known if name not in listed]
+            for name in removed:
+                self.skipped.pop(name, None)
+
+            records = []
+            if changed:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    for info, blob_records in zip(changed, executor.map(functools.partial(download_chunk_records, self.storage), changed)):
+                        if blob_records:
+                            records.extend(blob_records)
+                            self.skipped.pop(info.name, None)
+                        else:
+                            self.skipped[info.name] = info.generation
+
+            shard_records, dropped_rows, shard_generation = self._sync_shards(index)
+            records.extend(shard_records)
+
+            stats = {"changed": len(changed), "indexed": len(records), "removed": len(removed) + len(dropped_rows), "total": len(index)}
+            # Changed blobs are dropped as a whole so chunks that disappeared from them go too
+            index_blobs = {source_blob(name) for name in index.blob_names}
+            dropped = [name for name in removed + [info.name for info in changed] if name in index_blobs] + dropped_rows
+            if records or dropped:
+                new_index = index.with_changes(records, dropped)
+                if self.snapshot_dir:
+                    # Persist and re-map so restarts start from the synced state and the matrix stays off-heap
+                    new_index = VectorIndex.load(new_index.save(self.snapshot_dir))
+                if self.ann_kind and len(new_index):
+                    new_index.enable_ann(self.ann_kind, self.snapshot_dir, **self.ann_params)
+                self.index = new_index
+                stats["total"] = len(new_index)
+            self.shard_generation = shard_generation
+
+            stats["seconds"] = time.time() - start
+            self.last_sync = time.time()
+            self.last_stats = stats
+            return stats
+
+    def _sync_shards(self, index):
+        # Returns the records of shard rows that became live, the index rows that were superseded and the manifest generation
+        manifest, generation = read_manifest(self.storage)
+        if generation == self.shard_generation:
+            return [], [], generation
+
+        live = live_rows(manifest)
+        indexed = {}
+        for name in index.blob_names:
+            if name.startswith(SHARD_PREFIX):
+                indexed.setdefault(source_blob(name), set()).add(shard_row(name))
+        dropped = [f"{shard}#{row}" for shard, rows in indexed.items() for row in rows
+                   if shard not in live or (live[shard] is not None and row not in live[shard])]
+        # Shards with live rows the index lacks are downloaded again; their records replace all of their rows
+        missing = {shard: rows for shard, rows in live.items() if shard not in indexed or (rows is not None and not rows <= indexed[shard])}
+        records = download_shards(self.storage, missing, self.max_workers) if missing else []
+        if set(missing) - {source_blob(record["name"]) for record in records}:
+            # A shard failed to download; look at the manifest again on the next sync
+            generation = None
+        return records, dropped, generation
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                stats = self.sync_once()
+                if stats["changed"] or stats["removed"]:
+                    print(f"Index sync: {stats['changed']} changed, {stats['removed']} removed, {stats['total']} chunks in {stats['seconds']:.1f}s")
+            except Exception as e:
+                print(f"Error syncing index: {str(e)}")
+
+    def start(self):
+        """Starts syncing in a daemon thread every `interval` seconds."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="index-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,105 @@
+import threading
+import time
+
+
+class ResourceRegistry:
+    """Process-wide registry of expensive shared objects (models, API and storage clients).
+
+    Streamlit re-executes the app script on every interaction, but imported modules stay loaded, so
+    everything registered here is built once per process and shared by all sessions.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._health_checks = {}
+        self._instances = {}
+        self._locks = {}
+        self._init_seconds = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory, health_check=None, replace=False):
+        """Registers a factory; re-registering an existing name is ignored unless replace is set."""
+        with self._lock:
+            if name in self._factories and not replace:
+                return
+            self._factories[name] = factory
+            self._health_checks[name] = health_check
+            self._locks.setdefault(name, threading.Lock())
+            if replace:
+                self._instances.pop(name, None)
+
+    def get(self, name):
+        """Returns the shared instance, building it on first use; concurrent callers wait for one build."""
+        if name in self._instances:
+            return self._instances[name]
+        if name not in self._factories:
+            raise KeyError(f"No resource registered under {name!r}")
+
+        with self._locks[name]:
+            if name not in self._instances:
+                start = time.time()
+                # Factories may depend on other resources, which are resolved through get() as well
+                self._instances[name] = self._factories[name]()
+                self._init_seconds[name] = time.time() - start
+        return self._instances[name]
+
+    def is_initialized(self, name):
+        return name in self._instances
+
+    def reset(self, name):
+        """Drops an instance so the next get() rebuilds it."""
+        with self._locks.get(name, self._lock):
+            self._instances.pop(name, None)
+
+    def warm_up(self, names=None):
+        """Builds the given resources (all registered ones by default) and returns their build times."""
+        for name in names or list(self._factories):
+            self.get(name)
+        return {name: self._init_seconds.get(name, 0.0) for name in names or list(self._factories)}
+
+    def health(self):
+        """Runs the health check of every initialized resource."""
+        report = {}
+        for name in list(self._factories):
+            status = {"initialized": self.is_initialized(name), "init_seconds": self._init_seconds.get(name)}
+            check = self._health_checks.get(name)
+            if status["initialized"] and check is not None:
+                try:
+                    status["healthy"] = bool(check(self._instances[name]))
+                except Exception as e:
+                    status["healthy"] = False
+                    status["error"] = str(e)
+            report[name] = status
+        return report
+
+    def report(self):
+        """Prints and returns health(): one line per resource with its build time and check result."""
+        report = self.health()
+        for name, status in report.items():
+            if not status["initialized"]:
+                print(f"Resource {name}: not initialized")
+                continue
+            state = {True: "healthy", False: "unhealthy", None: "no health check"}[status.get("healthy")]
+            print(f"Resource {name}: {state}, built in {status['init_seconds']:.2f}s" + (f" ({status['error']})" if "error" in status else ""))
+        return report
+
+
+# Shared by every session in the process
+registry = ResourceRegistry()
+
+
+# Function to build the service account dict from the [gcs] section of Streamlit secrets
+def gcs_credentials_from_secrets(secrets):
+    gcs = secrets["gcs"]
+    return {
+        "type": "service_account",
+        "project_id": gcs["project_id"],
+        "private_key_id": gcs["private_key_id"],
+        "private_key": gcs["private_key"].replace('\\n', '\n'),
+        "client_email": gcs["client_email"],
+        "client_id": gcs["client_id"],
+        "auth_uri": gcs["auth_uri"],
+        "token_uri": gcs["token_uri"],
+        "auth_provider_x509_cert_url": gcs["auth_provider_x509_cert_url"],
+        "client_x509_cert_url": gcs["client_x509_cert_url"]
+    }
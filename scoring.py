@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+
+
+# Function to scale each row to unit length so cosine similarity becomes a plain dot product
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        norm = np.linalg.norm(matrix)
+        return matrix / norm if norm else matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(matrix, query, k):
+    """Returns (indices, scores) of the k best rows of a normalized matrix for one normalized query."""
+    scores = matrix @ query
+    return _select_top_k(scores, k)
+
+
+def batch_top_k(matrix, queries, k):
+    """Scores a batch of normalized queries with one matrix-matrix product; returns one (indices, scores) pair per query."""
+    queries = np.atleast_2d(queries)
+    scores = queries @ matrix.T
+    return [_select_top_k(row, k) for row in scores]
+
+
+def _select_top_k(scores, k):
+    count = scores.shape[0]
+    if count == 0 or k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    if k < count:
+        # argpartition finds the k best in linear time; only those k get sorted
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(count)
+    order = candidates[np.argsort(-scores[candidates])]
+    return order, scores[order]
+
+
+def benchmark(num_chunks=100000, dim=384, k=100, batch=5, repeats=20):
+    """Times single and batched top-k scoring over a random corpus."""
+    rng = np.random.default_rng(0)
+    matrix = normalize_rows(rng.standard_normal((num_chunks, dim), dtype=np.float32))
+    queries = normalize_rows(rng.standard_normal((batch, dim), dtype=np.float32))
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        top_k(matrix, queries[0], k)
+    single_ms = (time.perf_counter() - start) / repeats * 1000
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        batch_top_k(matrix, queries, k)
+    batch_ms = (time.perf_counter() - start) / repeats * 1000
+
+    print(f"{num_chunks} chunks x {dim} dims, top {k}")
+    print(f"  single query: {single_ms:.2f} ms")
+    print(f"  batch of {batch}: {batch_ms:.2f} ms ({batch_ms / batch:.2f} ms per query)")
+
+
+if __name__ == "__main__":
+    benchmark()
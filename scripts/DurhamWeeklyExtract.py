@@ -1,91 +1,154 @@
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-from google.cloud import storage
-from google.oauth2 import service_account
-from PyPDF2 import PdfReader
-import io
+from urllib.parse import urlparse
 import json
 import hashlib
-import time
-import concurrent.futures
 import threading
+import concurrent.futures
 import openai
 import os
+import sys
 import streamlit as st
 
+# Shared modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunk_shards import ShardWriter
+from storage_backend import storage_from_env
+from rate_limiter import HostRateLimiter
+from fetch_stream import PDF, SkipContent, read_response
+from html_extract import extract_page
+from pdf_extract import PdfExtractor, chunk_pages
+from boilerplate import BoilerplateDetector
+from crawl_frontier import MemoryFrontier, SQLiteFrontier, crawl, frontier_path
+from crawl_manifest import crawl_manifest_path
+from url_canon import URLCanonicalizer, site_host
+from sitemap_seed import SEED_PRIORITY, SitemapSeeder, session_fetcher
+from upload_queue import UploadQueue
+from embedding_batcher import EmbeddingBatcher, openai_encoder
+from crawl_metrics import CrawlMetrics, metrics_path
+
 
 class MadeInDurhamWebScanner:
-    def __init__(self, base_url, bucket_name, credentials_path, openai_api_key, max_urls_to_visit=300, chunk_size=2048, rate_limit=10, time_window=60):
+    def __init__(self, base_url, bucket_name, credentials_path, openai_api_key, max_urls_to_visit=300, chunk_size=2048, rate_limit=10, time_window=60, storage_format='json', max_content_size=10*1024*1024, use_sitemaps=True, manifest_dir='crawl_manifests', upload_queue=None, metrics_format='json', embedding_batcher=None):
         self.visited_urls = set()
-        self.urls_to_visit = set([base_url])
+        # Canonical keys of the URLs queued so far, so tracking-parameter, www/https and redirect variants are fetched once
+        self.canonicalizer = URLCanonicalizer()
+        # URLs queued, in progress and done; stored in SQLite under manifest_dir so an interrupted crawl resumes.
+        # The frontier stores each URL's canonical key too, so a resumed crawl does not queue variants again
+        path = frontier_path(crawl_manifest_path(manifest_dir, bucket_name, base_url)) if manifest_dir else None
+        self.frontier = SQLiteFrontier(path, key=self.canonicalizer.key) if path else MemoryFrontier(key=self.canonicalizer.key)
+        # Counts when the scan ended, since a finished frontier is cleared and closed
+        self.final_counts = None
+        # Per-stage timers, counters and queue depths, exported under manifest_dir at the end of each scan
+        path = metrics_path(crawl_manifest_path(manifest_dir, bucket_name, base_url), metrics_format) if manifest_dir else None
+        self.metrics = CrawlMetrics(path, format=metrics_format, labels={"site": urlparse(base_url).netloc})
+        self.metrics.gauge("frontier_queued", lambda: self.frontier.counts()["queued"])
         self.base_url = base_url
         self.max_urls_to_visit = max_urls_to_visit
         self.bucket_name = bucket_name
         self.chunk_size = chunk_size
 
-        # Rate limiting parameters
+        # Rate limiting parameters: a token bucket per host, so one slow host does not hold up the others
         self.rate_limit = rate_limit
         self.time_window = time_window
-        self.requests_made = 0
-        self.start_time = time.time()
-        self.lock = threading.Lock()
+        self.rate_limiter = HostRateLimiter(rate_limit, time_window)
 
-        # Load credentials from the JSON key file
-        self.credentials = service_account.Credentials.from_service_account_file(credentials_path)
-        self.storage_client = storage.Client(credentials=self.credentials)
-        self.bucket = self.storage_client.bucket(bucket_name)
+        # robots.txt and sitemaps seed the frontier before the crawl, and robots.txt Disallow rules apply to every link
+        self.sitemap_seeder = SitemapSeeder(session_fetcher(rate_limiter=self.rate_limiter)) if use_sitemaps else None
 
-        # Set OpenAI API key
-        openai.api_key = openai_api_key
+        # Maximum content size to download
+        self.max_content_size = max_content_size
 
-    def fetch_content(self, url):
-        with self.lock:
-            current_time = time.time()
-            elapsed_time = current_time - self.start_time
+        # PDFs are parsed in worker processes, with page and time limits, instead of in the crawler threads
+        self.pdf_extractor = PdfExtractor()
 
-            if elapsed_time > self.time_window:
-                self.start_time = current_time
-                self.requests_made = 0
+        # Blocks of text repeated across the site's pages (menus, footers, banners) are learned during the crawl
+        self.boilerplate = BoilerplateDetector(chunk_size=chunk_size)
 
-            if self.requests_made >= self.rate_limit:
-                sleep_time = self.time_window - elapsed_time
-                print(f"Rate limit reached. Sleeping for {sleep_time} seconds...")
-                time.sleep(sleep_time)
-                self.start_time = time.time()
-                self.requests_made = 0
+        # GCS with the JSON key file, or local/in-memory storage when STORAGE_BACKEND says so
+        self.storage = storage_from_env(bucket_name, credentials_path=credentials_path)
 
-            self.requests_made += 1
+        # 'json' writes one blob per chunk; 'shards' batches chunks into compact binary shards
+        self.storage_format = storage_format
+        self.shard_writer = ShardWriter(self.storage) if storage_format == 'shards' else None
+
+        # Chunk blobs are uploaded by a worker pool so slow GCS responses do not stall fetching
+        self.owns_upload_queue = upload_queue is None
+        self.upload_queue = upload_queue if upload_queue is not None else UploadQueue(self.storage)
+        # This site's uploads still in flight, so a shared queue's other sites are not waited for
+        self.pending_uploads = set()
+        self.pending_uploads_lock = threading.Lock()
+        self.metrics.gauge("upload_queue_depth", self.upload_queue.depth)
+
+        # Set OpenAI API key
+        openai.api_key = openai_api_key
+        # Chunks from every crawler thread are embedded together, one OpenAI request per batch
+        self.owns_embedding_batcher = embedding_batcher is None
+        self.embedding_batcher = embedding_batcher if embedding_batcher is not None else EmbeddingBatcher(openai_encoder(openai))
+        self.metrics.gauge("embedding_queue_depth", lambda: self.embedding_batcher.stats()["queued"])
+
+    def fetch_content(self, url):
+        self.rate_limiter.configure_from_robots(url, self.fetch_robots_txt)
+        with self.metrics.time("rate_limit_wait"):
+            self.rate_limiter.acquire(url)
 
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            return response.content
+            with self.metrics.time("fetch"):
+                response = requests.get(url, stream=True, timeout=30)
+                if response.status_code in (429, 503):
+                    response.close()
+                    delay = self.rate_limiter.penalize(url, response.headers.get('Retry-After'))
+                    print(f"{response.status_code} for URL: {url}. Backing off {urlparse(url).netloc} for {delay:.0f} seconds.")
+                    self.metrics.inc("fetch_errors")
+                    return None, None, None
+                response.raise_for_status()
+                if response.url != url and self.canonicalizer.redirected(url, response.url):
+                    # Redirected to a page that is crawled under another URL; skip the body
+                    response.close()
+                    return None, None, None
+                # The body is read in chunks and abandoned past max_content_size or when it sniffs as unsupported media
+                content, kind = read_response(response, url, self.max_content_size)
+            self.metrics.inc("pages_fetched")
+            self.metrics.inc("bytes_fetched", len(content))
+            return content, kind, response.headers.get('Content-Type')
+        except SkipContent as e:
+            print(f"Skipping URL {url}: {e}")
+            self.metrics.inc("pages_skipped")
+            return None, None, None
         except requests.RequestException as e:
             print(f"Error fetching URL: {e}")
-            return None
-
-    def parse_pdf(self, pdf_content):
-        pdf_reader = PdfReader(io.BytesIO(pdf_content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+            self.metrics.inc("fetch_errors")
+            return None, None, None
 
-    def parse_web_page(self, html_content, url):
-        if html_content and url not in self.visited_urls:
-            soup = BeautifulSoup(html_content, 'html.parser')
+    def fetch_robots_txt(self, robots_url):
+        try:
+            response = requests.get(robots_url, timeout=10)
+            return response.text if response.status_code == 200 else None
+        except requests.RequestException:
+            return None
 
-            # Extract meta information
-            meta_info = [meta.attrs for meta in soup.find_all('meta')]
+    def parse_pdf(self, pdf_content, url):
+        # Returns the PDF's text chunks; pages are extracted in the PDF worker pool and chunked as they arrive
+        try:
+            return list(chunk_pages(self.pdf_extractor.pages(pdf_content, url), self.chunk_size))
+        except Exception as e:
+            print(f"Error reading PDF: {e}")
+            return None
 
-            # Extract body text
-            body_text = soup.get_text(separator='\n', strip=True)
+    def parse_web_page(self, content, url, content_type=None):
+        # Returns the page's meta tags, normalized body text and absolute links, or ([], '', None) if it was already parsed
+        if content and url not in self.visited_urls:
+            page = extract_page(content, url, content_type)
+            if page.canonical and self.canonicalizer.canonical(url, page.canonical):
+                # The page's canonical URL is crawled too; its text is stored only there
+                self.visited_urls.add(url)
+                return page.meta_info, '', page.links
+            # Text repeated across the site (menus, footers, banners) is left out before chunking
+            text = self.boilerplate.strip(url, page.blocks)
 
             # Add the URL to the visited set
             self.visited_urls.add(url)
 
-            return meta_info, body_text, soup
+            return page.meta_info, text, page.links
         else:
             return [], '', None
 
@@ -93,11 +156,24 @@ class MadeInDurhamWebScanner:
         # Generate a hash for the URL to use as a unique identifier
         return f"{hashlib.md5(url.encode()).hexdigest()}_{index}.json"
 
-    def save_text_and_embeddings_to_gcs(self, meta_info, body_text, url):
-        chunks = [body_text[i:i + self.chunk_size] for i in range(0, len(body_text), self.chunk_size)]
-        for index, chunk in enumerate(chunks):
-            # Generate embeddings using OpenAI API
-            embeddings = self.get_embeddings(chunk)
+    def save_text_and_embeddings_to_gcs(self, meta_info, body_text, url, chunks=None):
+        # PDFs pass their chunks instead of the body text
+        if chunks is None:
+            with self.metrics.time("chunk"):
+                chunks = [body_text[i:i + self.chunk_size] for i in range(0, len(body_text), self.chunk_size)]
+        self.metrics.inc("chunks", len(chunks))
+        # Generate embeddings using OpenAI API, one request for all of the page's chunks
+        chunk_embeddings = self.get_embeddings_batch(chunks)
+        shard_rows = []
+        for index, (chunk, embeddings) in enumerate(zip(chunks, chunk_embeddings)):
+
+            if self.shard_writer is not None:
+                # Shards keep only the page title from the meta tags, and skip chunks that failed to embed
+                if not embeddings:
+                    continue
+                title = next((meta.get('content', '') for meta in meta_info if meta.get('name') == 'title' or meta.get('property') == 'og:title'), '')
+                shard_rows.append({"url": url, "title": title, "text": chunk, "embeddings": embeddings, "chunk_index": index})
+                continue
 
             data = {
                 "url": url,
@@ -105,16 +181,28 @@ class MadeInDurhamWebScanner:
                 "body_text": chunk,
                 "embeddings": embeddings
             }
-            blob_name = self.get_blob_name(url, index)
-            blob = self.bucket.blob(blob_name)
 
-            # Check if the blob already exists
-            if blob.exists():
-                print(f"Blob {blob_name} already exists. Overwriting.")
-            else:
-                print(f"Saving new blob {blob_name}.")
+            self.queue_upload(self.get_blob_name(url, index), json.dumps(data))
+
+        if self.shard_writer is not None:
+            # The page's chunk count goes with its rows so older shards' rows for it are superseded
+            self.shard_writer.add_page(url, len(chunks), shard_rows)
+
+    def queue_upload(self, name, data):
+        future = self.upload_queue.put(name, data, metrics=self.metrics)
+        with self.pending_uploads_lock:
+            self.pending_uploads.add(future)
+        future.add_done_callback(self.upload_done)
 
-            blob.upload_from_string(data=json.dumps(data), content_type='application/json')
+    def upload_done(self, future):
+        with self.pending_uploads_lock:
+            self.pending_uploads.discard(future)
+
+    def wait_for_uploads(self):
+        # Waits for this site's uploads only; failures were already counted and reported by the upload queue
+        with self.pending_uploads_lock:
+            pending = set(self.pending_uploads)
+        concurrent.futures.wait(pending)
 
     def get_embeddings(self, text):
         try:
@@ -127,36 +215,81 @@ class MadeInDurhamWebScanner:
             print(f"Error generating embeddings: {e}")
             return []
 
+    def get_embeddings_batch(self, chunks):
+        if not chunks:
+            return []
+        try:
+            with self.metrics.time("embed"):
+                return self.embedding_batcher.embed(chunks)
+        except Exception as e:
+            print(f"Error generating embeddings: {e}")
+            self.metrics.inc("embed_errors")
+            return [[] for _ in chunks]
+
     def is_valid_url(self, url):
         parsed_url = urlparse(url)
-        return bool(parsed_url.scheme) and bool(parsed_url.netloc) and urlparse(self.base_url).netloc in urlparse(url).netloc
+        if self.sitemap_seeder is not None and not self.sitemap_seeder.allowed(url):
+            return False
+        return bool(parsed_url.scheme) and bool(parsed_url.netloc) and site_host(self.base_url) in site_host(url)
 
     def process_url(self, url):
-        content = self.fetch_content(url)
+        # Returns the links to queue in the frontier
+        content, kind, content_type = self.fetch_content(url)
+        urls = []
         if content:
             parsed_url = urlparse(url)
-            if parsed_url.path.endswith(".pdf"):
-                body_text = self.parse_pdf(content)
-                meta_info = [{'name': 'title', 'content': os.path.basename(parsed_url.path)}]
-                self.save_text_and_embeddings_to_gcs(meta_info, body_text, url)
+            if kind == PDF:
+                with self.metrics.time("parse"):
+                    chunks = self.parse_pdf(content, url)
+                if chunks is not None:
+                    meta_info = [{'name': 'title', 'content': os.path.basename(parsed_url.path)}]
+                    self.save_text_and_embeddings_to_gcs(meta_info, None, url, chunks)
             else:
-                meta_info, body_text, soup = self.parse_web_page(content, url)
-                if soup:
+                with self.metrics.time("parse"):
+                    meta_info, body_text, links = self.parse_web_page(content, url, content_type)
+                if links is not None:
                     self.save_text_and_embeddings_to_gcs(meta_info, body_text, url)
-                    # Extract URLs from the current page and add them to the list of URLs to visit
-                    urls = [urljoin(url, link.get('href')) for link in soup.find_all('a', href=True)]
-                    for new_url in urls:
-                        if self.is_valid_url(new_url) and new_url not in self.visited_urls and new_url not in self.urls_to_visit:
-                            self.urls_to_visit.add(new_url)
-        return None
+                    urls = [new_url for new_url in links if self.is_valid_url(new_url)]
+        return self.canonicalizer.filter(urls)
 
     def start_scanning(self):
-        while self.urls_to_visit and len(self.visited_urls) < self.max_urls_to_visit:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                future_to_url = {executor.submit(self.process_url, url): url for url in self.urls_to_visit}
-                self.urls_to_visit = set()
-                for future in concurrent.futures.as_completed(future_to_url):
-                    future.result()
+        # Resumes the frontier left by an interrupted run, then queues the base URL and the sitemap pages, most recently changed first
+        self.frontier.start(self.canonicalizer.filter([self.base_url]), priority=SEED_PRIORITY)
+        if self.sitemap_seeder is not None:
+            entries = self.sitemap_seeder.seed(self.base_url, self.is_valid_url, limit=self.max_urls_to_visit)
+            # robots.txt has just been read; the rate limiter takes its Crawl-delay from the same text
+            self.rate_limiter.configure_from_robots(self.base_url, lambda robots_url: self.sitemap_seeder.robots_text)
+            for priority in sorted({entry.priority for entry in entries}, reverse=True):
+                self.frontier.add(self.canonicalizer.filter([entry.url for entry in entries if entry.priority == priority]), priority=priority)
+        self.metrics.start()
+        try:
+            # crawl releases URLs still claimed when it is interrupted, and finishes (clears) the frontier once it completes
+            self.final_counts = crawl(self.frontier, self.process_url, self.max_urls_to_visit, workers=10)
+        finally:
+            if self.shard_writer is not None:
+                self.shard_writer.flush()
+            # A shared queue is closed by whoever created it
+            self.wait_for_uploads()
+            if self.owns_upload_queue:
+                self.upload_queue.close()
+                self.upload_queue.report()
+            # After wait_for_uploads, so the upload stage and bytes cover every chunk of this site
+            self.metrics.stop()
+            self.metrics.export()
+            self.metrics.report()
+            if self.final_counts is None:
+                self.final_counts = self.frontier.counts()
+            # Closes the SQLite connections of the crawler threads and the gauge sampler
+            self.frontier.close()
+        self.rate_limiter.report()
+        self.pdf_extractor.report()
+        self.pdf_extractor.close()
+        if self.owns_embedding_batcher:
+            self.embedding_batcher.close()
+        self.boilerplate.report()
+        self.canonicalizer.report(self.base_url)
+        if self.sitemap_seeder is not None:
+            self.sitemap_seeder.report(self.base_url)
 
 def main():
     bucket_name = 'durham-bot'
@@ -0,0 +1,190 @@
+import asyncio
+import concurrent.futures
+import functools
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+from crawl_frontier import CLAIMED, DONE
+from crawl_manifest import NOT_MODIFIED
+from fetch_stream import SkipContent, read_response_async
+
+
+class AsyncCrawlEngine:
+    """Asyncio crawl loop with a continuous frontier.
+
+    Up to `concurrency` fetches are in flight at any time, at most `per_host_limit` of them against
+    the same host. A new URL starts as soon as any fetch finishes instead of waiting for a whole wave.
+    Responses are streamed and dropped early when they sniff as unsupported media or pass
+    `max_content_size`. Fetched content is handed to `process_content(url, content, kind, content_type)`,
+    where kind is the sniffed html/pdf/xml/text type and content_type the response header, in an executor, since
+    parsing and embedding are CPU-bound; it returns the links to follow. With a CrawlManifest the
+    requests are conditional, and a 304 is handed on as NOT_MODIFIED so the stored links are followed.
+    With a URLCanonicalizer, a response redirected to a page already crawled under another URL is dropped.
+
+    With a `frontier` (crawl_frontier.MemoryFrontier or SQLiteFrontier) URLs are claimed from it and
+    their links added to it, as in crawl_frontier.crawl, so an interrupted async crawl resumes from
+    the same SQLite database as a threaded one; call its `start` before crawling. Without one the
+    URLs are kept in memory and an interrupted crawl starts over.
+    """
+
+    def __init__(self, process_content, is_valid_url=None, max_urls_to_visit=300, concurrency=50, per_host_limit=4, timeout=30, headers=None, executor=None, max_content_size=10 * 1024 * 1024, rate_limiter=None, manifest=None, canonicalizer=None,
+                 frontier=None, idle_wait=1.0):
+        self.process_content = process_content
+        self.is_valid_url = is_valid_url or (lambda url: True)
+        self.max_urls_to_visit = max_urls_to_visit
+        self.concurrency = concurrency
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.executor = executor
+        self.max_content_size = max_content_size
+        self.rate_limiter = rate_limiter
+        self.manifest = manifest
+        self.canonicalizer = canonicalizer
+        self.frontier = frontier
+        self.idle_wait = idle_wait
+
+        self.seen_urls = set()
+        self.host_semaphores = {}
+        self.stats = {"fetched": 0, "not_modified": 0, "skipped": 0, "duplicates": 0, "errors": 0, "bytes": 0, "seconds": 0.0}
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).netloc
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return self.host_semaphores[host]
+
+    def _enqueue(self, queue, url):
+        # The frontier only ever admits max_urls_to_visit distinct URLs
+        if url in self.seen_urls or len(self.seen_urls) >= self.max_urls_to_visit:
+            return
+        self.seen_urls.add(url)
+        queue.put_nowait(url)
+
+    async def _fetch(self, session, url):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire_async(url)
+        async with self._host_semaphore(url):
+            headers = self.headers
+            if self.manifest is not None:
+                headers = dict(self.headers, **self.manifest.conditional_headers(url))
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        return NOT_MODIFIED, None, None
+                    if response.status in (429, 503) and self.rate_limiter is not None:
+                        delay = self.rate_limiter.penalize(url, response.headers.get("Retry-After"))
+                        print(f"{response.status} for URL: {url}. Backing off {urlparse(url).netloc} for {delay:.0f} seconds.")
+                        return None, None, None
+                    response.raise_for_status()
+                    if self.canonicalizer is not None and str(response.url) != url and self.canonicalizer.redirected(url, str(response.url)):
+                        self.stats["duplicates"] += 1
+                        return None, None, None
+                    content, kind = await read_response_async(response, url, self.max_content_size)
+                    if self.manifest is not None:
+                        self.manifest.stage(url, response.headers)
+                    return content, kind, response.headers.get("Content-Type")
+            except SkipContent as e:
+                print(f"Skipping URL {url}: {e}")
+                self.stats["skipped"] += 1
+                return None, None, None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Error fetching URL {url}: {e}")
+                self.stats["errors"] += 1
+                return None, None, None
+
+    async def _visit(self, session, url, loop):
+        # Fetches and processes one URL; returns the valid links found on it
+        content, kind, content_type = await self._fetch(session, url)
+        if content is NOT_MODIFIED:
+            self.stats["not_modified"] += 1
+        elif content:
+            self.stats["fetched"] += 1
+            self.stats["bytes"] += len(content)
+        if not content:
+            return []
+        new_urls = await loop.run_in_executor(self.executor, self.process_content, url, content, kind, content_type)
+        return [new_url for new_url in new_urls or [] if self.is_valid_url(new_url)]
+
+    async def _worker(self, session, queue, loop):
+        while True:
+            url = await queue.get()
+            try:
+                for new_url in await self._visit(session, url, loop):
+                    self._enqueue(queue, new_url)
+            except Exception as e:
+                print(f"Error processing URL {url}: {e}")
+                self.stats["errors"] += 1
+            finally:
+                queue.task_done()
+
+    async def _visit_claimed(self, session, url, depth, loop):
+        # SQLite calls run in the default executor so a busy database never blocks the event loop
+        try:
+            links = await self._visit(session, url, loop)
+        except Exception as e:
+            print(f"Error processing URL {url}: {e}")
+            self.stats["errors"] += 1
+            await loop.run_in_executor(None, self.frontier.fail, url)
+            return
+        if links:
+            await loop.run_in_executor(None, functools.partial(self.frontier.add, links, depth=depth + 1))
+        await loop.run_in_executor(None, self.frontier.complete, url)
+
+    async def _crawl_frontier(self, session, loop):
+        # Same loop as crawl_frontier.crawl, with tasks in place of threads
+        tasks = set()
+        try:
+            while True:
+                counts = await loop.run_in_executor(None, self.frontier.counts)
+                room = min(self.concurrency - len(tasks), self.max_urls_to_visit - counts[DONE] - len(tasks))
+                if room > 0:
+                    for url, depth in await loop.run_in_executor(None, self.frontier.claim, room):
+                        tasks.add(asyncio.create_task(self._visit_claimed(session, url, depth, loop)))
+                if not tasks:
+                    if counts[DONE] >= self.max_urls_to_visit or not counts[CLAIMED]:
+                        break
+                    await asyncio.sleep(self.idle_wait)
+                    continue
+                _, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # URLs still claimed after an interrupt go back to the queue for the next run
+            self.frontier.release()
+        self.stats["frontier"] = self.frontier.finish()
+
+    async def crawl(self, seed_urls):
+        """Crawls from the seed URLs until the frontier is empty or max_urls_to_visit is reached."""
+        start = time.time()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        if self.frontier is not None:
+            self.frontier.add(seed_urls)
+        else:
+            for url in seed_urls:
+                self._enqueue(queue, url)
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host_limit)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            if self.frontier is not None:
+                await self._crawl_frontier(session, loop)
+            else:
+                workers = [asyncio.create_task(self._worker(session, queue, loop)) for _ in range(self.concurrency)]
+                await queue.join()
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+        self.stats["seconds"] = time.time() - start
+        return self.stats
+
+
+def run_crawl(process_content, seed_urls, executor_workers=4, **engine_options):
+    """Runs an AsyncCrawlEngine to completion from synchronous code and returns its stats."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=executor_workers) as executor:
+        engine = AsyncCrawlEngine(process_content, executor=executor, **engine_options)
+        return asyncio.run(engine.crawl(seed_urls))
@@ -0,0 +1,118 @@
+import argparse
+import concurrent.futures
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+from async_crawl import run_crawl
+
+LINK_PATTERN = re.compile(rb'href="([^"]+)"')
+
+
+class FixtureSiteHandler(BaseHTTPRequestHandler):
+    """Serves a synthetic nonprofit site: every page links to a few others and responds with a random delay."""
+
+    pages_per_site = 60
+    links_per_page = 6
+    min_delay = 0.01
+    max_delay = 0.3
+
+    def do_GET(self):
+        time.sleep(random.uniform(self.min_delay, self.max_delay))
+        page = int(self.path.strip("/").replace("page", "") or 0) if self.path.strip("/") else 0
+        rng = random.Random(page)
+        links = "".join(f'<a href="/page{rng.randrange(self.pages_per_site)}">Program {i}</a>' for i in range(self.links_per_page))
+        body = f"<html><head><title>Page {page}</title></head><body><p>{'Community services in Durham. ' * 50}</p>{links}</body></html>".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_sites(count):
+    """Starts one local HTTP server per fixture site and returns their base URLs."""
+    servers = []
+    for _ in range(count):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureSiteHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers, [f"http://127.0.0.1:{server.server_address[1]}/" for server in servers]
+
+
+def extract_links(url, content, kind=None, content_type=None):
+    return [urljoin(url, link.decode()) for link in LINK_PATTERN.findall(content)]
+
+
+def crawl_in_waves(seed_urls, max_urls_to_visit, max_workers=10):
+    """The original start_scanning loop: a fresh thread pool per wave, waiting for the slowest URL."""
+    visited = set()
+    to_visit = set(seed_urls)
+    start = time.time()
+
+    def process(url):
+        try:
+            response = requests.get(url, timeout=30)
+            response.raise_for_status()
+        except requests.RequestException:
+            return []
+        visited.add(url)
+        return extract_links(url, response.content)
+
+    while to_visit and len(visited) < max_urls_to_visit:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(process, url) for url in to_visit]
+            to_visit = set()
+            for future in concurrent.futures.as_completed(futures):
+                for new_url in future.result():
+                    if new_url not in visited:
+                        to_visit.add(new_url)
+    return {"fetched": len(visited), "seconds": time.time() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the wave crawler against the asyncio crawl engine on local fixture sites.")
+    parser.add_argument("--sites", type=int, default=10)
+    parser.add_argument("--max-urls", type=int, default=50, help="Pages per site")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--per-host-limit", type=int, default=4)
+    args = parser.parse_args()
+
+    servers, base_urls = start_fixture_sites(args.sites)
+
+    # The scanners crawl one site at a time in waves
+    start = time.time()
+    wave_pages = 0
+    for base_url in base_urls:
+        wave_pages += crawl_in_waves([base_url], args.max_urls)["fetched"]
+    wave_seconds = time.time() - start
+
+    # The async engine keeps every site's frontier busy at once
+    hosts = {urlparse(url).netloc for url in base_urls}
+    stats = run_crawl(
+        extract_links,
+        base_urls,
+        max_urls_to_visit=args.max_urls * args.sites,
+        concurrency=args.concurrency,
+        per_host_limit=args.per_host_limit,
+        is_valid_url=lambda url: urlparse(url).netloc in hosts,
+    )
+
+    print(f"{args.sites} fixture sites, up to {args.max_urls} pages each")
+    print(f"  waves:  {wave_pages} pages in {wave_seconds:.1f}s ({wave_pages / wave_seconds:.1f} pages/s)")
+    print(f"  asyncio: {stats['fetched']} pages in {stats['seconds']:.1f}s ({stats['fetched'] / stats['seconds']:.1f} pages/s)")
+
+    for server in servers:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
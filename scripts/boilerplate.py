@@ -0,0 +1,104 @@
+import json
+import math
+import os
+import threading
+
+from crawl_manifest import content_hash
+
+
+def boilerplate_path(manifest_path):
+    """The detector's state is kept next to the site's crawl manifest."""
+    return manifest_path[:-len(".json")] + ".boilerplate.json" if manifest_path.endswith(".json") else manifest_path + ".boilerplate"
+
+
+class BoilerplateDetector:
+    """Learns the text blocks that repeat across a site's pages and strips them before chunking.
+
+    Every block (a paragraph, list item, heading, table cell...) records the pages it was found on.
+    A block found on `min_pages` different pages is navigation, footer, banner or cookie-notice
+    text: it is left out of every other page's text, so it is not chunked, embedded or stored again.
+    The first `min_pages - 1` pages it was seen on keep it, which means repeated real content is
+    still indexed somewhere and those pages' chunks stay the same from one crawl to the next. With a
+    path the state persists between crawls, since pages skipped as unchanged are not parsed again.
+    """
+
+    def __init__(self, path=None, min_pages=3, chunk_size=2048, max_blocks=50000):
+        self.path = path
+        self.min_pages = min_pages
+        self.chunk_size = chunk_size
+        self.max_blocks = max_blocks
+        # Block hash -> the first min_pages pages (as short URL hashes) it was found on
+        self.pages = {}
+        self.stats = {"pages": 0, "blocks": 0, "blocks_stripped": 0, "chars": 0, "chars_stripped": 0, "chunks_saved": 0}
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.pages = json.load(f).get("blocks", {})
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ignoring unreadable boilerplate file {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps({"blocks": self.pages})
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(self.path + ".tmp", self.path)
+
+    def _prune(self):
+        # Blocks seen on a single page are almost always real content; drop them first when the table is full
+        self.pages = {digest: pages for digest, pages in self.pages.items() if len(pages) > 1}
+        if len(self.pages) > self.max_blocks:
+            keep = sorted(self.pages.items(), key=lambda item: len(item[1]), reverse=True)[:self.max_blocks // 2]
+            self.pages = dict(keep)
+
+    def strip(self, url, blocks):
+        """Records a page's blocks and returns its text without the ones that repeat across the site."""
+        page = content_hash(url)[:12]
+        digests = [content_hash(block) for block in blocks]
+        kept = []
+        with self._lock:
+            for digest in set(digests):
+                pages = self.pages.setdefault(digest, [])
+                if page not in pages and len(pages) < self.min_pages:
+                    pages.append(page)
+            for block, digest in zip(blocks, digests):
+                pages = self.pages[digest]
+                if len(pages) < self.min_pages or page in pages[:self.min_pages - 1]:
+                    kept.append(block)
+            text = " ".join(kept)
+            original_chars = sum(len(block) for block in blocks) + max(len(blocks) - 1, 0)
+
+            self.stats["pages"] += 1
+            self.stats["blocks"] += len(blocks)
+            self.stats["blocks_stripped"] += len(blocks) - len(kept)
+            self.stats["chars"] += original_chars
+            self.stats["chars_stripped"] += original_chars - len(text)
+            self.stats["chunks_saved"] += math.ceil(original_chars / self.chunk_size) - math.ceil(len(text) / self.chunk_size)
+            if len(self.pages) > self.max_blocks:
+                self._prune()
+        return text
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["boilerplate_blocks"] = sum(1 for pages in self.pages.values() if len(pages) >= self.min_pages)
+        return stats
+
+    def report(self):
+        stats = self.summary()
+        if not stats["pages"]:
+            return
+        share = stats["chars_stripped"] / stats["chars"] if stats["chars"] else 0.0
+        # Every chunk that is not cut is one embedding input and one stored chunk fewer
+        print(f"Boilerplate: stripped {stats['blocks_stripped']} of {stats['blocks']} blocks ({share:.0%} of text) from {stats['pages']} pages, "
+              f"saving {stats['chunks_saved']} chunks and embedding calls; {stats['boilerplate_blocks']} repeated blocks known")
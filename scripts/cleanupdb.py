@@ -1,61 +1,34 @@
-from google.cloud import storage
-from google.oauth2 import service_account
+import os
+import sys
 from sentence_transformers import SentenceTransformer
 import json
-import numpy as np
 import streamlit as st
 from sklearn.metrics.pairwise import cosine_similarity
-import concurrent.futures  # Import concurrent.futures
 from tqdm import tqdm  # Import tqdm for progress bars
 
+# Shared modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from resources import gcs_credentials_from_secrets
+from storage_backend import storage_from_env
+
 # Initialize SentenceTransformer model
 embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
 
-# Load GCS credentials
-gcs_credentials = {
-    "type": "service_account",
-    "project_id": st.secrets["gcs"]["project_id"],
-    "private_key_id": st.secrets["gcs"]["private_key_id"],
-    "private_key": st.secrets["gcs"]["private_key"].replace('\\n', '\n'),
-    "client_email": st.secrets["gcs"]["client_email"],
-    "client_id": st.secrets["gcs"]["client_id"],
-    "auth_uri": st.secrets["gcs"]["auth_uri"],
-    "token_uri": st.secrets["gcs"]["token_uri"],
-    "auth_provider_x509_cert_url": st.secrets["gcs"]["auth_provider_x509_cert_url"],
-    "client_x509_cert_url": st.secrets["gcs"]["client_x509_cert_url"]
-}
-
-# Initialize Google Cloud Storage client with credentials
-credentials = service_account.Credentials.from_service_account_info(gcs_credentials)
-storage_client = storage.Client(credentials=credentials)
+# Storage is GCS with credentials from Streamlit secrets unless STORAGE_BACKEND selects local or in-memory storage
 bucket_name = "community_resource_nc"
-bucket = storage_client.bucket(bucket_name)
-
-# Function to download a single blob
-def download_blob(blob):
-    try:
-        content = blob.download_as_text()
-        data = json.loads(content)
-        return (blob.name, data)
-    except json.JSONDecodeError:
-        print(f"Skipping non-JSON blob: {blob.name}")
-        return None
-    except Exception as e:
-        print(f"Error downloading blob {blob.name}: {str(e)}")
-        return None
+storage = storage_from_env(bucket_name, credentials_info=lambda: gcs_credentials_from_secrets(st.secrets))
 
-# Function to download blobs from GCS in parallel
-def download_blobs(blobs, max_workers=10):
+# Function to download blobs in parallel
+def download_blobs(blob_names, max_workers=10):
     documents = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_blob = {executor.submit(download_blob, blob): blob for blob in blobs}
-        for future in tqdm(concurrent.futures.as_completed(future_to_blob), total=len(future_to_blob), desc="Downloading blobs"):
-            try:
-                result = future.result()
-                if result:
-                    documents.append(result)
-            except Exception as e:
-                print(f"Error in future: {str(e)}")
+    for name, content in tqdm(storage.get_many(blob_names, max_workers=max_workers), total=len(blob_names), desc="Downloading blobs"):
+        if isinstance(content, Exception):
+            print(f"Error downloading blob {name}: {str(content)}")
+            continue
+        try:
+            documents.append((name, json.loads(content)))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print(f"Skipping non-JSON blob: {name}")
     return documents
 
 # Function to generate embeddings using SentenceTransformer
@@ -86,17 +59,15 @@ def deduplicate_documents(documents, similarity_threshold=0.85):
             unique_vectors.append(embeddings)
     return unique_documents
 
-# Function to upload cleaned data to GCS
+# Function to upload cleaned data in parallel
 def upload_cleaned_data(cleaned_documents):
-    for i, (original_name, doc) in enumerate(tqdm(cleaned_documents, desc="Uploading cleaned data")):
-        blob_name = f"cleaned_data/doc_{i}.json"
-        blob = bucket.blob(blob_name)
-        blob.upload_from_string(json.dumps(doc), content_type='application/json')
-        print(f"Uploaded {blob_name}")
+    items = [(f"cleaned_data/doc_{i}.json", json.dumps(doc)) for i, (_, doc) in enumerate(cleaned_documents)]
+    storage.put_many(items, content_type='application/json')
+    print(f"Uploaded {len(items)} cleaned documents")
 
 # Main function to clean the database
 def clean_database(max_blobs=None, batch_size=100):
-    blobs = list(bucket.list_blobs())
+    blobs = [info.name for info in storage.list()]
     if max_blobs:
         blobs = blobs[:max_blobs]
 
@@ -1,50 +1,118 @@
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning, module="huggingface_hub")
 
-from bs4 import BeautifulSoup, FeatureNotFound
 import requests
-import io
 import json
 import hashlib
-import time
-import concurrent.futures
 import threading
+import concurrent.futures
 import os
+import sys
 import glob
-import random
-import re
-import chardet
-from google.api_core.exceptions import ServiceUnavailable
-from requests.exceptions import ConnectionError, HTTPError
-from google.cloud import storage
-from google.oauth2 import service_account
-from PyPDF2 import PdfReader
-from urllib.parse import urljoin, urlparse
+from requests.exceptions import HTTPError
+from urllib.parse import urlparse
 from sentence_transformers import SentenceTransformer
+from async_crawl import run_crawl
+from rate_limiter import HostRateLimiter
+from fetch_stream import PDF, SNIFF_BYTES, SkipContent, read_response, sniff_content_kind
+from html_extract import extract_page
+from pdf_extract import PdfExtractor, chunk_pages
+from boilerplate import BoilerplateDetector, boilerplate_path
+from crawl_frontier import MemoryFrontier, SQLiteFrontier, crawl, frontier_path
+from crawl_manifest import NOT_MODIFIED, CrawlManifest, content_hash, crawl_manifest_path
+from upload_queue import UploadQueue
+from url_canon import URLCanonicalizer, clean_url, site_host
+from sitemap_seed import SEED_PRIORITY, SitemapSeeder, session_fetcher
+from crawl_metrics import CrawlMetrics, metrics_path
+
+# Shared modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunk_shards import ShardWriter
+from storage_backend import ObjectNotFound, storage_from_env
 
 class ComResGuideWebScanner:
-    def __init__(self, base_url, bucket_name, credentials_path, embedding_model_name='all-MiniLM-L6-v2', max_urls_to_visit=300, chunk_size=2048, rate_limit=10, time_window=60):
+    def __init__(self, base_url, bucket_name, credentials_path=None, embedding_model_name='all-MiniLM-L6-v2', max_urls_to_visit=300, chunk_size=2048, rate_limit=10, time_window=60, storage_format='json', max_content_size=10*1024*1024,
+                 storage=None, embedding_model=None, session=None, rate_limiter=None, fetch_semaphore=None, shard_writer=None, embedding_batcher=None,
+                 manifest_dir='crawl_manifests', manifest=None, upload_queue=None, pdf_extractor=None, strip_boilerplate=True, frontier=None,
+                 canonicalizer=None, metrics=None, metrics_format='json', use_sitemaps=True):
         self.visited_urls = set()
-        self.urls_to_visit = set([base_url])
         self.base_url = base_url
         self.max_urls_to_visit = max_urls_to_visit
         self.bucket_name = bucket_name
         self.chunk_size = chunk_size
 
-        # Rate limiting parameters
+        # Rate limiting parameters: a token bucket per host, so one slow host does not hold up the others
         self.rate_limit = rate_limit
         self.time_window = time_window
-        self.requests_made = 0
-        self.start_time = time.time()
-        self.lock = threading.Lock()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else HostRateLimiter(rate_limit, time_window)
+
+        # A CrawlOrchestrator passes in its shared storage, model and connection pool; a standalone scanner builds its own
+        self.storage = storage if storage is not None else storage_from_env(bucket_name, credentials_path=credentials_path)
+
+        # 'json' writes one blob per chunk; 'shards' batches chunks into compact binary shards
+        self.storage_format = storage_format
+        if shard_writer is None and storage_format == 'shards':
+            shard_writer = ShardWriter(self.storage)
+        self.shard_writer = shard_writer
+
+        # Chunk blobs are uploaded by a worker pool so slow GCS responses do not stall fetching
+        self.owns_upload_queue = upload_queue is None
+        self.upload_queue = upload_queue if upload_queue is not None else UploadQueue(self.storage)
+        # This site's uploads still in flight, by URL, so a shared queue's other sites are not waited for
+        self.pending_uploads = {}
+        self.pending_uploads_lock = threading.Lock()
 
-        # Load credentials from the JSON key file
-        self.credentials = service_account.Credentials.from_service_account_file(credentials_path)
-        self.storage_client = storage.Client(credentials=self.credentials)
-        self.bucket = self.storage_client.bucket(bucket_name)
+        # PDFs are parsed in worker processes, with page and time limits, instead of in the crawler threads
+        self.owns_pdf_extractor = pdf_extractor is None
+        self.pdf_extractor = pdf_extractor if pdf_extractor is not None else PdfExtractor()
 
         # Initialize Sentence-Transformers model
-        self.embedding_model = SentenceTransformer(embedding_model_name)
+        self.embedding_model = embedding_model if embedding_model is not None else SentenceTransformer(embedding_model_name)
+        # An EmbeddingBatcher shared by several scanners batches chunks across pages; without one each page is encoded in one call
+        self.embedding_batcher = embedding_batcher
+        self.embedding_batch_size = 64
+
+        # Pooled HTTP connections; fetch_semaphore caps in-flight requests across every scanner sharing it
+        self.session = session if session is not None else requests.Session()
+        self.fetch_semaphore = fetch_semaphore
+
+        # Responses are streamed and abandoned once they pass max_content_size or sniff as unsupported media
+        self.max_content_size = max_content_size
+        self.fetch_timeout = 30
+
+        # Validators and content hashes from earlier crawls, so unchanged pages are not parsed, embedded or uploaded again
+        if manifest is None and manifest_dir:
+            manifest = CrawlManifest(crawl_manifest_path(manifest_dir, bucket_name, base_url))
+        self.manifest = manifest
+
+        # Blocks of text repeated across this site's pages, kept next to the manifest
+        self.boilerplate = None
+        if strip_boilerplate:
+            path = boilerplate_path(crawl_manifest_path(manifest_dir, bucket_name, base_url)) if manifest_dir else None
+            self.boilerplate = BoilerplateDetector(path, chunk_size=chunk_size)
+
+        # Canonical keys of the URLs queued so far, so tracking-parameter, www/https and redirect variants are fetched once
+        self.canonicalizer = canonicalizer if canonicalizer is not None else URLCanonicalizer()
+
+        # URLs queued, in progress and done; stored in SQLite next to the manifest so an interrupted crawl resumes.
+        # The frontier stores each URL's canonical key too, so a resumed crawl does not queue variants again
+        self.owns_frontier = frontier is None
+        if frontier is None:
+            path = frontier_path(crawl_manifest_path(manifest_dir, bucket_name, base_url)) if manifest_dir else None
+            frontier = SQLiteFrontier(path, key=self.canonicalizer.key) if path else MemoryFrontier(key=self.canonicalizer.key)
+        self.frontier = frontier
+        # Counts when the scan ended, since a finished frontier is cleared and an owned one closed
+        self.final_counts = None
+
+        # Per-stage timers, counters and queue depths, exported next to the manifest at the end of each scan
+        if metrics is None:
+            path = metrics_path(crawl_manifest_path(manifest_dir, bucket_name, base_url), metrics_format) if manifest_dir else None
+            metrics = CrawlMetrics(path, format=metrics_format, labels={"site": urlparse(base_url).netloc})
+        self.metrics = metrics
+        self.metrics.gauge("frontier_queued", lambda: self.frontier.counts()["queued"])
+        self.metrics.gauge("upload_queue_depth", self.upload_queue.depth)
+        if self.embedding_batcher is not None:
+            self.metrics.gauge("embedding_queue_depth", lambda: self.embedding_batcher.stats()["queued"])
 
         # Domains to skip
         self.skip_domains = ["guidestar.org", "propublica.org", "causeiq.com", "charitynavigator.org", "facebook.com"]
@@ -54,112 +122,133 @@ class ComResGuideWebScanner:
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
         }
 
-    def fetch_content(self, url):
-        with self.lock:
-            current_time = time.time()
-            elapsed_time = current_time - self.start_time
-
-            if elapsed_time > self.time_window:
-                self.start_time = current_time
-                self.requests_made = 0
+        # robots.txt and sitemaps seed the frontier before the crawl, and robots.txt Disallow rules apply to every link
+        self.sitemap_seeder = SitemapSeeder(session_fetcher(self.session, self.headers, self.rate_limiter, self.fetch_timeout)) if use_sitemaps else None
+        # Sitemap lastmod per URL, so pages stored since their last change are not fetched again
+        self.sitemap_lastmod = {}
 
-            if self.requests_made >= self.rate_limit:
-                sleep_time = self.time_window - elapsed_time + random.uniform(0, 5)
-                print(f"Rate limit reached. Sleeping for {sleep_time:.2f} seconds...")
-                time.sleep(sleep_time)
-                self.start_time = time.time()
-                self.requests_made = 0
+    def fetch_content(self, url):
+        self.rate_limiter.configure_from_robots(url, self.fetch_robots_txt)
+        with self.metrics.time("rate_limit_wait"):
+            self.rate_limiter.acquire(url)
 
-            self.requests_made += 1
+        headers = self.headers
+        if self.manifest is not None:
+            headers = dict(self.headers, **self.manifest.conditional_headers(url))
 
         try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
-            return response.content
+            if self.fetch_semaphore is not None:
+                with self.fetch_semaphore:
+                    return self.read_content(url, headers)
+            return self.read_content(url, headers)
+        except SkipContent as e:
+            print(f"Skipping URL {url}: {e}")
+            self.metrics.inc("pages_skipped")
+            return None, None, None
         except HTTPError as e:
-            if e.response.status_code == 403:
+            e.response.close()
+            self.metrics.inc("fetch_errors")
+            if e.response.status_code in (429, 503):
+                delay = self.rate_limiter.penalize(url, e.response.headers.get('Retry-After'))
+                print(f"{e.response.status_code} for URL: {url}. Backing off {urlparse(url).netloc} for {delay:.0f} seconds.")
+            elif e.response.status_code == 403:
                 print(f"403 Forbidden error for URL: {url}")
             else:
                 print(f"HTTP error: {e}")
-            return None
+            return None, None, None
         except requests.RequestException as e:
             print(f"Error fetching URL: {e}")
+            self.metrics.inc("fetch_errors")
+            return None, None, None
+
+    def read_content(self, url, headers):
+        # Returns (content, kind, content_type) where kind is the sniffed html/pdf/xml/text type
+        with self.metrics.time("fetch"):
+            response = self.session.get(url, headers=headers, stream=True, timeout=self.fetch_timeout)
+            if response.status_code == 304:
+                response.close()
+                self.metrics.inc("pages_not_modified")
+                return NOT_MODIFIED, None, None
+            response.raise_for_status()
+            if response.url != url and self.canonicalizer.redirected(url, response.url):
+                # Redirected to a page that is crawled under another URL; skip the body
+                response.close()
+                return None, None, None
+            content, kind = read_response(response, url, self.max_content_size)
+        self.metrics.inc("pages_fetched")
+        self.metrics.inc("bytes_fetched", len(content))
+        if self.manifest is not None:
+            self.manifest.stage(url, response.headers)
+        return content, kind, response.headers.get('Content-Type')
+
+    def fetch_robots_txt(self, robots_url):
+        try:
+            response = self.session.get(robots_url, headers=self.headers, timeout=10)
+            return response.text if response.status_code == 200 else None
+        except requests.RequestException:
             return None
 
-    def parse_pdf(self, pdf_content):
+    def parse_pdf(self, pdf_content, url):
+        # Returns the PDF's text chunks; pages are extracted in the PDF worker pool and chunked as they arrive
         try:
-            pdf_reader = PdfReader(io.BytesIO(pdf_content))
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
+            return list(chunk_pages(self.pdf_extractor.pages(pdf_content, url), self.chunk_size))
         except Exception as e:
             print(f"Error reading PDF: {e}")
             return None
 
-    def parse_web_page(self, content, url):
+    def parse_web_page(self, content, url, content_type=None):
+        # Returns the page's meta tags, normalized body text and absolute links, or ([], '', None) if it was already parsed
         if content and url not in self.visited_urls:
-            detected = chardet.detect(content)
-            encoding = detected['encoding'] if detected['encoding'] is not None else 'utf-8'
-            html_content = content.decode(encoding, errors='replace')
-
-            # Determine if the content is XML or HTML
-            soup = None
-            if html_content.strip().startswith('<?xml'):
-                try:
-                    soup = BeautifulSoup(html_content, 'xml')
-                except Exception as e:
-                    print(f"Error parsing XML: {e}")
-            else:
-                for parser in ["html.parser", "lxml", "html5lib"]:
-                    try:
-                        soup = BeautifulSoup(html_content, parser)
-                        break
-                    except FeatureNotFound:
-                        continue
-                    except Exception as e:
-                        print(f"Error parsing with {parser}: {e}")
-                        continue
-
-            if soup is None:
-                print(f"Could not parse content for URL: {url}")
-                return [], '', None
-
-            # Extract meta information
-            meta_info = [meta.attrs for meta in soup.find_all('meta')]
-
-            # Extract body text
-            body_text = soup.get_text(separator='\n', strip=True)
-
-            # Clean up the body text
-            cleaned_body_text = self.clean_text(body_text)
+            page = extract_page(content, url, content_type)
+            if page.canonical and self.canonicalizer.canonical(url, page.canonical):
+                # The page's canonical URL is crawled too; its text is stored only there
+                self.visited_urls.add(url)
+                return page.meta_info, '', page.links
+            # Text repeated across the site (menus, footers, banners) is left out before chunking
+            text = self.boilerplate.strip(url, page.blocks) if self.boilerplate is not None else page.text
 
             # Add the URL to the visited set
             self.visited_urls.add(url)
 
-            return meta_info, cleaned_body_text, soup
+            return page.meta_info, text, page.links
         else:
             return [], '', None
 
-    def clean_text(self, text):
-        # Remove HTML tags
-        clean_text = re.sub(r'<.*?>', '', text)
-        # Normalize whitespace
-        clean_text = re.sub(r'\s+', ' ', clean_text).strip()
-        # Handle special characters
-        clean_text = clean_text.replace('\ufffd', ' ')
-        return clean_text
-
     def get_blob_name(self, url, index=0):
         # Generate a hash for the URL to use as a unique identifier
         return f"{hashlib.md5(url.encode()).hexdigest()}_{index}.json"
 
-    def save_text_and_embeddings_to_gcs(self, meta_info, body_text, url):
-        is_rfp = self.check_for_rfp(body_text)
-        chunks = [body_text[i:i + self.chunk_size] for i in range(0, len(body_text), self.chunk_size)]
-        for index, chunk in enumerate(chunks):
-            # Generate embeddings using Sentence-Transformers model
-            embeddings = self.get_embeddings(chunk)
+    def save_text_and_embeddings_to_gcs(self, meta_info, body_text, url, chunks=None):
+        # Returns the hashes of the chunks now stored for the URL (None where a chunk failed to embed);
+        # PDFs pass their chunks instead of the body text
+        with self.metrics.time("chunk"):
+            if chunks is None:
+                is_rfp = self.check_for_rfp(body_text)
+                chunks = [body_text[i:i + self.chunk_size] for i in range(0, len(body_text), self.chunk_size)]
+            else:
+                is_rfp = any(self.check_for_rfp(chunk) for chunk in chunks)
+            chunk_hashes = [content_hash(chunk) for chunk in chunks]
+            changed = self.manifest.changed_chunks(url, chunk_hashes) if self.manifest is not None else list(range(len(chunks)))
+        self.metrics.inc("chunks", len(chunks))
+        self.metrics.inc("chunks_changed", len(changed))
+        if self.manifest is not None and self.shard_writer is None:
+            self.delete_stale_chunks(url, len(chunks))
+
+        # Generate embeddings for the page's new and changed chunks together
+        chunk_embeddings = self.get_embeddings_batch([chunks[index] for index in changed])
+        shard_rows = []
+        for index, embeddings in zip(changed, chunk_embeddings):
+            chunk = chunks[index]
+            if not embeddings:
+                chunk_hashes[index] = None
+
+            if self.shard_writer is not None:
+                # Shards keep only the page title from the meta tags, and skip chunks that failed to embed
+                if not embeddings:
+                    continue
+                title = next((meta.get('content', '') for meta in meta_info if meta.get('name') == 'title' or meta.get('property') == 'og:title'), '')
+                shard_rows.append({"url": url, "title": title, "text": chunk, "embeddings": embeddings, "is_rfp": is_rfp, "chunk_index": index})
+                continue
 
             data = {
                 "url": url,
@@ -168,23 +257,45 @@ class ComResGuideWebScanner:
                 "embeddings": embeddings,
                 "is_rfp": is_rfp
             }
-            blob_name = self.get_blob_name(url, index)
-            blob = self.bucket.blob(blob_name)
-
-            # Retry logic for uploading to GCS
-            max_retries = 5
-            for attempt in range(max_retries):
-                try:
-                    blob.upload_from_string(data=json.dumps(data), content_type='application/json')
-                    break
-                except (ServiceUnavailable, ConnectionError) as e:
-                    if attempt < max_retries - 1:
-                        wait_time = (2 ** attempt) + random.uniform(0, 1)
-                        print(f"Service unavailable or connection error. Retrying in {wait_time:.2f} seconds...")
-                        time.sleep(wait_time)
-                    else:
-                        print(f"Failed to upload blob {blob_name} after {max_retries} attempts.")
-                        raise
+            self.queue_upload(self.get_blob_name(url, index), json.dumps(data), url)
+        if self.shard_writer is not None:
+            # The page's chunk count goes with its rows so older shards' rows for it are superseded
+            self.shard_writer.add_page(url, len(chunks), shard_rows)
+        return chunk_hashes
+
+    def queue_upload(self, name, data, url):
+        future = self.upload_queue.put(name, data, on_error=lambda name, error: self.upload_failed(url, error), metrics=self.metrics)
+        with self.pending_uploads_lock:
+            self.pending_uploads[future] = url
+        future.add_done_callback(self.upload_done)
+
+    def upload_done(self, future):
+        with self.pending_uploads_lock:
+            self.pending_uploads.pop(future, None)
+
+    def wait_for_uploads(self):
+        # Waits for this site's uploads only; a failure is forgotten here too, since on_error may still be running when wait returns
+        with self.pending_uploads_lock:
+            pending = dict(self.pending_uploads)
+        concurrent.futures.wait(pending)
+        for future, url in pending.items():
+            if future.exception() is not None:
+                self.upload_failed(url, future.exception())
+
+    def upload_failed(self, url, error):
+        # Called by the upload queue once its retries are exhausted; the page is redone on the next crawl
+        if self.manifest is not None:
+            self.manifest.forget(url)
+
+    def delete_stale_chunks(self, url, chunk_count):
+        # A page that shrank leaves blobs for chunk indices it no longer has
+        for index in range(chunk_count, len(self.manifest.chunk_hashes(url))):
+            try:
+                self.storage.delete(self.get_blob_name(url, index))
+            except ObjectNotFound:
+                pass
+            except Exception as e:
+                print(f"Error deleting stale chunk {self.get_blob_name(url, index)}: {e}")
 
     def check_for_rfp(self, text):
         return 'request for proposal' in text.lower() or 'rfp' in text.lower()
@@ -197,67 +308,210 @@ class ComResGuideWebScanner:
             print(f"Error generating embeddings: {e}")
             return []
 
+    def get_embeddings_batch(self, chunks):
+        if not chunks:
+            return []
+        try:
+            with self.metrics.time("embed"):
+                if self.embedding_batcher is not None:
+                    return self.embedding_batcher.embed(chunks)
+                return self.embedding_model.encode(chunks, batch_size=self.embedding_batch_size, show_progress_bar=False).tolist()
+        except Exception as e:
+            print(f"Error generating embeddings: {e}")
+            self.metrics.inc("embed_errors")
+            return [[] for _ in chunks]
+
     def is_valid_url(self, url):
         parsed_url = urlparse(url)
         domain = parsed_url.netloc
         if any(skip_domain in domain for skip_domain in self.skip_domains):
             print(f"Skipping URL with domain: {domain}")
             return False
-        return bool(parsed_url.scheme) and bool(parsed_url.netloc) and urlparse(self.base_url).netloc in urlparse(url).netloc
+        if self.sitemap_seeder is not None and not self.sitemap_seeder.allowed(url):
+            return False
+        return bool(parsed_url.scheme) and bool(parsed_url.netloc) and site_host(self.base_url) in site_host(url)
 
     def process_url(self, url):
-        content = self.fetch_content(url)
+        # Returns the links to queue in the frontier
+        lastmod = self.sitemap_lastmod.get(url)
+        if lastmod is not None and self.manifest is not None and self.manifest.unchanged_since(url, lastmod):
+            # The sitemap dates the page's last change before it was last stored; follow its stored links without fetching it
+            self.sitemap_seeder.count_unchanged()
+            self.visited_urls.add(url)
+            return self.canonicalizer.filter(self.manifest.not_modified(url))
+        content, kind, content_type = self.fetch_content(url)
+        return self.process_content(url, content, kind, content_type)
+
+    def process_content(self, url, content, kind=None, content_type=None):
+        # Parse fetched content, save its chunks and return the valid links found on the page that were not queued yet;
+        # kind is the type sniffed while fetching (or None to sniff it here), content_type the response header
+        new_urls = []
+        if content is NOT_MODIFIED:
+            # The server confirmed the page is unchanged; follow the links stored from the last crawl
+            self.visited_urls.add(url)
+            return self.canonicalizer.filter(self.manifest.not_modified(url))
         if content:
+            digest = content_hash(content)
+            if self.manifest is not None:
+                links = self.manifest.unchanged_links(url, digest)
+                if links is not None:
+                    self.visited_urls.add(url)
+                    return self.canonicalizer.filter(links)
+
+            chunk_hashes = None
             parsed_url = urlparse(url)
-            if parsed_url.path.endswith(".pdf"):
-                body_text = self.parse_pdf(content)
-                if body_text is not None:
+            kind = kind or sniff_content_kind(content_type, content[:SNIFF_BYTES], url)
+            if kind == PDF:
+                with self.metrics.time("parse"):
+                    chunks = self.parse_pdf(content, url)
+                if chunks is not None:
                     meta_info = [{'name': 'title', 'content': os.path.basename(parsed_url.path)}]
-                    self.save_text_and_embeddings_to_gcs(meta_info, body_text, url)
+                    chunk_hashes = self.save_text_and_embeddings_to_gcs(meta_info, None, url, chunks)
             else:
-                meta_info, body_text, soup = self.parse_web_page(content, url)
-                if soup:
-                    self.save_text_and_embeddings_to_gcs(meta_info, body_text, url)
-                    # Extract URLs from the current page and add them to the list of URLs to visit
-                    urls = [urljoin(url, link.get('href')) for link in soup.find_all('a', href=True)]
-                    for new_url in urls:
-                        if self.is_valid_url(new_url) and new_url not in self.visited_urls and new_url not in self.urls_to_visit:
-                            self.urls_to_visit.add(new_url)
-        return None
+                with self.metrics.time("parse"):
+                    meta_info, body_text, links = self.parse_web_page(content, url, content_type)
+                if links is not None:
+                    chunk_hashes = self.save_text_and_embeddings_to_gcs(meta_info, body_text, url)
+                    new_urls = [new_url for new_url in links if self.is_valid_url(new_url)]
+            if self.manifest is not None and chunk_hashes is not None:
+                self.manifest.record(url, digest, chunk_hashes, new_urls)
+        return self.canonicalizer.filter(new_urls)
+
+    def sitemap_entries(self):
+        # The site's sitemap pages, best first, with their lastmod recorded for process_url
+        entries = self.sitemap_seeder.seed(self.base_url, self.is_valid_url, limit=self.max_urls_to_visit)
+        # robots.txt has just been read; the rate limiter takes its Crawl-delay from the same text
+        self.rate_limiter.configure_from_robots(self.base_url, lambda robots_url: self.sitemap_seeder.robots_text)
+        self.sitemap_lastmod = {clean_url(entry.url, self.canonicalizer.strip_params): entry.lastmod for entry in entries if entry.lastmod is not None}
+        return entries
+
+    def seed_frontier(self):
+        # Resumes the frontier left by an interrupted run, then queues the base URL and the sitemap pages, most recently changed first
+        self.frontier.start(self.canonicalizer.filter([self.base_url]), priority=SEED_PRIORITY)
+        if self.sitemap_seeder is None:
+            return
+        entries = self.sitemap_entries()
+        for priority in sorted({entry.priority for entry in entries}, reverse=True):
+            self.frontier.add(self.canonicalizer.filter([entry.url for entry in entries if entry.priority == priority]), priority=priority)
 
     def start_scanning(self):
-        while self.urls_to_visit and len(self.visited_urls) < self.max_urls_to_visit:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                future_to_url = {executor.submit(self.process_url, url): url for url in self.urls_to_visit}
-                self.urls_to_visit = set()
-                for future in concurrent.futures.as_completed(future_to_url):
-                    future.result()
+        # State is saved even when this run is interrupted
+        self.seed_frontier()
+        self.metrics.start()
+        try:
+            self.final_counts = crawl(self.frontier, self.process_url, self.max_urls_to_visit, workers=10)
+        finally:
+            if self.shard_writer is not None:
+                self.shard_writer.flush()
+            self.finish_uploads()
+            self.save_manifest()
+            self.finish_metrics()
+            self.close_frontier()
+        self.rate_limiter.report()
+        self.finish_pdfs()
+        self.canonicalizer.report(self.base_url)
+        if self.sitemap_seeder is not None:
+            self.sitemap_seeder.report(self.base_url)
+
+    def progress(self):
+        counts = self.final_counts if self.final_counts is not None else self.frontier.counts()
+        progress = {"visited": counts["done"], "queued": counts["queued"] + counts["claimed"], "max_urls": self.max_urls_to_visit}
+        if self.boilerplate is not None:
+            progress["boilerplate_chunks_saved"] = self.boilerplate.summary()["chunks_saved"]
+        progress["fetches_avoided"] = self.canonicalizer.summary()["fetches_avoided"]
+        return progress
+
+    def close_frontier(self):
+        # Closes the SQLite connections of the crawler threads, gauge sampler and progress reporter; a frontier passed in is closed by its owner
+        if self.final_counts is None:
+            self.final_counts = self.frontier.counts()
+        if self.owns_frontier:
+            self.frontier.close()
+
+    def finish_uploads(self):
+        # The manifest is saved after this site's uploads settle; a shared queue is closed by whoever created it
+        self.wait_for_uploads()
+        if self.owns_upload_queue:
+            self.upload_queue.close()
+            self.upload_queue.report()
+
+    def save_manifest(self):
+        if self.manifest is not None:
+            self.manifest.save()
+            self.manifest.report()
+        if self.boilerplate is not None:
+            self.boilerplate.save()
+            self.boilerplate.report()
+
+    def finish_metrics(self):
+        # Called after finish_uploads, so the upload stage and bytes cover every chunk of this site even on a shared queue.
+        # Exported even when the scan was interrupted, since a slow or stuck crawl is what they are for
+        self.metrics.stop()
+        self.metrics.export()
+        self.metrics.report()
+
+    def finish_pdfs(self):
+        # A shared extractor is reported and closed by the orchestrator
+        if self.owns_pdf_extractor:
+            self.pdf_extractor.report()
+            self.pdf_extractor.close()
+
+    def start_scanning_async(self, concurrency=50, per_host_limit=4, timeout=30, executor_workers=4):
+        # Continuous asyncio crawl over the same frontier as start_scanning, so it resumes too; parsing and embedding run in a thread pool
+        self.seed_frontier()
+        self.rate_limiter.configure_from_robots(self.base_url, self.fetch_robots_txt)
+        self.metrics.start()
+        stats = None
+        try:
+            stats = run_crawl(
+                self.process_content,
+                [],
+                executor_workers=executor_workers,
+                max_urls_to_visit=self.max_urls_to_visit,
+                concurrency=concurrency,
+                per_host_limit=per_host_limit,
+                timeout=timeout,
+                headers=self.headers,
+                rate_limiter=self.rate_limiter,
+                manifest=self.manifest,
+                canonicalizer=self.canonicalizer,
+                frontier=self.frontier,
+            )
+            self.final_counts = stats["frontier"]
+        finally:
+            if self.shard_writer is not None:
+                self.shard_writer.flush()
+            self.finish_uploads()
+            self.save_manifest()
+            if stats is not None:
+                # The engine fetches, so its figures stand in for the fetch counters
+                self.metrics.inc("pages_fetched", stats["fetched"])
+                self.metrics.inc("pages_not_modified", stats["not_modified"])
+                self.metrics.inc("pages_skipped", stats["skipped"])
+                self.metrics.inc("bytes_fetched", stats["bytes"])
+                self.metrics.inc("fetch_errors", stats["errors"])
+            self.finish_metrics()
+            self.close_frontier()
+        self.rate_limiter.report()
+        self.finish_pdfs()
+        self.canonicalizer.report(self.base_url)
+        if self.sitemap_seeder is not None:
+            self.sitemap_seeder.report(self.base_url)
+        print(f"Crawled {stats['fetched']} pages ({stats['bytes'] / 1e6:.1f} MB) from {self.base_url} in {stats['seconds']:.1f}s")
+        return stats
 
 def main():
+    # Imported here because crawl_orchestrator builds ComResGuideWebScanner instances from this module
+    from crawl_orchestrator import CrawlOrchestrator, load_sites
+
     bucket_name = 'community_resource_nc'
     folder_path = r"C:\Users\Megha Patel\Documents\com docs"  # Path to the folder containing JSON files with websites
     credentials_path = r"C:\Users\Megha Patel\Downloads\community-resource-guide-3002b8ea07bb.json"  # Path to your service account JSON file
 
-    # Get list of JSON files in the folder
-    json_files = glob.glob(os.path.join(folder_path, '*.json'))
-
-    for json_file in json_files:
-        print(f"Processing file: {json_file}")
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-            for entry in data:
-                organization_name = entry.get("Organization Name")
-                zipcode = entry.get("Zipcode")
-                websites = entry.get("websites", {})
-                website = websites.get(organization_name)
-                if not website or any(domain in website for domain in ["guidestar.org", "propublica.org", "causeiq.com", "charitynavigator.org", "facebook.com"]):
-                    print(f"Skipping {organization_name} in zipcode {zipcode} due to invalid website: {website}")
-                    continue
-
-                print(f"Scanning website for {organization_name} in zipcode {zipcode}: {website}")
-                scanner = ComResGuideWebScanner(website, bucket_name, credentials_path)
-                scanner.start_scanning()
+    sites = load_sites(glob.glob(os.path.join(folder_path, '*.json')))
+    orchestrator = CrawlOrchestrator(bucket_name, credentials_path)
+    orchestrator.run(sites)
+    orchestrator.close()
 
 if __name__ == "__main__":
     main()
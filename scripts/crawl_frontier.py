@@ -0,0 +1,340 @@
+import concurrent.futures
+import heapq
+import itertools
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+QUEUED = "queued"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+
+
+def frontier_path(manifest_path):
+    """A site's frontier database is kept next to its crawl manifest."""
+    return manifest_path[:-len(".json")] + ".frontier.db" if manifest_path.endswith(".json") else manifest_path + ".frontier.db"
+
+
+def _worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MemoryFrontier:
+    """In-process frontier: the queue of URLs to crawl plus every URL already queued, claimed or done.
+
+    All operations hold one lock, so crawler threads can add links while others claim work. URLs are
+    claimed highest priority first, then shallowest depth first. With a `key` function, e.g.
+    URLCanonicalizer.key, URLs with the same key are admitted once.
+    """
+
+    def __init__(self, max_attempts=3, key=None):
+        self.max_attempts = max_attempts
+        self.key = key or (lambda url: url)
+        self._entries = {}
+        self._keys = set()
+        self._heap = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def start(self, seed_urls, priority=0):
+        """Begins a crawl: seeds the frontier unless it still holds unfinished work to resume."""
+        with self._lock:
+            if not any(entry["state"] in (QUEUED, CLAIMED) for entry in self._entries.values()):
+                self._entries.clear()
+                self._keys.clear()
+                self._heap = []
+        self.add(seed_urls, priority=priority)
+
+    def add(self, urls, depth=0, priority=0):
+        """Queues URLs that were never seen before and returns how many were new."""
+        added = 0
+        with self._lock:
+            for url in urls:
+                key = self.key(url)
+                if url in self._entries or key in self._keys:
+                    continue
+                self._keys.add(key)
+                self._entries[url] = {"state": QUEUED, "depth": depth, "priority": priority, "attempts": 0}
+                heapq.heappush(self._heap, (-priority, depth, next(self._order), url))
+                added += 1
+        return added
+
+    def claim(self, limit=1):
+        """Marks up to `limit` queued URLs as in progress and returns them as (url, depth) pairs."""
+        claimed = []
+        with self._lock:
+            while self._heap and len(claimed) < limit:
+                _, depth, _, url = heapq.heappop(self._heap)
+                entry = self._entries[url]
+                if entry["state"] != QUEUED:
+                    continue
+                entry["state"] = CLAIMED
+                entry["attempts"] += 1
+                claimed.append((url, entry["depth"]))
+        return claimed
+
+    def complete(self, url):
+        with self._lock:
+            self._entries[url]["state"] = DONE
+
+    def fail(self, url):
+        """Puts a URL whose processing raised back in the queue, or gives up on it after max_attempts."""
+        with self._lock:
+            entry = self._entries[url]
+            if entry["attempts"] < self.max_attempts:
+                entry["state"] = QUEUED
+                heapq.heappush(self._heap, (-entry["priority"], entry["depth"], next(self._order), url))
+            else:
+                entry["state"] = FAILED
+
+    def release(self):
+        """Returns every claimed URL to the queue, e.g. when a crawl is interrupted."""
+        with self._lock:
+            for url, entry in self._entries.items():
+                if entry["state"] == CLAIMED:
+                    entry["state"] = QUEUED
+                    entry["attempts"] -= 1
+                    heapq.heappush(self._heap, (-entry["priority"], entry["depth"], next(self._order), url))
+
+    def finish(self):
+        """Clears the frontier after a crawl ran to completion, so the next start begins a new crawl instead of resuming.
+
+        Returns the counts from just before it was cleared.
+        """
+        with self._lock:
+            counts = self._counts()
+            if not counts[CLAIMED]:
+                self._entries.clear()
+                self._keys.clear()
+                self._heap = []
+        return counts
+
+    def _counts(self):
+        counts = {QUEUED: 0, CLAIMED: 0, DONE: 0, FAILED: 0}
+        for entry in self._entries.values():
+            counts[entry["state"]] += 1
+        return counts
+
+    def counts(self):
+        with self._lock:
+            return self._counts()
+
+    def close(self):
+        pass
+
+
+class SQLiteFrontier:
+    """Frontier stored in a SQLite database, so a crawl survives a crash and can be shared by processes.
+
+    Claims run in BEGIN IMMEDIATE transactions and hand out leases: a URL claimed by a process that
+    died is queued again once its lease expires, or straight away when `start` finds that the
+    claiming process on this machine is gone. The database is in WAL mode so readers do not block
+    the process writing. Each thread uses its own connection. With a `key` function, e.g.
+    URLCanonicalizer.key, each URL's key is stored with it and URLs with the same key are admitted
+    once, so a resumed crawl does not queue variants of pages an earlier run already had.
+    """
+
+    def __init__(self, path, lease_seconds=600, max_attempts=3, key=None):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.key = key or (lambda url: url)
+        self.worker = _worker_id()
+        # One connection per thread; close() closes them all
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS frontier (
+            url TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            depth INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            lease_until REAL,
+            updated REAL NOT NULL,
+            url_key TEXT
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS frontier_claim ON frontier (state, priority DESC, depth)")
+        if "url_key" not in {row[1] for row in conn.execute("PRAGMA table_info(frontier)")}:
+            # Frontiers written before URL keys were stored
+            conn.execute("ALTER TABLE frontier ADD COLUMN url_key TEXT")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS frontier_key ON frontier (url_key)")
+        self._transaction(self._fill_keys)
+
+    def _fill_keys(self, conn):
+        # Rows without a key get one; of several rows with the same key the first keeps it
+        rows = conn.execute("SELECT url FROM frontier WHERE url_key IS NULL").fetchall()
+        conn.executemany("UPDATE OR IGNORE frontier SET url_key = ? WHERE url = ?", [(self.key(url), url) for (url,) in rows])
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; every write below opens its own transaction
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _transaction(self, work):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _requeue_dead_workers(self, conn):
+        host = socket.gethostname()
+        for (worker,) in conn.execute("SELECT DISTINCT worker FROM frontier WHERE state = ?", (CLAIMED,)).fetchall():
+            worker_host, _, pid = (worker or "").rpartition(":")
+            if worker_host == host and pid.isdigit() and worker != self.worker and not _pid_alive(int(pid)):
+                conn.execute("UPDATE frontier SET state = ?, worker = NULL, lease_until = NULL WHERE state = ? AND worker = ?", (QUEUED, CLAIMED, worker))
+
+    def start(self, seed_urls, priority=0):
+        """Begins a crawl. With unfinished work left by an earlier or concurrent run it resumes; otherwise it starts over from the seeds."""
+        def start(conn):
+            self._requeue_dead_workers(conn)
+            pending = conn.execute("SELECT COUNT(*) FROM frontier WHERE state IN (?, ?)", (QUEUED, CLAIMED)).fetchone()[0]
+            if not pending:
+                conn.execute("DELETE FROM frontier")
+            else:
+                print(f"Resuming crawl with {pending} URLs left in {self.path}")
+        self._transaction(start)
+        self.add(seed_urls, priority=priority)
+
+    def add(self, urls, depth=0, priority=0):
+        """Queues URLs that were never seen before and returns how many were new."""
+        urls = list(urls)
+        if not urls:
+            return 0
+        now = time.time()
+
+        def add(conn):
+            before = conn.total_changes
+            # A URL already in the frontier, or another URL with the same key, is ignored
+            conn.executemany("INSERT OR IGNORE INTO frontier (url, state, priority, depth, updated, url_key) VALUES (?, ?, ?, ?, ?, ?)",
+                             [(url, QUEUED, priority, depth, now, self.key(url)) for url in urls])
+            return conn.total_changes - before
+        return self._transaction(add)
+
+    def claim(self, limit=1):
+        """Leases up to `limit` queued URLs to this process and returns them as (url, depth) pairs."""
+        now = time.time()
+
+        def claim(conn):
+            # Leases of processes that stopped without releasing their URLs
+            conn.execute("UPDATE frontier SET state = ?, worker = NULL, lease_until = NULL WHERE state = ? AND lease_until < ?", (QUEUED, CLAIMED, now))
+            rows = conn.execute("SELECT url, depth FROM frontier WHERE state = ? ORDER BY priority DESC, depth LIMIT ?", (QUEUED, limit)).fetchall()
+            conn.executemany("UPDATE frontier SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE url = ?",
+                             [(CLAIMED, self.worker, now + self.lease_seconds, now, url) for url, _ in rows])
+            return rows
+        return self._transaction(claim)
+
+    def complete(self, url):
+        self._transaction(lambda conn: conn.execute("UPDATE frontier SET state = ?, worker = NULL, lease_until = NULL, updated = ? WHERE url = ?", (DONE, time.time(), url)))
+
+    def fail(self, url):
+        """Puts a URL whose processing raised back in the queue, or gives up on it after max_attempts."""
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE frontier SET state = CASE WHEN attempts < ? THEN ? ELSE ? END, worker = NULL, lease_until = NULL, updated = ? WHERE url = ?",
+            (self.max_attempts, QUEUED, FAILED, time.time(), url)))
+
+    def release(self):
+        """Returns this process's claimed URLs to the queue, e.g. when a crawl is interrupted."""
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE frontier SET state = ?, worker = NULL, lease_until = NULL, attempts = attempts - 1 WHERE state = ? AND worker = ?", (QUEUED, CLAIMED, self.worker)))
+
+    def finish(self):
+        """Clears the frontier after a crawl ran to completion, unless another process is still working on it.
+
+        Returns the counts from just before it was cleared.
+        """
+        def finish(conn):
+            counts = self._counts(conn)
+            if not counts[CLAIMED]:
+                conn.execute("DELETE FROM frontier")
+            return counts
+        return self._transaction(finish)
+
+    def _counts(self, conn):
+        counts = {QUEUED: 0, CLAIMED: 0, DONE: 0, FAILED: 0}
+        for state, count in conn.execute("SELECT state, COUNT(*) FROM frontier GROUP BY state"):
+            counts[state] = count
+        return counts
+
+    def counts(self):
+        return self._counts(self._connection())
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+def crawl(frontier, process_url, max_urls, workers=10, max_depth=None, idle_wait=1.0):
+    """Runs `process_url(url)` over the frontier with a pool of threads until it is empty or `max_urls` pages are done.
+
+    process_url returns the page's links, which are queued one level deeper. Work is claimed as
+    threads free up rather than in waves. While other processes sharing the frontier still hold
+    claimed URLs, this one waits for the links they may add instead of stopping. A crawl that ends
+    normally clears the frontier and returns its final counts; an interrupted one leaves it to be resumed.
+    """
+    futures = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                counts = frontier.counts()
+                room = min(workers - len(futures), max_urls - counts[DONE] - len(futures))
+                if room > 0:
+                    for url, depth in frontier.claim(room):
+                        futures[executor.submit(process_url, url)] = (url, depth)
+                if not futures:
+                    if counts[DONE] >= max_urls or not counts[CLAIMED]:
+                        break
+                    time.sleep(idle_wait)
+                    continue
+
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    url, depth = futures.pop(future)
+                    try:
+                        links = future.result()
+                    except Exception as e:
+                        print(f"Error processing URL {url}: {e}")
+                        frontier.fail(url)
+                        continue
+                    if links and (max_depth is None or depth < max_depth):
+                        frontier.add(links, depth=depth + 1)
+                    frontier.complete(url)
+    finally:
+        # URLs still claimed after an interrupt go back to the queue for the next run
+        frontier.release()
+    return frontier.finish()
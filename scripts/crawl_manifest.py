@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+# Returned by a scanner's fetch_content when the server answered 304 Not Modified
+NOT_MODIFIED = object()
+
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.md5(data).hexdigest()
+
+
+def crawl_manifest_path(manifest_dir, bucket_name, base_url):
+    """One manifest file per bucket and site, so scanners running in parallel never share a file."""
+    host = urlparse(base_url).netloc.replace(":", "_") or "site"
+    return os.path.join(manifest_dir, bucket_name, f"{host}.json")
+
+
+class CrawlManifest:
+    """Local record of what was fetched from a site and what was stored for it.
+
+    Each URL maps to its ETag and Last-Modified validators, a hash of the raw content, the hashes of
+    the chunks uploaded for it and the links found on it. Scanners send the validators as
+    If-None-Match/If-Modified-Since; on a 304 or an identical content hash the page is not parsed,
+    embedded or uploaded again and its stored links keep the crawl going. On a changed page only
+    chunks whose hash changed are re-embedded.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.stats = {"not_modified": 0, "unchanged": 0, "changed": 0, "new": 0, "chunks_skipped": 0, "chunks_written": 0}
+        self._pending = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("pages", {})
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ignoring unreadable crawl manifest {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps({"pages": self.entries})
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(self.path + ".tmp", self.path)
+
+    def get(self, url):
+        with self._lock:
+            return self.entries.get(url)
+
+    def conditional_headers(self, url):
+        """Request headers that let the server answer 304 when the page is unchanged."""
+        entry = self.get(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def stage(self, url, response_headers):
+        """Holds a response's validators until the page has been stored, so a failed page is fetched in full next time."""
+        with self._lock:
+            self._pending[url] = {"etag": response_headers.get("ETag"), "last_modified": response_headers.get("Last-Modified")}
+
+    def not_modified(self, url):
+        """Counts a 304 and returns the links stored for the page."""
+        with self._lock:
+            self._pending.pop(url, None)
+            self.stats["not_modified"] += 1
+            entry = self.entries.get(url)
+            if entry:
+                entry["checked"] = time.time()
+            return list(entry.get("links", [])) if entry else []
+
+    def unchanged_links(self, url, digest):
+        """Returns the stored links when the content hash matches the last crawl, otherwise None."""
+        with self._lock:
+            entry = self.entries.get(url)
+            if not entry or entry.get("content_hash") != digest:
+                return None
+            validators = self._pending.pop(url, None)
+            if validators:
+                entry.update(validators)
+            entry["checked"] = time.time()
+            self.stats["unchanged"] += 1
+            return list(entry.get("links", []))
+
+    def unchanged_since(self, url, timestamp):
+        """True when the page was stored or confirmed unchanged after `timestamp`, e.g. its sitemap lastmod."""
+        entry = self.get(url)
+        return bool(entry) and entry.get("checked", 0) >= timestamp
+
+    def chunk_hashes(self, url):
+        entry = self.get(url)
+        return list(entry.get("chunk_hashes", [])) if entry else []
+
+    def changed_chunks(self, url, hashes):
+        """Returns the indices of chunks that differ from what was stored for the URL."""
+        previous = self.chunk_hashes(url)
+        changed = [i for i, digest in enumerate(hashes) if i >= len(previous) or previous[i] != digest]
+        with self._lock:
+            self.stats["chunks_skipped"] += len(hashes) - len(changed)
+            self.stats["chunks_written"] += len(changed)
+        return changed
+
+    def record(self, url, digest, chunk_hashes, links):
+        """Stores a processed page with the validators staged for it."""
+        with self._lock:
+            if url in self._failed:
+                self._failed.discard(url)
+                self._pending.pop(url, None)
+                return
+            self.stats["changed" if url in self.entries else "new"] += 1
+            entry = {"content_hash": digest, "chunk_hashes": list(chunk_hashes), "links": list(links), "checked": time.time()}
+            entry.update(self._pending.pop(url, {"etag": None, "last_modified": None}))
+            self.entries[url] = entry
+
+    def forget(self, url):
+        """Drops a page whose chunks failed to upload, whether or not it has been recorded yet, so the next crawl redoes it."""
+        with self._lock:
+            self.entries.pop(url, None)
+            self._failed.add(url)
+            self._pending.pop(url, None)
+
+    def summary(self):
+        stats = dict(self.stats)
+        skipped = stats["not_modified"] + stats["unchanged"]
+        stats["pages_skipped"] = skipped
+        stats["pages_processed"] = stats["changed"] + stats["new"]
+        return stats
+
+    def report(self):
+        stats = self.summary()
+        print(f"Crawl manifest: {stats['pages_processed']} pages processed ({stats['new']} new, {stats['changed']} changed), "
+              f"{stats['pages_skipped']} skipped ({stats['not_modified']} not modified, {stats['unchanged']} same content), "
+              f"{stats['chunks_written']} chunks written, {stats['chunks_skipped']} unchanged chunks skipped")
@@ -0,0 +1,290 @@
+import bisect
+import collections
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the stage duration histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def metrics_path(manifest_path, format="json"):
+    """A site's metrics are written next to its crawl manifest."""
+    base = manifest_path[:-len(".json")] if manifest_path.endswith(".json") else manifest_path
+    return base + (".metrics.prom" if format == "prometheus" else ".metrics.json")
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum and maximum, in the Prometheus layout."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The last count is the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Estimates the q-quantile by interpolating inside the bucket that holds it."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+class StackSampler:
+    """Sampling profiler: records every other thread's stack each `interval` seconds.
+
+    The samples are written as folded stacks, one `frame;frame;frame count` line per distinct stack,
+    which flamegraph.pl and speedscope read directly. Threads blocked on a lock or socket show up
+    where they wait, so the output also shows what the crawler threads spend their time waiting on.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def write(self, path):
+        _write_atomic(path, "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common()))
+        print(f"Profile: {self.samples} samples written to {path}")
+
+
+class CrawlMetrics:
+    """Stage timers, counters and queue-depth gauges for one crawl, exported as JSON or Prometheus text.
+
+    `time(stage)` records how long a block takes in the stage's histogram (fetch, parse, chunk,
+    embed, upload...), `inc` adds to a counter (pages, bytes, chunks, errors...) and `gauge`
+    registers a function whose value, such as a queue depth, is sampled every `gauge_interval`
+    seconds between `start` and `stop`. Stage times are summed over threads, so their shares show
+    where the crawler threads spend their time. With `profile_interval` a StackSampler runs for the
+    same period and its folded stacks are written next to the export.
+    """
+
+    def __init__(self, path=None, format="json", labels=None, gauge_interval=1.0, profile_interval=None):
+        self.path = path
+        self.format = format
+        self.labels = labels or {}
+        self.gauge_interval = gauge_interval
+        self.histograms = {}
+        self.counters = collections.Counter()
+        self.gauges = {}
+        # Gauge name -> last, max, sum and number of samples
+        self.gauge_stats = {}
+        self.seconds = 0.0
+        self.profiler = StackSampler(profile_interval) if profile_interval else None
+        self._started = None
+        self._stop = threading.Event()
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def gauge(self, name, read):
+        """Registers `read()`, e.g. a queue's current depth, to be sampled while the crawl runs."""
+        self.gauges[name] = read
+
+    def sample_gauges(self):
+        for name, read in list(self.gauges.items()):
+            try:
+                value = read()
+            except Exception:
+                continue
+            with self._lock:
+                stats = self.gauge_stats.setdefault(name, {"last": 0, "max": 0, "sum": 0, "samples": 0})
+                stats["last"] = value
+                stats["max"] = max(stats["max"], value)
+                stats["sum"] += value
+                stats["samples"] += 1
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.gauge_interval):
+            self.sample_gauges()
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._stop.clear()
+        if self.gauges and self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample_loop, name="metrics-gauges", daemon=True)
+            self._sampler.start()
+        if self.profiler is not None:
+            self.profiler.start()
+
+    def stop(self):
+        if self._started is not None:
+            self.seconds += time.perf_counter() - self._started
+            self._started = None
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        self.sample_gauges()
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def merge(self, other):
+        """Adds another crawl's stage times and counters, e.g. to total the sites of one orchestrator run."""
+        with other._lock:
+            histograms = {stage: histogram for stage, histogram in other.histograms.items()}
+            counters = dict(other.counters)
+        with self._lock:
+            for stage, histogram in histograms.items():
+                self.histograms.setdefault(stage, Histogram(histogram.buckets)).merge(histogram)
+            self.counters.update(counters)
+
+    def summary(self):
+        with self._lock:
+            stage_seconds = sum(histogram.sum for histogram in self.histograms.values())
+            stages = {
+                stage: {
+                    "count": histogram.count,
+                    "seconds": histogram.sum,
+                    "share": histogram.sum / stage_seconds if stage_seconds else 0.0,
+                    "avg": histogram.sum / histogram.count if histogram.count else 0.0,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "max": histogram.max,
+                }
+                for stage, histogram in self.histograms.items()
+            }
+            gauges = {name: {"last": stats["last"], "max": stats["max"], "avg": stats["sum"] / stats["samples"] if stats["samples"] else 0.0}
+                      for name, stats in self.gauge_stats.items()}
+            return {"labels": dict(self.labels), "seconds": self.seconds, "stages": stages, "counters": dict(self.counters), "gauges": gauges}
+
+    def to_prometheus(self):
+        def labels(**extra):
+            pairs = dict(self.labels, **extra)
+            if not pairs:
+                return ""
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in pairs.values())
+            return "{" + ",".join(f'{name}="{value}"' for name, value in zip(pairs, escaped)) + "}"
+
+        def metric_name(name):
+            return "crawl_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+        lines = ["# HELP crawl_stage_seconds Time spent in each crawl stage, summed over threads.", "# TYPE crawl_stage_seconds histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"crawl_stage_seconds_bucket{labels(stage=stage, le=le)} {cumulative}")
+                lines.append(f"crawl_stage_seconds_sum{labels(stage=stage)} {histogram.sum}")
+                lines.append(f"crawl_stage_seconds_count{labels(stage=stage)} {histogram.count}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {metric_name(name)}_total counter")
+                lines.append(f"{metric_name(name)}_total{labels()} {value}")
+            for name, stats in sorted(self.gauge_stats.items()):
+                lines.append(f"# TYPE {metric_name(name)} gauge")
+                lines.append(f"{metric_name(name)}{labels()} {stats['last']}")
+                lines.append(f"# TYPE {metric_name(name)}_max gauge")
+                lines.append(f"{metric_name(name)}_max{labels()} {stats['max']}")
+            lines.append("# TYPE crawl_duration_seconds gauge")
+            lines.append(f"crawl_duration_seconds{labels()} {self.seconds}")
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """Writes the metrics to `path` in the configured format, and the profile next to it."""
+        if not self.path:
+            return
+        if self.format == "prometheus":
+            _write_atomic(self.path, self.to_prometheus())
+        else:
+            _write_atomic(self.path, json.dumps(self.summary(), indent=2))
+        if self.profiler is not None and self.profiler.samples:
+            self.profiler.write(os.path.splitext(self.path)[0] + ".profile.folded")
+
+    def report(self):
+        summary = self.summary()
+        if not summary["stages"]:
+            return
+        stages = ", ".join(f"{stage} {stats['seconds']:.1f}s ({stats['share']:.0%}, p50 {stats['p50'] * 1000:.0f} ms, p95 {stats['p95'] * 1000:.0f} ms)"
+                           for stage, stats in sorted(summary["stages"].items(), key=lambda item: -item[1]["seconds"]))
+        print(f"Stage times: {stages}")
+        counters = ", ".join(f"{name} {value}" for name, value in sorted(summary["counters"].items()))
+        if counters:
+            print(f"Counters: {counters}")
+        gauges = ", ".join(f"{name} max {stats['max']} avg {stats['avg']:.1f}" for name, stats in sorted(summary["gauges"].items()))
+        if gauges:
+            print(f"Queue depths: {gauges}")
@@ -0,0 +1,248 @@
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from sentence_transformers import SentenceTransformer
+
+from com_res_webscrape import ComResGuideWebScanner
+from crawl_metrics import CrawlMetrics
+from embedding_batcher import EmbeddingBatcher, sentence_transformer_encoder
+from pdf_extract import PdfExtractor
+from rate_limiter import HostRateLimiter
+from upload_queue import UploadQueue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunk_shards import ShardWriter
+from storage_backend import storage_from_env
+
+SKIP_DOMAINS = ["guidestar.org", "propublica.org", "causeiq.com", "charitynavigator.org", "facebook.com"]
+
+
+def load_sites(json_files):
+    """Reads the organization lists and returns (organization, zipcode, website) for every crawlable site, once each."""
+    sites = []
+    seen = set()
+    for json_file in json_files:
+        print(f"Processing file: {json_file}")
+        with open(json_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        for entry in data:
+            organization_name = entry.get("Organization Name")
+            zipcode = entry.get("Zipcode")
+            website = entry.get("websites", {}).get(organization_name)
+            if not website or any(domain in website for domain in SKIP_DOMAINS):
+                print(f"Skipping {organization_name} in zipcode {zipcode} due to invalid website: {website}")
+                continue
+            # The same organization is often listed under several zipcodes
+            if website in seen:
+                continue
+            seen.add(website)
+            sites.append((organization_name, zipcode, website))
+    return sites
+
+
+def create_session(pool_size=64, max_retries=2):
+    """Returns a requests.Session whose connection pool is large enough for every concurrent fetch."""
+    session = requests.Session()
+    retry = Retry(total=max_retries, connect=max_retries, read=max_retries, backoff_factor=0.5, status_forcelist=(), allowed_methods=("GET", "HEAD"))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class CrawlOrchestrator:
+    """Crawls many sites in parallel with one storage backend, one embedding model and one HTTP connection pool.
+
+    `max_sites` scanners run at once, and `max_concurrent_requests` bounds the requests in flight
+    across all of them. The per-host rate limiter is shared too, so two organizations hosted on the
+    same domain do not each get a full allowance.
+    """
+
+    def __init__(self, bucket_name, credentials_path=None, embedding_model_name='all-MiniLM-L6-v2', max_sites=8, max_concurrent_requests=32,
+                 rate_limit=10, time_window=60, storage_format='json', embedding_batch_size=64, upload_workers=16, pdf_workers=2, report_interval=30, scanner_options=None,
+                 metrics_path=None, profile_interval=None):
+        self.bucket_name = bucket_name
+        self.max_sites = max_sites
+        self.report_interval = report_interval
+        self.scanner_options = scanner_options or {}
+
+        # Loaded once for the whole run instead of once per website
+        self.storage = storage_from_env(bucket_name, credentials_path=credentials_path)
+        self.embedding_model = SentenceTransformer(embedding_model_name)
+        # One worker encodes chunks from every site in batches instead of each crawler thread running the model
+        self.embedding_batcher = EmbeddingBatcher(sentence_transformer_encoder(self.embedding_model, embedding_batch_size), batch_size=embedding_batch_size)
+
+        # Scanners run 10 fetch threads each; the pool only needs to cover what the semaphore lets through
+        self.session = create_session(pool_size=max_concurrent_requests)
+        self.fetch_semaphore = threading.BoundedSemaphore(max_concurrent_requests)
+        self.rate_limiter = HostRateLimiter(rate_limit, time_window)
+        self.storage_format = storage_format
+        self.shard_writer = ShardWriter(self.storage) if storage_format == 'shards' else None
+
+        # Every site's chunk blobs go through one upload pool
+        self.upload_queue = UploadQueue(self.storage, workers=upload_workers)
+
+        # One PDF process pool, so PDF-heavy sites queue for extraction instead of tying up HTML crawler threads
+        self.pdf_extractor = PdfExtractor(workers=pdf_workers)
+
+        # Every site's stage times and counters, totalled once the run's uploads have finished; a .prom path exports Prometheus text
+        self.metrics = CrawlMetrics(metrics_path, format="prometheus" if metrics_path and metrics_path.endswith(".prom") else "json", profile_interval=profile_interval)
+        self.metrics.gauge("upload_queue_depth", self.upload_queue.depth)
+        self.metrics.gauge("embedding_queue_depth", lambda: self.embedding_batcher.stats()["queued"])
+        self.metrics.gauge("sites_running", lambda: len(self._scanners))
+        self._site_metrics = []
+
+        self.progress = {}
+        self._scanners = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def crawl_site(self, organization_name, zipcode, website):
+        with self._lock:
+            self.progress[website]["status"] = "running"
+            self.progress[website]["started"] = time.time()
+
+        print(f"Scanning website for {organization_name} in zipcode {zipcode}: {website}")
+        scanner = None
+        try:
+            # Built here so a site whose frontier, manifest or boilerplate state cannot be opened fails alone
+            scanner = ComResGuideWebScanner(
+                website,
+                self.bucket_name,
+                storage_format=self.storage_format,
+                storage=self.storage,
+                embedding_model=self.embedding_model,
+                session=self.session,
+                rate_limiter=self.rate_limiter,
+                fetch_semaphore=self.fetch_semaphore,
+                shard_writer=self.shard_writer,
+                embedding_batcher=self.embedding_batcher,
+                upload_queue=self.upload_queue,
+                pdf_extractor=self.pdf_extractor,
+                **self.scanner_options
+            )
+            with self._lock:
+                self._scanners[website] = scanner
+            scanner.start_scanning()
+            status = "done"
+        except Exception as e:
+            print(f"Error scanning {website}: {e}")
+            status = "failed"
+
+        with self._lock:
+            self._scanners.pop(website, None)
+            if scanner is not None:
+                self._site_metrics.append(scanner.metrics)
+                self.progress[website].update(scanner.progress())
+            self.progress[website]["status"] = status
+            self.progress[website]["seconds"] = time.time() - self.progress[website]["started"]
+        return self.progress[website]
+
+    def snapshot(self):
+        """Returns per-site status and page counts, including live counts for sites still running."""
+        with self._lock:
+            progress = {website: dict(site) for website, site in self.progress.items()}
+            for website, scanner in self._scanners.items():
+                progress[website].update(scanner.progress())
+        return progress
+
+    def report(self):
+        progress = self.snapshot()
+        counts = {}
+        for site in progress.values():
+            counts[site["status"]] = counts.get(site["status"], 0) + 1
+        pages = sum(site.get("visited", 0) for site in progress.values())
+        print(f"Crawl progress: {counts.get('done', 0)} done, {counts.get('running', 0)} running, {counts.get('pending', 0)} pending, "
+              f"{counts.get('failed', 0)} failed, {pages} pages, {self.upload_queue.metrics()['queue_depth']} uploads queued")
+        for website, site in progress.items():
+            if site["status"] == "running":
+                print(f"  {website}: {site.get('visited', 0)}/{site.get('max_urls', 0)} pages, {site.get('queued', 0)} queued")
+
+    def _report_loop(self):
+        while not self._done.wait(self.report_interval):
+            self.report()
+
+    def run(self, sites):
+        """Crawls (organization, zipcode, website) tuples, `max_sites` at a time, and returns per-site progress."""
+        start = time.time()
+        self._done.clear()
+        with self._lock:
+            for _, _, website in sites:
+                self.progress[website] = {"status": "pending", "visited": 0}
+
+        reporter = threading.Thread(target=self._report_loop, name="crawl-progress", daemon=True)
+        reporter.start()
+        self.metrics.start()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_sites) as executor:
+                futures = {executor.submit(self.crawl_site, *site): site for site in sites}
+                for future in concurrent.futures.as_completed(futures):
+                    organization_name, _, website = futures[future]
+                    site = future.result()
+                    print(f"Finished {organization_name} ({website}): {site.get('visited', 0)} pages in {site['seconds']:.1f}s [{site['status']}]")
+        finally:
+            self._done.set()
+            if self.shard_writer is not None:
+                self.shard_writer.flush()
+            self.upload_queue.flush()
+            self.metrics.stop()
+            for site_metrics in self._site_metrics:
+                self.metrics.merge(site_metrics)
+            self._site_metrics = []
+            self.metrics.export()
+
+        self.report()
+        chunks_saved = sum(site.get("boilerplate_chunks_saved", 0) for site in self.snapshot().values())
+        print(f"Boilerplate stripping saved {chunks_saved} chunks and embedding calls")
+        fetches_avoided = sum(site.get("fetches_avoided", 0) for site in self.snapshot().values())
+        print(f"URL canonicalization avoided {fetches_avoided} duplicate page fetches")
+        embedding = self.embedding_batcher.stats()
+        self.pdf_extractor.report()
+        print(f"Embedded {embedding['chunks']} chunks in {embedding['batches']} batches (average {embedding['average_batch']:.1f}, {embedding['chunks_per_second']:.1f} chunks/s)")
+        self.metrics.report()
+        print(f"Crawled {len(sites)} sites in {time.time() - start:.1f}s")
+        return self.snapshot()
+
+    def close(self):
+        self.embedding_batcher.close()
+        self.upload_queue.close()
+        self.upload_queue.report()
+        self.pdf_extractor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl every organization website listed in a folder of zipcode JSON files.")
+    parser.add_argument("folder_path", help="Folder containing the JSON files with websites")
+    parser.add_argument("credentials_path", nargs="?", default=None, help="Path to the service account JSON file (GCS only)")
+    parser.add_argument("--bucket", default="community_resource_nc")
+    parser.add_argument("--max-sites", type=int, default=8, help="Sites crawled at the same time")
+    parser.add_argument("--max-requests", type=int, default=32, help="Requests in flight across all sites")
+    parser.add_argument("--storage-format", choices=["json", "shards"], default="json")
+    parser.add_argument("--upload-workers", type=int, default=16)
+    parser.add_argument("--pdf-workers", type=int, default=2, help="Processes extracting PDF text")
+    parser.add_argument("--metrics", default=None, help="Write the run's stage metrics to this .json file, or .prom for Prometheus text")
+    parser.add_argument("--profile", action="store_true", help="Sample every thread's stack and write folded stacks next to the metrics file")
+    args = parser.parse_args()
+    if args.profile and not args.metrics:
+        parser.error("--profile needs --metrics to know where to write the profile")
+
+    sites = load_sites(glob.glob(os.path.join(args.folder_path, '*.json')))
+    orchestrator = CrawlOrchestrator(args.bucket, args.credentials_path, max_sites=args.max_sites, max_concurrent_requests=args.max_requests, storage_format=args.storage_format,
+                                      upload_workers=args.upload_workers, pdf_workers=args.pdf_workers,
+                                      metrics_path=args.metrics, profile_interval=0.01 if args.profile else None)
+    orchestrator.run(sites)
+    orchestrator.close()
+
+
+if __name__ == "__main__":
+    main()
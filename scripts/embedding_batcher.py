@@ -0,0 +1,165 @@
+import argparse
+import concurrent.futures
+import queue
+import threading
+import time
+
+
+def sentence_transformer_encoder(model, batch_size=64):
+    """Returns an encode function that runs a SentenceTransformer over a whole list at once."""
+    def encode(texts):
+        return model.encode(texts, batch_size=batch_size, show_progress_bar=False).tolist()
+    return encode
+
+
+def openai_encoder(client, model="text-embedding-ada-002"):
+    """Returns an encode function that embeds a whole list in one OpenAI embeddings request."""
+    def encode(texts):
+        response = client.embeddings.create(input=texts, model=model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    return encode
+
+
+class EmbeddingBatcher:
+    """Collects chunks from every crawler thread and embeds them in batches on a single worker thread.
+
+    `submit` returns a Future for the chunk's vector. The worker takes up to `batch_size` queued chunks,
+    waiting at most `max_wait` seconds after the first one for the batch to fill, and runs one
+    `encode(texts)` call for all of them. The queue is bounded, so crawler threads slow down when
+    encoding falls behind instead of buffering pages without limit.
+    """
+
+    def __init__(self, encode, batch_size=64, max_wait=0.05, max_queue=4096):
+        self.encode = encode
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.chunks = 0
+        self.encode_seconds = 0.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        if self._closed:
+            raise RuntimeError("EmbeddingBatcher is closed")
+        future = concurrent.futures.Future()
+        self._queue.put((text, future))
+        return future
+
+    def submit_many(self, texts):
+        return [self.submit(text) for text in texts]
+
+    def embed(self, texts, timeout=300):
+        """Blocks until every text is embedded and returns the vectors in order.
+
+        Raises concurrent.futures.TimeoutError when they are not all embedded within `timeout` seconds,
+        so a crawler thread never hangs on a stalled model; None waits indefinitely.
+        """
+        futures = self.submit_many(texts)
+        if timeout is None:
+            return [future.result() for future in futures]
+        deadline = time.monotonic() + timeout
+        return [future.result(max(0.0, deadline - time.monotonic())) for future in futures]
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, then let the worker see the close marker
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            texts = [text for text, _ in batch]
+            start = time.perf_counter()
+            try:
+                vectors = self.encode(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.encode_seconds += time.perf_counter() - start
+            if len(vectors) != len(batch):
+                # zip would leave the futures past the shorter list unresolved
+                error = ValueError(f"encode returned {len(vectors)} vectors for {len(batch)} texts")
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            self.batches += 1
+            self.chunks += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def close(self, timeout=None):
+        """Embeds everything already submitted, then stops the worker."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "chunks": self.chunks,
+            "batches": self.batches,
+            "average_batch": self.chunks / self.batches if self.batches else 0.0,
+            "encode_seconds": self.encode_seconds,
+            "chunks_per_second": self.chunks / self.encode_seconds if self.encode_seconds else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+
+def benchmark(model_name="all-MiniLM-L6-v2", num_chunks=512, chunk_size=2048, batch_sizes=(1, 8, 32, 64, 128), threads=10, chunks_per_page=8):
+    """Embeds the same pages from crawler-like threads, once per chunk and through the batcher at each batch size."""
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name)
+    text = "Durham community resource food pantry housing assistance "
+    chunks = [(f"Page {i}. " + text * (chunk_size // len(text)))[:chunk_size] for i in range(num_chunks)]
+    pages = [chunks[i:i + chunks_per_page] for i in range(0, num_chunks, chunks_per_page)]
+    model.encode(chunks[:8])  # Load weights before timing
+
+    def run_threads(fn):
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(fn, pages))
+        return time.perf_counter() - start
+
+    print(f"{num_chunks} chunks of {chunk_size} chars in pages of {chunks_per_page}, from {threads} threads with {model_name}")
+    seconds = run_threads(lambda page: [model.encode(chunk) for chunk in page])
+    print(f"  per-chunk encode: {num_chunks / seconds:.1f} chunks/s")
+
+    for batch_size in batch_sizes:
+        batcher = EmbeddingBatcher(sentence_transformer_encoder(model, batch_size), batch_size=batch_size)
+        seconds = run_threads(batcher.embed)
+        batcher.close()
+        print(f"  batcher, batch_size={batch_size}: {num_chunks / seconds:.1f} chunks/s (average batch {batcher.stats()['average_batch']:.1f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding throughput at different batch sizes.")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--chunks", type=int, default=512)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 64, 128])
+    args = parser.parse_args()
+    benchmark(args.model, args.chunks, batch_sizes=args.batch_sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ import os
 import numpy as np
 import scipy
 import requests
+from url_canon import URLCanonicalizer
 import time
 
 class PMTWebScannerSpider:
@@ -15,6 +16,7 @@ class PMTWebScannerSpider:
         self.visited_urls = set()
         self.base_url = None  # Base URL for beauty products
         self.max_urls_to_visit = 300  # Maximum number of URLs to visit
+        self.canonicalizer = URLCanonicalizer()
 
         # Create a session object to persist cookies across requests
         self.session = requests.Session()
@@ -22,6 +24,9 @@ class PMTWebScannerSpider:
     def fetch_web_page(self, url):
         try:
             response = self.session.get(url, verify=False, timeout=10)  # Timeout set to 10 seconds
+            if response.url != url and self.canonicalizer.redirected(url, response.url):
+                # Redirected to a page that is already queued or scanned under another URL
+                return None
             return response.text
         except Exception as e:
             print(f"Error fetching URL: {e}")
@@ -60,20 +65,24 @@ class PMTWebScannerSpider:
             print(f"Skipping saving text file for {organization_name} as extraction was skipped.")
 
     def start_scanning(self):
-        urls_to_visit = [self.base_url]
+        # Tracking parameters, fragments, www/https variants and redirects to known pages are fetched once per site
+        self.canonicalizer = URLCanonicalizer()
+        urls_to_visit = self.canonicalizer.filter([self.base_url])
         while urls_to_visit and len(self.visited_urls) < self.max_urls_to_visit:
             url = urls_to_visit.pop(0)
             html_content = self.fetch_web_page(url)
             if html_content:
+                soup = BeautifulSoup(html_content, 'lxml')
+                canonical = soup.find('link', rel='canonical', href=True)
+                if canonical is not None and self.canonicalizer.canonical(url, urljoin(url, canonical['href'])):
+                    continue
                 meta_info, body_text = self.parse_web_page(html_content, url)
                 self.save_text_to_file(meta_info, body_text, "extracted_text.txt")
 
                 # Extract URLs from the current page and add them to the list of URLs to visit
-                soup = BeautifulSoup(html_content, 'lxml')
                 urls = [urljoin(url, link.get('href')) for link in soup.find_all('a', href=True)]
-                for new_url in urls:
-                    if new_url not in self.visited_urls and new_url not in urls_to_visit:
-                        urls_to_visit.append(new_url)
+                urls_to_visit.extend(self.canonicalizer.filter(urls))
+        self.canonicalizer.report(self.base_url)
 
 def main():
     with open(r"C:\Users\Megha Patel\Documents\Split_By_Zipcode_JSON2\27722_data.json", "r") as f:  # Replace "your_json_file.json" with the path to your JSON file
@@ -0,0 +1,142 @@
+from urllib.parse import urlparse
+
+# Bytes read before deciding whether a response is worth downloading
+SNIFF_BYTES = 2048
+READ_CHUNK_SIZE = 64 * 1024
+
+# Kinds of content the scanners can parse
+HTML = "html"
+PDF = "pdf"
+XML = "xml"
+TEXT = "text"
+
+_DECLARED_KINDS = {
+    "text/html": HTML,
+    "application/xhtml+xml": HTML,
+    "application/pdf": PDF,
+    "application/x-pdf": PDF,
+    "application/xml": XML,
+    "text/xml": XML,
+    "application/rss+xml": XML,
+    "application/atom+xml": XML,
+    "text/plain": TEXT,
+}
+
+# Declared types that are never parsed, whatever the body looks like
+_UNSUPPORTED_PREFIXES = ("image/", "video/", "audio/", "font/", "model/")
+_UNSUPPORTED_TYPES = {
+    "application/zip", "application/x-zip-compressed", "application/gzip", "application/x-tar", "application/x-7z-compressed",
+    "application/x-rar-compressed", "application/vnd.rar", "application/x-msdownload", "application/x-shockwave-flash",
+    "application/vnd.ms-powerpoint", "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "application/javascript", "text/javascript", "text/css", "application/json",
+}
+
+# Leading bytes of binary formats that servers often mislabel as text/html or octet-stream
+_BINARY_SIGNATURES = (
+    b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"PK\x03\x04", b"\x1f\x8b", b"Rar!", b"7z\xbc\xaf", b"ID3", b"OggS",
+    b"\x1a\x45\xdf\xa3", b"RIFF", b"fLaC", b"MZ", b"\x00\x00\x01\x00", b"wOFF", b"wOF2",
+)
+
+
+class SkipContent(Exception):
+    """Raised while reading a response that should not be downloaded or parsed."""
+
+
+def media_type(content_type):
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def sniff_content_kind(content_type, head, url=""):
+    """Returns html, pdf, xml or text from the Content-Type header and the first bytes, or None if unsupported."""
+    declared = media_type(content_type)
+    if declared.startswith(_UNSUPPORTED_PREFIXES) or declared in _UNSUPPORTED_TYPES:
+        return None
+
+    head = head or b""
+    if head.startswith(b"%PDF-"):
+        return PDF
+    # MP4/MOV keep their signature at byte 4
+    if head.startswith(_BINARY_SIGNATURES) or head[4:8] == b"ftyp":
+        return None
+
+    start = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if start.startswith((b"<!doctype html", b"<html", b"<head", b"<body")):
+        return HTML
+    if declared in _DECLARED_KINDS:
+        return _DECLARED_KINDS[declared]
+    if start.startswith(b"<?xml"):
+        return XML
+    if start.startswith(b"<"):
+        return HTML
+    if urlparse(url).path.lower().endswith(".pdf"):
+        return PDF
+    # Unlabelled text without NUL bytes is treated as plain text
+    if head and b"\x00" not in head[:SNIFF_BYTES]:
+        return TEXT
+    return None
+
+
+def check_headers(headers, max_bytes):
+    """Rejects a response from its headers alone: a declared length over max_bytes or a media type that is never parsed."""
+    length = headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise SkipContent(f"Content-Length {length} exceeds the {max_bytes} byte limit")
+    declared = media_type(headers.get("Content-Type"))
+    if declared.startswith(_UNSUPPORTED_PREFIXES) or declared in _UNSUPPORTED_TYPES:
+        raise SkipContent(f"Unsupported content ({declared})")
+
+
+def _accept(chunks, size, content_type, url, max_bytes, sniffed):
+    if size > max_bytes:
+        raise SkipContent(f"More than {max_bytes} bytes")
+    if sniffed is None and size >= SNIFF_BYTES:
+        kind = sniff_content_kind(content_type, b"".join(chunks)[:SNIFF_BYTES], url)
+        if kind is None:
+            raise SkipContent(f"Unsupported content ({media_type(content_type) or 'unknown type'})")
+        return kind
+    return sniffed
+
+
+def read_response(response, url, max_bytes):
+    """Streams a requests response (made with stream=True) and returns (content, kind).
+
+    The body is sniffed after the first few KB and reading stops as soon as it turns out to be an
+    unsupported type or passes max_bytes, so oversized or binary responses are never fully downloaded.
+    """
+    content_type = response.headers.get("Content-Type", "")
+    try:
+        check_headers(response.headers, max_bytes)
+        chunks = []
+        size = 0
+        kind = None
+        for chunk in response.iter_content(READ_CHUNK_SIZE):
+            chunks.append(chunk)
+            size += len(chunk)
+            kind = _accept(chunks, size, content_type, url, max_bytes, kind)
+        content = b"".join(chunks)
+        if kind is None:
+            kind = sniff_content_kind(content_type, content[:SNIFF_BYTES], url)
+            if kind is None:
+                raise SkipContent(f"Unsupported content ({media_type(content_type) or 'unknown type'})")
+        return content, kind
+    finally:
+        response.close()
+
+
+async def read_response_async(response, url, max_bytes):
+    """Like read_response, for an aiohttp response."""
+    content_type = response.headers.get("Content-Type", "")
+    check_headers(response.headers, max_bytes)
+    chunks = []
+    size = 0
+    kind = None
+    async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+        chunks.append(chunk)
+        size += len(chunk)
+        kind = _accept(chunks, size, content_type, url, max_bytes, kind)
+    content = b"".join(chunks)
+    if kind is None:
+        kind = sniff_content_kind(content_type, content[:SNIFF_BYTES], url)
+        if kind is None:
+            raise SkipContent(f"Unsupported content ({media_type(content_type) or 'unknown type'})")
+    return content, kind
@@ -0,0 +1,196 @@
+import argparse
+import io
+import multiprocessing
+import threading
+import time
+
+from PyPDF2 import PdfReader
+
+
+class PdfTimeout(Exception):
+    pass
+
+
+def _extract_document(content, max_pages, deadline):
+    # Runs in a worker process; parses the document once and returns its page count and the text of its first max_pages pages
+    reader = PdfReader(io.BytesIO(content))
+    page_count = len(reader.pages)
+    texts = []
+    for number in range(min(page_count, max_pages)):
+        # Checked between pages, so a worker gives up on a slow document shortly after its deadline
+        if time.time() > deadline:
+            break
+        try:
+            texts.append(reader.pages[number].extract_text() or "")
+        except Exception as e:
+            print(f"Error extracting PDF page {number}: {e}")
+            texts.append("")
+    return page_count, texts
+
+
+def chunk_pages(pages, chunk_size):
+    """Cuts a stream of page texts into chunk_size pieces as pages arrive.
+
+    Each page is followed by a newline, so the chunks are the same as slicing the whole document's
+    text, without ever building that string.
+    """
+    pending = ""
+    for page in pages:
+        pending += page + "\n"
+        full = len(pending) - len(pending) % chunk_size
+        for i in range(0, full, chunk_size):
+            yield pending[i:i + chunk_size]
+        pending = pending[full:]
+    if pending:
+        yield pending
+
+
+class PdfExtractor:
+    """Extracts PDF text in a pool of worker processes, so PyPDF2 neither holds the GIL nor ties up a crawler thread.
+
+    Each document is one task: a worker parses it once and extracts its pages in order, so up to
+    `workers` documents are extracted at the same time. Only the first `max_pages` pages are read, and
+    a document that takes longer than `timeout` seconds keeps the pages extracted by then. Workers stop
+    between pages at the deadline; one still busy `kill_grace` seconds later is stuck inside PyPDF2,
+    so the pool is terminated and replaced. Other documents that were on the old pool run again on
+    the new one.
+    """
+
+    def __init__(self, workers=2, max_pages=300, timeout=120, kill_grace=5, poll_interval=1.0):
+        self.workers = workers
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.kill_grace = kill_grace
+        self.poll_interval = poll_interval
+
+        self.documents = 0
+        self.pages_extracted = 0
+        self.truncated = 0
+        self.timeouts = 0
+        self.failed = 0
+        self.pools_killed = 0
+        self.seconds = 0.0
+        self._started = None
+        self._lock = threading.Lock()
+        self._pool = self._create_pool()
+
+    def _create_pool(self):
+        # Spawned rather than forked: the crawler process already runs threads and the embedding model
+        return multiprocessing.get_context("spawn").Pool(self.workers)
+
+    def _submit(self, content, deadline):
+        # Returns [pool, result], so the task can be resubmitted if its pool is replaced
+        with self._lock:
+            pool = self._pool
+            return [pool, pool.apply_async(_extract_document, (content, self.max_pages, deadline))]
+
+    def _result(self, task, content, deadline):
+        # Waits up to kill_grace past the deadline for a worker to finish its current page
+        while True:
+            pool, result = task
+            remaining = deadline + self.kill_grace - time.time()
+            result.wait(max(0.0, min(remaining, self.poll_interval)))
+            if result.ready():
+                return result.get()
+            if pool is not self._pool:
+                # The pool was terminated for another document's stuck worker, taking this task with it
+                task[:] = self._submit(content, deadline)
+            elif remaining <= 0:
+                raise PdfTimeout()
+
+    def _kill_pool(self, pool):
+        # A worker stuck in PdfReader or extract_text cannot be interrupted; the whole pool is terminated and replaced
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = self._create_pool()
+            self.pools_killed += 1
+        pool.terminate()
+        print(f"Replaced the PDF worker pool after a worker stayed stuck {self.kill_grace}s past the deadline")
+
+    def pages(self, content, url=""):
+        """Yields the text of each page in order; raises on a PDF that cannot be read at all."""
+        start = time.monotonic()
+        deadline = time.time() + self.timeout
+        with self._lock:
+            if self._started is None:
+                self._started = start
+        count = 0
+        task = self._submit(content, deadline)
+        try:
+            try:
+                page_count, texts = self._result(task, content, deadline)
+            except PdfTimeout:
+                self._kill_pool(task[0])
+                page_count, texts = None, []
+            limit = min(page_count, self.max_pages) if page_count is not None else None
+            for text in texts:
+                count += 1
+                yield text
+
+            if limit is None or count < limit:
+                print(f"PDF {url} timed out after {self.timeout}s; keeping {count} pages")
+                with self._lock:
+                    self.timeouts += 1
+            elif page_count > limit:
+                print(f"PDF {url} has {page_count} pages; extracted the first {limit}")
+                with self._lock:
+                    self.truncated += 1
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.documents += 1
+                self.pages_extracted += count
+                self.seconds += time.monotonic() - start
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._started if self._started is not None else 0.0
+            return {
+                "documents": self.documents,
+                "pages": self.pages_extracted,
+                "truncated": self.truncated,
+                "timeouts": self.timeouts,
+                "failed": self.failed,
+                "pools_killed": self.pools_killed,
+                "seconds_per_document": self.seconds / self.documents if self.documents else 0.0,
+                "pages_per_second": self.pages_extracted / elapsed if elapsed else 0.0,
+            }
+
+    def report(self):
+        stats = self.stats()
+        if stats["documents"]:
+            print(f"PDFs: {stats['documents']} documents, {stats['pages']} pages ({stats['pages_per_second']:.1f} pages/s, "
+                  f"{stats['seconds_per_document']:.1f}s per document), {stats['truncated']} truncated, {stats['timeouts']} timed out, {stats['failed']} failed"
+                  + (f", {stats['pools_killed']} stuck worker pools replaced" if stats["pools_killed"] else ""))
+
+    def close(self):
+        with self._lock:
+            pool = self._pool
+        pool.close()
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract PDFs through the worker pool and report pages/sec.")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-pages", type=int, default=300)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--chunk-size", type=int, default=2048)
+    args = parser.parse_args()
+
+    extractor = PdfExtractor(workers=args.workers, max_pages=args.max_pages, timeout=args.timeout)
+    for path in args.paths:
+        with open(path, "rb") as f:
+            chunks = list(chunk_pages(extractor.pages(f.read(), path), args.chunk_size))
+        print(f"{path}: {len(chunks)} chunks")
+    extractor.report()
+    extractor.close()
+
+
+if __name__ == "__main__":
+    main()
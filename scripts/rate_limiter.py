@@ -0,0 +1,166 @@
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+
+class HostRateLimiter:
+    """Token-bucket rate limiter keyed by host.
+
+    Each host refills `rate_limit` tokens per `time_window` seconds. A caller reserves its slot under
+    the lock and then sleeps outside it, so waiting on one slow host never blocks threads bound for
+    other hosts. Retry-After responses and robots.txt Crawl-delay push a host's next slot back.
+    """
+
+    def __init__(self, rate_limit=10, time_window=60, burst=None, jitter=0.2):
+        self.rate = rate_limit / float(time_window)
+        self.capacity = burst if burst is not None else rate_limit
+        self.jitter = jitter
+        self.hosts = {}
+        self.robots_checked = set()
+        self._lock = threading.Lock()
+
+    def _host_state(self, host, now):
+        if host not in self.hosts:
+            self.hosts[host] = {
+                "tokens": float(self.capacity),
+                "updated": now,
+                "next_slot": now,
+                "blocked_until": 0.0,
+                "crawl_delay": 0.0,
+                "requests": 0,
+                "waits": 0,
+                "wait_seconds": 0.0,
+                "max_wait": 0.0,
+            }
+        return self.hosts[host]
+
+    def reserve(self, url):
+        """Reserves the next request slot for the URL's host and returns how long to wait for it."""
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            state = self._host_state(host, now)
+            state["tokens"] = min(self.capacity, state["tokens"] + (now - state["updated"]) * self.rate)
+            state["updated"] = now
+
+            # Tokens may go negative: each one is a reservation that is paid back by later refills
+            token_ready = now if state["tokens"] >= 1 else now + (1 - state["tokens"]) / self.rate
+            slot = max(token_ready, state["blocked_until"], state["next_slot"])
+            state["tokens"] -= 1
+            state["next_slot"] = slot + state["crawl_delay"]
+
+            wait = slot - now
+            if wait > 0:
+                # Jitter spreads out threads that reserved slots close together
+                wait += random.uniform(0, self.jitter * max(1.0 / self.rate, state["crawl_delay"]))
+                state["waits"] += 1
+                state["wait_seconds"] += wait
+                state["max_wait"] = max(state["max_wait"], wait)
+            state["requests"] += 1
+            return wait
+
+    def acquire(self, url):
+        """Blocks the calling thread until the URL's host may be requested again."""
+        wait = self.reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, url):
+        wait = self.reserve(url)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def penalize(self, url, retry_after):
+        """Holds back a host after a 429/503, honouring its Retry-After header (seconds or HTTP date)."""
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = 1.0 / self.rate
+        host = urlparse(url).netloc
+        with self._lock:
+            state = self._host_state(host, time.monotonic())
+            state["blocked_until"] = max(state["blocked_until"], time.monotonic() + delay)
+        return delay
+
+    def set_crawl_delay(self, host, delay):
+        with self._lock:
+            state = self._host_state(host, time.monotonic())
+            state["crawl_delay"] = max(0.0, float(delay))
+
+    def configure_from_robots(self, url, fetch_text):
+        """Reads Crawl-delay from the host's robots.txt once; fetch_text(robots_url) returns its text or None."""
+        parsed = urlparse(url)
+        host = parsed.netloc
+        with self._lock:
+            if host in self.robots_checked:
+                return
+            self.robots_checked.add(host)
+
+        robots_text = fetch_text(f"{parsed.scheme}://{host}/robots.txt")
+        if not robots_text:
+            return
+        delay = parse_crawl_delay(robots_text)
+        if delay:
+            print(f"Using Crawl-delay of {delay}s for {host}")
+            self.set_crawl_delay(host, delay)
+
+    def metrics(self):
+        """Returns per-host and total request and wait-time counters."""
+        with self._lock:
+            hosts = {
+                host: {key: state[key] for key in ("requests", "waits", "wait_seconds", "max_wait", "crawl_delay")}
+                for host, state in self.hosts.items()
+            }
+        return {
+            "hosts": hosts,
+            "requests": sum(host["requests"] for host in hosts.values()),
+            "waits": sum(host["waits"] for host in hosts.values()),
+            "wait_seconds": sum(host["wait_seconds"] for host in hosts.values()),
+            "max_wait": max([host["max_wait"] for host in hosts.values()] or [0.0]),
+        }
+
+    def report(self):
+        metrics = self.metrics()
+        print(f"Rate limiter: {metrics['requests']} requests, {metrics['waits']} waited {metrics['wait_seconds']:.1f}s in total (max {metrics['max_wait']:.1f}s)")
+
+
+# Function to turn a Retry-After header into seconds
+def parse_retry_after(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+# Function to read the Crawl-delay of the "User-agent: *" group; unlike urllib.robotparser it accepts fractional delays
+def parse_crawl_delay(robots_text):
+    applies = False
+    previous_was_agent = False
+    for line in robots_text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if ':' not in line:
+            continue
+        key, value = [part.strip() for part in line.split(':', 1)]
+        key = key.lower()
+        if key == 'user-agent':
+            # Consecutive User-agent lines share one group
+            applies = (applies and previous_was_agent) or value == '*'
+            previous_was_agent = True
+            continue
+        previous_was_agent = False
+        if applies and key == 'crawl-delay':
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
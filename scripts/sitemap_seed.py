@@ -0,0 +1,195 @@
+import gzip
+import io
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+from fetch_stream import READ_CHUNK_SIZE
+
+# The sitemap protocol caps a sitemap at 50 MB uncompressed and 50,000 URLs
+SITEMAP_MAX_BYTES = 50 * 1024 * 1024
+
+# Frontier priorities: the seed page first, then sitemap pages by how recently they changed; links found while crawling get 0
+SEED_PRIORITY = 5
+_RECENCY_PRIORITIES = ((timedelta(days=7), 4), (timedelta(days=30), 3), (timedelta(days=365), 2))
+_DEFAULT_PRIORITY = 1
+
+# A page listed in a sitemap; lastmod is a Unix timestamp or None
+SitemapEntry = namedtuple("SitemapEntry", ["url", "lastmod", "priority"])
+
+
+def session_fetcher(session=requests, headers=None, rate_limiter=None, timeout=30, max_bytes=SITEMAP_MAX_BYTES):
+    """Returns fetch(url) -> bytes or None for a SitemapSeeder, going through the scanner's session and rate limiter."""
+    def fetch(url):
+        if rate_limiter is not None:
+            rate_limiter.acquire(url)
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code != 200:
+                    return None
+                content = bytearray()
+                for chunk in response.iter_content(READ_CHUNK_SIZE):
+                    content += chunk
+                    if len(content) > max_bytes:
+                        print(f"Sitemap {url} is larger than {max_bytes} bytes; reading the first part only")
+                        break
+                return bytes(content)
+        except requests.RequestException as e:
+            print(f"Error fetching {url}: {e}")
+            return None
+    return fetch
+
+
+def parse_lastmod(value):
+    """Reads a W3C datetime lastmod as a Unix timestamp. A bare date counts as the end of that day, so changes during it are not missed."""
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        if len(value) == 10:
+            moment = datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc) + timedelta(days=1)
+        else:
+            moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return moment.timestamp()
+
+
+def lastmod_priority(lastmod, now=None):
+    if lastmod is None:
+        return _DEFAULT_PRIORITY
+    age = timedelta(seconds=max(0.0, (now or time.time()) - lastmod))
+    return next((priority for limit, priority in _RECENCY_PRIORITIES if age <= limit), _DEFAULT_PRIORITY)
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1].lower()
+
+
+def parse_sitemap(content):
+    """Returns (pages, sitemaps) from a sitemap, sitemap index or plain-text sitemap.
+
+    pages is a list of (url, lastmod) pairs and sitemaps lists the child sitemaps of an index.
+    Malformed XML yields whatever was read before the error.
+    """
+    if content.startswith(b"\x1f\x8b"):
+        try:
+            with gzip.GzipFile(fileobj=io.BytesIO(content)) as f:
+                content = f.read(SITEMAP_MAX_BYTES)
+        except (OSError, EOFError) as e:
+            print(f"Unreadable gzipped sitemap: {e}")
+            return [], []
+    if not content.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"<"):
+        # Plain-text sitemaps list one URL per line
+        lines = content.decode("utf-8", errors="replace").splitlines()
+        return [(line.strip(), None) for line in lines if line.strip().startswith(("http://", "https://"))], []
+
+    pages, sitemaps = [], []
+    try:
+        for _, element in ElementTree.iterparse(io.BytesIO(content), events=("end",)):
+            name = _local_name(element.tag)
+            if name not in ("url", "sitemap"):
+                continue
+            fields = {_local_name(child.tag): (child.text or "").strip() for child in element}
+            if fields.get("loc"):
+                if name == "url":
+                    pages.append((fields["loc"], parse_lastmod(fields.get("lastmod"))))
+                else:
+                    sitemaps.append(fields["loc"])
+            element.clear()
+    except ElementTree.ParseError as e:
+        print(f"Malformed sitemap ({e}); keeping {len(pages)} pages and {len(sitemaps)} sitemaps read before the error")
+    return pages, sitemaps
+
+
+class SitemapSeeder:
+    """Finds a site's pages from its robots.txt and sitemaps before the crawl starts.
+
+    `seed` reads the Sitemap: lines of robots.txt, or /sitemap.xml when there are none, follows
+    sitemap indexes up to `max_sitemaps` documents and returns the listed pages on the site that
+    robots.txt allows, most recently modified first, as SitemapEntry tuples whose priority ranks them
+    in the frontier. `allowed` applies the same robots.txt Disallow rules to links found while
+    crawling. `fetch(url)` returns a document's bytes or None, e.g. from session_fetcher.
+    """
+
+    def __init__(self, fetch, user_agent="*", max_sitemaps=50, max_urls=50000):
+        self.fetch = fetch
+        self.user_agent = user_agent
+        self.max_sitemaps = max_sitemaps
+        self.max_urls = max_urls
+        self.robots_text = None
+        self.robots = None
+        self.stats = {"sitemaps": 0, "listed": 0, "seeded": 0, "disallowed": 0, "offsite": 0, "skipped_unchanged": 0}
+        self._lock = threading.Lock()
+
+    def _read_robots(self, base_url):
+        parsed = urlparse(base_url)
+        content = self.fetch(f"{parsed.scheme}://{parsed.netloc}/robots.txt")
+        self.robots_text = content.decode("utf-8", errors="replace") if content else None
+        if self.robots_text:
+            self.robots = RobotFileParser()
+            self.robots.parse(self.robots_text.splitlines())
+            return [value.strip() for key, _, value in (line.split("#", 1)[0].partition(":") for line in self.robots_text.splitlines())
+                    if key.strip().lower() == "sitemap" and value.strip()]
+        return []
+
+    def allowed(self, url):
+        """True unless the site's robots.txt disallows the URL; everything is allowed before `seed` has read it."""
+        return self.robots is None or self.robots.can_fetch(self.user_agent, url)
+
+    def seed(self, base_url, is_valid_url=None, limit=None):
+        """Returns the pages to seed the frontier with, best first; `is_valid_url` keeps them to the crawled site."""
+        is_valid_url = is_valid_url or (lambda url: urlparse(url).netloc == urlparse(base_url).netloc)
+        pending = self._read_robots(base_url) or [urljoin(base_url, "/sitemap.xml")]
+        seen_sitemaps = set()
+        listed = {}
+        while pending and len(seen_sitemaps) < self.max_sitemaps and len(listed) < self.max_urls:
+            sitemap_url = pending.pop(0)
+            if sitemap_url in seen_sitemaps:
+                continue
+            seen_sitemaps.add(sitemap_url)
+            content = self.fetch(sitemap_url)
+            if not content:
+                continue
+            pages, sitemaps = parse_sitemap(content)
+            pending.extend(sitemaps)
+            self.stats["sitemaps"] += 1
+            for url, lastmod in pages[:self.max_urls - len(listed)]:
+                # The same page can be listed by several sitemaps; keep its latest date
+                if url not in listed or (lastmod or 0) > (listed[url] or 0):
+                    listed[url] = lastmod
+
+        entries = []
+        now = time.time()
+        for url, lastmod in listed.items():
+            if not self.allowed(url):
+                self.stats["disallowed"] += 1
+            elif not is_valid_url(url):
+                self.stats["offsite"] += 1
+            else:
+                entries.append(SitemapEntry(url, lastmod, lastmod_priority(lastmod, now)))
+        entries.sort(key=lambda entry: (entry.priority, entry.lastmod or 0), reverse=True)
+        if limit is not None:
+            entries = entries[:limit]
+        self.stats["listed"] = len(listed)
+        self.stats["seeded"] = len(entries)
+        return entries
+
+    def count_unchanged(self):
+        with self._lock:
+            self.stats["skipped_unchanged"] += 1
+
+    def report(self, site=""):
+        stats = dict(self.stats)
+        if not stats["sitemaps"]:
+            return
+        print(f"Sitemaps{' for ' + site if site else ''}: {stats['listed']} pages listed in {stats['sitemaps']} sitemaps, {stats['seeded']} seeded, "
+              f"{stats['disallowed']} disallowed by robots.txt, {stats['offsite']} off-site, {stats['skipped_unchanged']} skipped as unchanged since their lastmod")
@@ -0,0 +1,132 @@
+import collections
+import concurrent.futures
+import queue
+import random
+import threading
+import time
+
+
+class UploadQueue:
+    """Bounded queue of object uploads drained by a pool of worker threads.
+
+    Crawler threads `put` an object and carry on; the workers write it to `storage` (a
+    storage_backend.StorageBackend) with exponential backoff and jitter. The queue holds at most
+    `max_queue` objects, so a slow object store slows the crawl down instead of buffering unbounded
+    memory. `flush` waits for everything queued so far and `close` drains the queue and stops the
+    workers.
+    """
+
+    def __init__(self, storage, workers=8, max_queue=1000, max_retries=5, base_delay=1.0, latency_window=10000):
+        self.storage = storage
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+
+        self.uploaded = 0
+        self.failed = 0
+        self.retries = 0
+        self.bytes = 0
+        self.max_depth = 0
+        self.latencies = collections.deque(maxlen=latency_window)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._workers = [threading.Thread(target=self._run, name=f"upload-{i}", daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def put(self, name, data, content_type="application/json", on_error=None, metrics=None):
+        """Queues an upload and returns a Future that resolves once it is stored; blocks while the queue is full.
+
+        With a CrawlMetrics, the upload's time and bytes are recorded there, so scanners sharing the queue keep their own figures.
+        They are recorded before the Future resolves, so a scanner that has waited on its Futures can export complete figures.
+        """
+        if self._closed:
+            raise RuntimeError("UploadQueue is closed")
+        future = concurrent.futures.Future()
+        if on_error is not None:
+            future.add_done_callback(lambda f: on_error(name, f.exception()) if f.exception() else None)
+        self._queue.put((name, data, content_type, future, metrics))
+        with self._lock:
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        return future
+
+    def _upload(self, name, data, content_type):
+        for attempt in range(self.max_retries):
+            try:
+                self.storage.put(name, data, content_type)
+                return
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                wait_time = self.base_delay * (2 ** attempt) + random.uniform(0, 1)
+                with self._lock:
+                    self.retries += 1
+                print(f"Upload of {name} failed ({e}). Retrying in {wait_time:.2f} seconds...")
+                time.sleep(wait_time)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                name, data, content_type, future, metrics = item
+                start = time.perf_counter()
+                try:
+                    self._upload(name, data, content_type)
+                except Exception as e:
+                    print(f"Failed to upload {name} after {self.max_retries} attempts: {e}")
+                    with self._lock:
+                        self.failed += 1
+                    if metrics is not None:
+                        metrics.inc("upload_errors")
+                    future.set_exception(e)
+                    continue
+                latency = time.perf_counter() - start
+                with self._lock:
+                    self.uploaded += 1
+                    self.bytes += len(data)
+                    self.latencies.append(latency)
+                if metrics is not None:
+                    metrics.observe("upload", latency)
+                    metrics.inc("upload_bytes", len(data))
+                future.set_result(name)
+            finally:
+                self._queue.task_done()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        """Blocks until every upload queued so far has finished or failed."""
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            metrics = {
+                "uploaded": self.uploaded,
+                "failed": self.failed,
+                "retries": self.retries,
+                "bytes": self.bytes,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self.max_depth,
+            }
+        metrics["latency_avg"] = sum(latencies) / len(latencies) if latencies else 0.0
+        metrics["latency_p95"] = latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0
+        metrics["latency_max"] = latencies[-1] if latencies else 0.0
+        return metrics
+
+    def report(self):
+        metrics = self.metrics()
+        print(f"Uploads: {metrics['uploaded']} stored ({metrics['bytes'] / 1e6:.1f} MB), {metrics['failed']} failed, {metrics['retries']} retries, "
+              f"latency avg {metrics['latency_avg'] * 1000:.0f} ms / p95 {metrics['latency_p95'] * 1000:.0f} ms, max queue depth {metrics['max_queue_depth']}")
@@ -0,0 +1,149 @@
+import re
+import threading
+from urllib.parse import unquote, urlsplit, urlunsplit
+
+# Query parameters that never change a page's content: campaign tracking, click IDs and session IDs.
+# A trailing * matches any parameter starting with the prefix.
+DEFAULT_STRIP_PARAMS = (
+    "utm_*", "gclid", "gclsrc", "dclid", "fbclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl", "_hsenc", "_hsmi",
+    "hsctatracking", "mkt_tok", "vero_id", "sessionid", "session_id", "sid", "phpsessid", "jsessionid", "aspsessionid*", "cfid", "cftoken",
+    "replytocom", "share", "amp",
+)
+
+# Directory index files that serve the same page as the directory itself
+_INDEX_FILES = ("index.html", "index.htm", "index.php", "index.asp", "default.asp", "default.aspx")
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+# ;jsessionid=... and similar session IDs embedded in the path
+_PATH_SESSION_PATTERN = re.compile(r";(?:jsessionid|phpsessid|sid|sessionid)=[^/?#]*", re.IGNORECASE)
+
+
+def _param_matcher(strip_params):
+    exact = {param.lower() for param in strip_params if not param.endswith("*")}
+    prefixes = tuple(param[:-1].lower() for param in strip_params if param.endswith("*"))
+    return lambda name: name in exact or name.startswith(prefixes)
+
+
+_default_matcher = _param_matcher(DEFAULT_STRIP_PARAMS)
+
+
+def clean_url(url, strip_params=None):
+    """Returns the URL as it should be fetched: no fragment, tracking or session parameters, default port or host case.
+
+    Only changes that cannot alter the response are made; the query keeps its order and encoding.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS:
+        return url
+    is_stripped = _param_matcher(strip_params) if strip_params is not None else _default_matcher
+
+    host = parts.hostname or ""
+    if ":" in host:
+        host = f"[{host}]"
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = f"{host}:{port}" if port and port != _DEFAULT_PORTS[scheme] else host
+
+    path = _PATH_SESSION_PATTERN.sub("", parts.path) or "/"
+    pairs = [pair for pair in parts.query.split("&") if pair and not is_stripped(unquote(pair.split("=", 1)[0]).lower())]
+    return urlunsplit((scheme, netloc, path, "&".join(pairs), ""))
+
+
+def site_host(url):
+    """The URL's host without a leading www., for comparing sites."""
+    host = (urlsplit(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def url_key(url, strip_params=None):
+    """Key under which URLs serving the same page compare equal.
+
+    On top of clean_url it ignores http vs https, a www. prefix, a trailing slash, a directory
+    index file and the order of query parameters. It is only used for deduplication; pages are
+    fetched at the URL they were first found at.
+    """
+    cleaned = clean_url(url, strip_params)
+    parts = urlsplit(cleaned)
+    if parts.scheme not in _DEFAULT_PORTS:
+        return cleaned
+    netloc = parts.netloc[4:] if parts.netloc.startswith("www.") else parts.netloc
+    path = parts.path
+    directory, _, filename = path.rpartition("/")
+    if filename.lower() in _INDEX_FILES:
+        path = directory + "/"
+    path = path.rstrip("/") or "/"
+    query = "&".join(sorted(parts.query.split("&"))) if parts.query else ""
+    return f"{netloc}{path}?{query}" if query else f"{netloc}{path}"
+
+
+class URLCanonicalizer:
+    """Per-site record of the pages already queued, by canonical key, so URL variants are fetched once.
+
+    `filter` drops links whose key was seen before, under any spelling. `redirected` and
+    `canonical` record where a fetched URL actually lives, after a redirect or according to the
+    page's rel=canonical link, and say when that page has already been crawled under another URL.
+    """
+
+    def __init__(self, strip_params=None):
+        self.strip_params = strip_params
+        self.stats = {"links": 0, "duplicate_links": 0, "redirect_duplicates": 0, "canonical_duplicates": 0}
+        self._urls = {}
+        self._lock = threading.Lock()
+
+    def key(self, url):
+        return url_key(url, self.strip_params)
+
+    def filter(self, urls):
+        """Returns the cleaned URLs whose pages were not seen before, in order."""
+        admitted = []
+        with self._lock:
+            for url in urls:
+                cleaned = clean_url(url, self.strip_params)
+                key = url_key(cleaned, self.strip_params)
+                self.stats["links"] += 1
+                first = self._urls.get(key)
+                if first is None:
+                    self._urls[key] = cleaned
+                    admitted.append(cleaned)
+                elif first != cleaned:
+                    # The same page under a different spelling: one fetch avoided
+                    self.stats["duplicate_links"] += 1
+        return admitted
+
+    def _alias(self, url, target, stat):
+        key = self.key(url)
+        target_key = self.key(target)
+        if target_key == key:
+            return False
+        with self._lock:
+            if target_key in self._urls:
+                self.stats[stat] += 1
+                return True
+            self._urls[target_key] = url
+        return False
+
+    def redirected(self, url, final_url):
+        """Records a redirect; True when the target page was already queued or crawled, so this response can be dropped."""
+        return self._alias(url, final_url, "redirect_duplicates")
+
+    def canonical(self, url, canonical_url):
+        """Records a page's rel=canonical URL; True when the canonical page is queued or crawled already."""
+        if urlsplit(canonical_url).path in ("", "/") and urlsplit(url).path not in ("", "/"):
+            # Some sites put their home page in every page's canonical link
+            return False
+        return self._alias(url, canonical_url, "canonical_duplicates")
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["fetches_avoided"] = stats["duplicate_links"] + stats["redirect_duplicates"] + stats["canonical_duplicates"]
+        return stats
+
+    def report(self, site=""):
+        stats = self.summary()
+        print(f"URL canonicalization{' for ' + site if site else ''}: {stats['fetches_avoided']} duplicate pages avoided "
+              f"({stats['duplicate_links']} URL variants, {stats['redirect_duplicates']} redirects, {stats['canonical_duplicates']} rel=canonical) "
+              f"out of {stats['links']} links")
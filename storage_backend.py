@@ -0,0 +1,312 @@
+import abc
+import concurrent.futures
+import itertools
+import os
+import threading
+from collections import namedtuple
+
+# What list() and stat() return for an object; generation changes every time the object is written
+ObjectInfo = namedtuple("ObjectInfo", ["name", "generation", "size"])
+
+
+class ObjectNotFound(KeyError):
+    pass
+
+
+class PreconditionFailed(Exception):
+    """Raised by put() when if_generation_match does not match the object's current generation."""
+
+
+class StorageBackend(abc.ABC):
+    """Object store used for chunk blobs, shards, manifests and feedback.
+
+    Implementations must provide list, stat, get, put and delete, and may override get_range with a
+    ranged read; bulk reads and writes run those in a thread pool. Generations follow GCS semantics: if_generation_match=0 means the
+    object must not exist yet.
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def list(self, prefix=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def stat(self, name):
+        """Returns the object's ObjectInfo, or None if it does not exist."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get(self, name):
+        raise NotImplementedError
+
+    def get_range(self, name, start, end=None):
+        """Returns bytes [start, end) of an object."""
+        return self.get(name)[start:end]
+
+    @abc.abstractmethod
+    def put(self, name, data, content_type=None, if_generation_match=None):
+        """Writes an object and returns its new generation."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, name):
+        raise NotImplementedError
+
+    def exists(self, name):
+        return self.stat(name) is not None
+
+    def get_text(self, name, encoding="utf-8"):
+        return self.get(name).decode(encoding)
+
+    def get_many(self, names, max_workers=16):
+        """Downloads objects in parallel; yields (name, bytes) in order, with the exception in place of bytes on failure."""
+        def fetch(name):
+            try:
+                return name, self.get(name)
+            except Exception as e:
+                return name, e
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            yield from executor.map(fetch, names)
+
+    def put_many(self, items, content_type=None, max_workers=16):
+        """Uploads (name, data) pairs in parallel and returns their generations."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda item: self.put(item[0], item[1], content_type), items))
+
+    def health(self):
+        return True
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name})"
+
+
+class GCSStorage(StorageBackend):
+    """A Google Cloud Storage bucket."""
+
+    def __init__(self, bucket):
+        from google.api_core import exceptions
+
+        self.bucket = bucket
+        self.name = bucket.name
+        self._exceptions = exceptions
+
+    @classmethod
+    def from_credentials(cls, bucket_name, credentials_info=None, credentials_path=None):
+        from google.cloud import storage
+        from google.oauth2 import service_account
+
+        if credentials_path:
+            credentials = service_account.Credentials.from_service_account_file(credentials_path)
+        elif credentials_info:
+            credentials = service_account.Credentials.from_service_account_info(credentials_info)
+        else:
+            credentials = None
+        return cls(storage.Client(credentials=credentials).bucket(bucket_name))
+
+    def list(self, prefix=None):
+        for blob in self.bucket.list_blobs(prefix=prefix):
+            yield ObjectInfo(blob.name, blob.generation, blob.size)
+
+    def stat(self, name):
+        blob = self.bucket.get_blob(name)
+        return ObjectInfo(blob.name, blob.generation, blob.size) if blob is not None else None
+
+    def get(self, name):
+        try:
+            return self.bucket.blob(name).download_as_bytes()
+        except self._exceptions.NotFound:
+            raise ObjectNotFound(name)
+
+    def get_range(self, name, start, end=None):
+        try:
+            # GCS ranges are inclusive at the end
+            return self.bucket.blob(name).download_as_bytes(start=start, end=end - 1 if end is not None else None)
+        except self._exceptions.NotFound:
+            raise ObjectNotFound(name)
+
+    def put(self, name, data, content_type=None, if_generation_match=None):
+        blob = self.bucket.blob(name)
+        try:
+            blob.upload_from_string(data, content_type=content_type or "application/octet-stream", if_generation_match=if_generation_match)
+        except self._exceptions.PreconditionFailed:
+            raise PreconditionFailed(name)
+        return blob.generation
+
+    def delete(self, name):
+        try:
+            self.bucket.blob(name).delete()
+        except self._exceptions.NotFound:
+            raise ObjectNotFound(name)
+
+    def health(self):
+        return self.bucket.exists()
+
+
+class LocalStorage(StorageBackend):
+    """Objects stored as files under a root directory; names containing '/' become subdirectories.
+
+    The generation is the file's modification time in nanoseconds. Conditional puts are atomic
+    within one process only.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.name = os.path.basename(os.path.normpath(root))
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name):
+        path = os.path.normpath(os.path.join(self.root, name))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Object name escapes the storage root: {name}")
+        return path
+
+    def _info(self, name, path):
+        stat = os.stat(path)
+        return ObjectInfo(name, stat.st_mtime_ns, stat.st_size)
+
+    def list(self, prefix=None):
+        names = []
+        for directory, _, files in os.walk(self.root):
+            for filename in files:
+                if filename.endswith(".tmp"):
+                    continue
+                name = os.path.relpath(os.path.join(directory, filename), self.root).replace(os.sep, "/")
+                if prefix is None or name.startswith(prefix):
+                    names.append(name)
+        # GCS lists in lexicographic order, so listings match across backends
+        for name in sorted(names):
+            try:
+                yield self._info(name, self._path(name))
+            except FileNotFoundError:
+                continue
+
+    def stat(self, name):
+        try:
+            return self._info(name, self._path(name))
+        except FileNotFoundError:
+            return None
+
+    def get(self, name):
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ObjectNotFound(name)
+
+    def get_range(self, name, start, end=None):
+        try:
+            with open(self._path(name), "rb") as f:
+                f.seek(start)
+                return f.read(-1 if end is None else max(0, end - start))
+        except FileNotFoundError:
+            raise ObjectNotFound(name)
+
+    def put(self, name, data, content_type=None, if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            current = self.stat(name)
+            if if_generation_match is not None and (current.generation if current else 0) != if_generation_match:
+                raise PreconditionFailed(name)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            generation = os.stat(path).st_mtime_ns
+            # Coarse filesystem clocks could repeat a generation; make sure every write moves it forward
+            if current is not None and generation <= current.generation:
+                generation = current.generation + 1
+                os.utime(path, ns=(generation, generation))
+            return generation
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            raise ObjectNotFound(name)
+
+    def health(self):
+        return os.path.isdir(self.root)
+
+
+class MemoryStorage(StorageBackend):
+    """Objects kept in a dict, for tests and load tests that should not touch disk or network."""
+
+    _generations = itertools.count(1)
+
+    def __init__(self, name="memory"):
+        self.name = name
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def list(self, prefix=None):
+        with self._lock:
+            items = sorted(self._objects.items())
+        for name, (data, generation) in items:
+            if prefix is None or name.startswith(prefix):
+                yield ObjectInfo(name, generation, len(data))
+
+    def stat(self, name):
+        with self._lock:
+            if name not in self._objects:
+                return None
+            data, generation = self._objects[name]
+            return ObjectInfo(name, generation, len(data))
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._objects:
+                raise ObjectNotFound(name)
+            return self._objects[name][0]
+
+    def put(self, name, data, content_type=None, if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._lock:
+            current = self._objects.get(name)
+            if if_generation_match is not None and (current[1] if current else 0) != if_generation_match:
+                raise PreconditionFailed(name)
+            generation = next(self._generations)
+            self._objects[name] = (bytes(data), generation)
+            return generation
+
+    def delete(self, name):
+        with self._lock:
+            if self._objects.pop(name, None) is None:
+                raise ObjectNotFound(name)
+
+
+# Memory stores are shared by name within a process, like buckets
+_memory_stores = {}
+_memory_lock = threading.Lock()
+
+
+def memory_storage(name):
+    with _memory_lock:
+        if name not in _memory_stores:
+            _memory_stores[name] = MemoryStorage(name)
+        return _memory_stores[name]
+
+
+def storage_from_env(bucket_name, credentials_info=None, credentials_path=None):
+    """Returns the storage for a bucket name, selected by STORAGE_BACKEND (gcs, local or memory).
+
+    local keeps each bucket in a directory under STORAGE_ROOT (default local_storage). For gcs,
+    credentials_info may be a service account dict or a function returning one, so callers that
+    read it from secrets only do so when GCS is actually used.
+    """
+    backend = os.environ.get("STORAGE_BACKEND", "gcs").lower()
+    if backend == "local":
+        return LocalStorage(os.path.join(os.environ.get("STORAGE_ROOT", "local_storage"), bucket_name))
+    if backend == "memory":
+        return memory_storage(bucket_name)
+    if backend != "gcs":
+        raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected gcs, local or memory")
+    if callable(credentials_info):
+        credentials_info = credentials_info()
+    return GCSStorage.from_credentials(bucket_name, credentials_info=credentials_info, credentials_path=credentials_path)
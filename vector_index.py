@@ -0,0 +1,310 @@
+import argparse
+import concurrent.futures
+import functools
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+from chunk_shards import SHARD_PREFIX, load_shards
+from scoring import batch_top_k, normalize_rows, top_k as top_k_rows
+from storage_backend import storage_from_env
+
+# Files that make up an index snapshot on disk
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.json"
+MANIFEST_FILE = "manifest.json"
+# Pointer to the snapshot's current version directory, swapped in a single os.replace
+CURRENT_FILE = "CURRENT"
+VERSION_PREFIX = "v-"
+
+
+class VectorIndex:
+    """Local copy of the chunk corpus: chunk texts plus a packed, row-normalized float32 embedding matrix."""
+
+    def __init__(self, texts, urls, blob_names, embeddings, generations=None, version=None, normalized=False):
+        self.texts = texts
+        self.urls = urls
+        self.blob_names = blob_names
+        # Embeddings are stored unit length so cosine similarity is a single matrix product
+        self.embeddings = embeddings if normalized else normalize_rows(embeddings).reshape(len(texts), -1)
+        self.generations = generations if generations is not None else [None] * len(texts)
+        self.version = version or compute_version(blob_names, self.generations)
+        # Version directory the index was saved to or loaded from
+        self.path = None
+        self.ann = None
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def dim(self):
+        return self.embeddings.shape[1] if self.embeddings.ndim == 2 else 0
+
+    @classmethod
+    def build_from_storage(cls, storage, max_workers=16, max_blobs=None):
+        """Downloads every chunk blob, and the live rows of the shards in the shard manifest, once and packs them into an index."""
+        objects = []
+        for info in storage.list():
+            # Shards are read through their manifest, which leaves out orphaned and superseded rows
+            if info.name.startswith(SHARD_PREFIX):
+                continue
+            objects.append(info)
+            if max_blobs and len(objects) >= max_blobs:
+                break
+
+        records = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for blob_records in executor.map(functools.partial(download_chunk_records, storage), objects):
+                records.extend(blob_records)
+        records.extend(load_shards(storage, max_workers=max_workers))
+        return cls.from_records(records)
+
+    @classmethod
+    def from_records(cls, records):
+        """Packs chunk records (dicts with name, generation, url, text, embeddings) into an index."""
+        # Drop chunks whose embedding width disagrees with the majority of the corpus
+        if records:
+            widths = [len(record["embeddings"]) for record in records]
+            dim = max(set(widths), key=widths.count)
+            records = [record for record in records if len(record["embeddings"]) == dim]
+        else:
+            dim = 0
+
+        embeddings = np.asarray([record["embeddings"] for record in records], dtype=np.float32).reshape(len(records), dim)
+        return cls(
+            texts=[record["text"] for record in records],
+            urls=[record["url"] for record in records],
+            blob_names=[record["name"] for record in records],
+            embeddings=embeddings,
+            generations=[record.get("generation") for record in records],
+        )
+
+    def with_changes(self, records, removed_blobs=()):
+        """Returns a new index with the chunks of removed_blobs dropped and the given records added.
+
+        Every chunk that came from the blob of a new record is replaced, which also covers shards that
+        hold many chunks. removed_blobs may also name single shard rows (<shard blob>#<row>). The
+        current index is left untouched so searches running against it are never disturbed.
+        """
+        replaced = set(removed_blobs) | {source_blob(record["name"]) for record in records}
+        keep = [i for i, name in enumerate(self.blob_names) if source_blob(name) not in replaced and name not in replaced]
+        if self.dim:
+            records = [record for record in records if len(record["embeddings"]) == self.dim]
+        elif records:
+            return VectorIndex.from_records(records)
+
+        new_embeddings = normalize_rows(np.asarray([record["embeddings"] for record in records], dtype=np.float32).reshape(len(records), self.dim))
+        return VectorIndex(
+            texts=[self.texts[i] for i in keep] + [record["text"] for record in records],
+            urls=[self.urls[i] for i in keep] + [record["url"] for record in records],
+            blob_names=[self.blob_names[i] for i in keep] + [record["name"] for record in records],
+            embeddings=np.concatenate([np.asarray(self.embeddings[keep], dtype=np.float32), new_embeddings]),
+            generations=[self.generations[i] for i in keep] + [record.get("generation") for record in records],
+            normalized=True,
+        )
+
+    def save(self, snapshot_dir, keep_versions=3):
+        """Writes the index to a new version directory under snapshot_dir and points CURRENT at it.
+
+        Files of a published version are never rewritten, so a reader always sees one consistent
+        snapshot, and concurrent writers each publish their own directory. Older versions beyond
+        `keep_versions` are removed. Returns the version directory.
+        """
+        path = os.path.join(snapshot_dir, f"{VERSION_PREFIX}{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(path)
+
+        with open(os.path.join(path, EMBEDDINGS_FILE), "wb") as f:
+            np.save(f, np.ascontiguousarray(self.embeddings, dtype=np.float32))
+
+        chunks = {
+            "texts": self.texts,
+            "urls": self.urls,
+            "blob_names": self.blob_names,
+            "generations": self.generations,
+        }
+        with open(os.path.join(path, CHUNKS_FILE), "w", encoding="utf-8") as f:
+            json.dump(chunks, f)
+
+        manifest = {
+            "version": self.version,
+            "count": len(self),
+            "dim": self.dim,
+            "normalized": True,
+            "created": time.time(),
+        }
+        with open(os.path.join(path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+        _write_text_atomic(os.path.join(snapshot_dir, CURRENT_FILE), os.path.basename(path))
+        self.path = path
+        prune_versions(snapshot_dir, keep_versions)
+        return path
+
+    @classmethod
+    def load(cls, snapshot_dir, mmap=True):
+        """Loads the current version of a snapshot, memory-mapping the embedding matrix by default."""
+        path = snapshot_path(snapshot_dir)
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        with open(os.path.join(path, CHUNKS_FILE), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r" if mmap else None)
+        index = cls(
+            texts=chunks["texts"],
+            urls=chunks["urls"],
+            blob_names=chunks["blob_names"],
+            embeddings=embeddings,
+            generations=chunks.get("generations"),
+            version=manifest.get("version"),
+            normalized=manifest.get("normalized", False),
+        )
+        index.path = path
+        return index
+
+    def enable_ann(self, kind, snapshot_dir=None, **params):
+        """Routes searches through a faiss ANN index (flat, ivf or hnsw), persisted next to the snapshot."""
+        from ann_index import load_or_build_ann_index
+
+        # The ANN index lives in the version directory it was built from
+        if snapshot_dir is not None:
+            snapshot_dir = self.path or snapshot_path(snapshot_dir)
+        self.ann = load_or_build_ann_index(self.embeddings, snapshot_dir, kind, version=self.version, **params)
+        return self.ann
+
+    def search(self, query_vector, top_k=100):
+        """Returns (index, similarity) pairs for the chunks most similar to the query vector."""
+        if not len(self):
+            return []
+        if self.ann is not None:
+            indices, scores = self.ann.search(normalize_rows(query_vector), top_k)[0]
+        else:
+            indices, scores = top_k_rows(self.embeddings, normalize_rows(query_vector), top_k)
+        return [(int(i), float(score)) for i, score in zip(indices, scores)]
+
+    def search_batch(self, query_vectors, top_k=100):
+        """Scores several query vectors in one matrix-matrix product; returns one result list per query."""
+        if not len(self):
+            return [[] for _ in query_vectors]
+        if self.ann is not None:
+            results = self.ann.search(normalize_rows(query_vectors), top_k)
+        else:
+            results = batch_top_k(self.embeddings, normalize_rows(query_vectors), top_k)
+        return [[(int(i), float(score)) for i, score in zip(indices, scores)] for indices, scores in results]
+
+
+# Function to download and parse a JSON chunk blob into index records
+def download_chunk_records(storage, info):
+    try:
+        data = json.loads(storage.get_text(info.name))
+    except (json.JSONDecodeError, UnicodeDecodeError, ValueError):
+        print(f"Skipping non-chunk blob: {info.name}")
+        return []
+    except Exception as e:
+        print(f"Error downloading blob {info.name}: {str(e)}")
+        return []
+
+    text = data.get("body_text", "") if isinstance(data, dict) else ""
+    embeddings = data.get("embeddings", []) if isinstance(data, dict) else []
+    if not text.strip() or not embeddings:
+        return []
+    return [{
+        "name": info.name,
+        "generation": info.generation,
+        "url": data.get("url", ""),
+        "text": text,
+        "embeddings": embeddings,
+    }]
+
+
+# Function to get the blob a record came from; shard records are named <shard blob>#<row>
+def source_blob(name):
+    return name.split("#", 1)[0]
+
+
+# Function to derive a snapshot version from the blobs it was built from
+def compute_version(blob_names, generations):
+    digest = hashlib.md5()
+    for name, generation in sorted(zip(blob_names, generations), key=lambda item: item[0]):
+        digest.update(f"{name}:{generation}\n".encode())
+    return digest.hexdigest()
+
+
+# Function to get the directory holding a snapshot's current files; snapshots saved before versioning keep them in snapshot_dir itself
+def snapshot_path(snapshot_dir):
+    try:
+        with open(os.path.join(snapshot_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return os.path.join(snapshot_dir, f.read().strip())
+    except FileNotFoundError:
+        return snapshot_dir
+
+
+# Function to remove all but the newest keep_versions version directories, never the current one
+def prune_versions(snapshot_dir, keep_versions=3):
+    current = os.path.basename(snapshot_path(snapshot_dir))
+    versions = sorted(name for name in os.listdir(snapshot_dir) if name.startswith(VERSION_PREFIX))
+    for name in versions[:-keep_versions] if keep_versions else versions:
+        if name != current:
+            # A reader may still have the files open or mapped; they are retried on the next save
+            shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+
+def _write_text_atomic(path, text):
+    # Each writer gets its own temporary file, so concurrent writers never write into the same one
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def load_or_build_index(storage, snapshot_dir, backend="exact", **ann_params):
+    """Memory-maps the snapshot in snapshot_dir, building it from storage first if it does not exist yet.
+
+    backend is "exact" for brute-force scoring or one of "flat", "ivf", "hnsw" for a faiss index.
+    """
+    if not os.path.exists(os.path.join(snapshot_path(snapshot_dir), MANIFEST_FILE)):
+        print(f"No index snapshot in {snapshot_dir}. Building from {storage!r}...")
+        index = VectorIndex.build_from_storage(storage)
+        index.save(snapshot_dir)
+
+    index = VectorIndex.load(snapshot_dir)
+    if backend != "exact" and len(index):
+        index.enable_ann(backend, snapshot_dir, **ann_params)
+    return index
+
+
+# Function to read the retrieval backend settings from the environment
+def retrieval_settings_from_env():
+    settings = {"backend": os.environ.get("RETRIEVAL_BACKEND", "exact")}
+    if os.environ.get("ANN_NPROBE"):
+        settings["nprobe"] = int(os.environ["ANN_NPROBE"])
+    if os.environ.get("ANN_EF_SEARCH"):
+        settings["ef_search"] = int(os.environ["ANN_EF_SEARCH"])
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a local vector index snapshot from a bucket (STORAGE_BACKEND selects GCS, local or memory storage).")
+    parser.add_argument("bucket_name")
+    parser.add_argument("credentials_path", nargs="?", default=None, help="Path to your service account JSON file (GCS only)")
+    parser.add_argument("--out", default=None, help="Snapshot directory (default: index_snapshots/<bucket_name>)")
+    parser.add_argument("--ann", choices=["flat", "ivf", "hnsw"], default=None, help="Also build and persist a faiss index")
+    args = parser.parse_args()
+
+    storage = storage_from_env(args.bucket_name, credentials_path=args.credentials_path)
+
+    start = time.time()
+    index = VectorIndex.build_from_storage(storage)
+    snapshot_dir = args.out or os.path.join("index_snapshots", args.bucket_name)
+    index.save(snapshot_dir)
+    if args.ann:
+        index.enable_ann(args.ann, snapshot_dir)
+    print(f"Saved {len(index)} chunks ({index.dim} dims) to {snapshot_dir} in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()